@@ -1,34 +1,136 @@
 import os
-from flask import Flask, render_template
-from modules.accounts_receivable.routes import accounts_receivable_bp
-from modules.cash_and_banks.routes import cash_and_banks_bp
-from modules.product_catalog.routes import product_catalog_bp
-# Correctly import IMAGE_UPLOAD_FOLDER from the models file where it's defined
-from modules.product_catalog.models import IMAGE_UPLOAD_FOLDER
-
-app = Flask(__name__)
-app.secret_key = 'your_secret_key' # Needed for flash messages
-
-# Configure upload folder for product images
-# Ensure the path is absolute or correctly relative to the app root.
-# os.path.join(app.root_path, IMAGE_UPLOAD_FOLDER) is robust.
-# IMAGE_UPLOAD_FOLDER is 'static/uploads/products/'
-# app.root_path is the directory where app.py is.
-app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, IMAGE_UPLOAD_FOLDER)
-# Ensure the directory exists (routes.py also does this, but good to have)
-if not os.path.exists(app.config['UPLOAD_FOLDER']):
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
-
-# Register Blueprints
-app.register_blueprint(accounts_receivable_bp, url_prefix='/accounts_receivable')
-app.register_blueprint(cash_and_banks_bp, url_prefix='/cash_and_banks')
-app.register_blueprint(product_catalog_bp, url_prefix='/products')
-
-
-@app.route('/')
-def index():
-    return render_template('index.html')
+from flask import Flask, render_template, jsonify
+from modules import startup
+
+
+def create_app(config=None):
+    """Build the Flask app; ``config`` overrides the defaults and the environment.
+
+    Data files are not read here: each collection loads on first use, or in
+    the background warm-up once a worker starts serving (see
+    ``modules.startup``). How long each step took is served at ``/_startup``.
+    """
+    with startup.phase('create_app'):
+        with startup.phase('import_modules'):
+            # Imported here, not at the top, so their cost shows in the report
+            from modules.accounts_receivable.routes import accounts_receivable_bp
+            from modules.cash_and_banks.routes import cash_and_banks_bp
+            from modules.product_catalog.routes import product_catalog_bp
+            from modules.imports.routes import imports_bp
+            from modules.api.routes import api_bp
+            # Correctly import IMAGE_UPLOAD_FOLDER from the models file where it's defined
+            from modules.product_catalog.models import IMAGE_UPLOAD_FOLDER
+            from modules.storage import cache_stats, configure as configure_storage
+            from modules.http_cache import add_immutable_cache_headers, build_id
+            from modules.money import format_cents
+            from modules.instrumentation.web import init_app as init_instrumentation
+            from modules.storage.cli import storage_cli
+            from modules.cash_and_banks.cli import cash_cli
+            from modules.accounts_receivable.cli import ar_cli
+            from modules.product_catalog.cli import products_cli
+            from modules.imports.cli import import_cli
+
+        with startup.phase('configure'):
+            app = Flask(__name__)
+            app.secret_key = 'your_secret_key' # Needed for flash messages
+
+            # Storage backend: 'json' (the default data files) or 'sqlite'. Can be set
+            # from the environment, e.g. FLASK_STORAGE_BACKEND=sqlite.
+            app.config['STORAGE_BACKEND'] = 'json'
+            app.config['SQLITE_DATABASE'] = 'erp.sqlite3'
+            # 'columnar' writes compact binary snapshots of the ledgers (cash and banks,
+            # accounts receivable) instead of JSON; see `flask storage convert`.
+            app.config['SNAPSHOT_FORMAT'] = 'json'
+            # Group commit: writes from concurrent requests are queued and written by
+            # one thread, up to GROUP_COMMIT_MAX_BATCH at a time, with one fsync per
+            # batch. Writes arriving during a flush form the next batch; a batch can
+            # also wait up to GROUP_COMMIT_MAX_DELAY_MS for more, which only pays off
+            # when fsync is fast next to the request rate. E.g. FLASK_GROUP_COMMIT=true
+            # for tills posting in bursts.
+            app.config['GROUP_COMMIT'] = False
+            app.config['GROUP_COMMIT_MAX_BATCH'] = 64
+            app.config['GROUP_COMMIT_MAX_DELAY_MS'] = 0
+            # Opt-in request instrumentation: per-phase timings in a Server-Timing
+            # header and Prometheus metrics at /metrics. PROFILE_SLOW_REQUESTS_MS turns
+            # it on too and keeps cProfile dumps of slower requests in PROFILE_DIR.
+            # E.g. FLASK_INSTRUMENTATION=true FLASK_PROFILE_SLOW_REQUESTS_MS=500
+            app.config['INSTRUMENTATION'] = False
+            app.config['PROFILE_SLOW_REQUESTS_MS'] = None
+            app.config['PROFILE_SAMPLE_RATE'] = 1.0
+            app.config['PROFILE_DIR'] = 'profiles'
+            # Load every collection in a background thread when a worker starts
+            # serving, instead of on the first request that needs it.
+            app.config['WARM_UP'] = True
+            # Part of the ETags of cached pages, so browsers don't keep pages rendered
+            # by a previous deploy. Defaults to the newest modification time of the
+            # code, templates and static files; set it (e.g. FLASK_BUILD_ID=<git sha>)
+            # when a deploy doesn't update them.
+            app.config['BUILD_ID'] = None
+            app.config.from_prefixed_env()
+            if config:
+                app.config.update(config)
+            if not app.config['BUILD_ID']:
+                app.config['BUILD_ID'] = build_id(app.root_path)
+            configure_storage(app.config['STORAGE_BACKEND'], app.config['SQLITE_DATABASE'],
+                              app.config['SNAPSHOT_FORMAT'],
+                              group_commit=app.config['GROUP_COMMIT'] and {
+                                  'max_batch': app.config['GROUP_COMMIT_MAX_BATCH'],
+                                  'max_delay': app.config['GROUP_COMMIT_MAX_DELAY_MS'] / 1000})
+
+            # Configure upload folder for product images
+            # Ensure the path is absolute or correctly relative to the app root.
+            # os.path.join(app.root_path, IMAGE_UPLOAD_FOLDER) is robust.
+            # IMAGE_UPLOAD_FOLDER is 'static/uploads/products/'
+            # app.root_path is the directory where app.py is.
+            app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, IMAGE_UPLOAD_FOLDER)
+            # Ensure the directory exists (routes.py also does this, but good to have)
+            if not os.path.exists(app.config['UPLOAD_FOLDER']):
+                os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+        with startup.phase('register'):
+            # Register Blueprints
+            app.register_blueprint(accounts_receivable_bp, url_prefix='/accounts_receivable')
+            app.register_blueprint(cash_and_banks_bp, url_prefix='/cash_and_banks')
+            app.register_blueprint(product_catalog_bp, url_prefix='/products')
+            app.register_blueprint(imports_bp, url_prefix='/import')
+            app.register_blueprint(api_bp, url_prefix='/api/v1')
+
+            # {{ amount_cents|money }} shows integer cents as e.g. 1234.50
+            app.add_template_filter(format_cents, 'money')
+
+            # Far-future caching for content-addressed product images
+            app.after_request(add_immutable_cache_headers)
+
+            init_instrumentation(app)
+            startup.init_app(app)
+
+            # `flask storage|cash|ar|products|import ...` maintenance commands
+            app.cli.add_command(storage_cli)
+            app.cli.add_command(cash_cli)
+            app.cli.add_command(ar_cli)
+            app.cli.add_command(products_cli)
+            app.cli.add_command(import_cli)
+
+            @app.route('/')
+            def index():
+                return render_template('index.html')
+
+            @app.route('/_storage/stats')
+            def storage_stats():
+                # Per-worker cache hit/miss counters for the data stores
+                return jsonify(cache_stats())
+
+            @app.route('/_startup')
+            def startup_report():
+                # This worker's create_app and warm-up timings
+                return jsonify(startup.report())
+
+    phases = startup.report()['phases']
+    app.logger.info('create_app took %.1f ms (%s)', phases.pop('create_app'), phases)
+    return app
+
+
+app = create_app()
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,4 @@
+"""Performance benchmarks for the models and routes.
+
+Run ``python -m benchmarks.run`` from the project root; see README.md.
+"""
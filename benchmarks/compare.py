@@ -0,0 +1,56 @@
+"""Compare two benchmark result files and report regressions.
+
+    python -m benchmarks.compare before.json after.json [--threshold 1.25]
+
+Exits with status 1 if any operation's median got slower by more than
+``threshold`` times (and by more than ``--min-delta`` ms, to ignore noise
+on operations that take microseconds).
+"""
+import argparse
+import json
+import sys
+
+
+def _median(stats):
+    return stats.get('median_ms', stats['min_ms'])
+
+
+def compare(before, after, threshold=1.25, min_delta=0.05):
+    """Yield ``(size, name, before_ms, after_ms, ratio, regressed)`` for every shared result."""
+    for size, run in after['sizes'].items():
+        old_run = before['sizes'].get(size)
+        if old_run is None:
+            continue
+        for name, stats in run['results'].items():
+            old = old_run['results'].get(name)
+            if old is None:
+                continue
+            old_ms, new_ms = _median(old), _median(stats)
+            ratio = new_ms / old_ms if old_ms else float('inf')
+            regressed = ratio > threshold and new_ms - old_ms > min_delta
+            yield size, name, old_ms, new_ms, ratio, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=1.25)
+    parser.add_argument('--min-delta', type=float, default=0.05, help='Ignore changes smaller than this (ms).')
+    args = parser.parse_args(argv)
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    regressions = 0
+    for size, name, old_ms, new_ms, ratio, regressed in compare(before, after, args.threshold, args.min_delta):
+        marker = 'SLOWER' if regressed else ''
+        regressions += regressed
+        print(f'{size:>8} {name:<45} {old_ms:>10.3f} -> {new_ms:>10.3f} ms  x{ratio:5.2f} {marker}')
+    print(f'{regressions} regression(s) above x{args.threshold}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
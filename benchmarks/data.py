@@ -0,0 +1,85 @@
+"""Seeded synthetic data for the benchmarks.
+
+Writes the three data files (and a set of product images) into a working
+directory in the same format the app stores them, so a benchmark run starts
+from a realistic snapshot instead of timing thousands of inserts.
+"""
+import hashlib
+import json
+import os
+import random
+import uuid
+from datetime import date, timedelta
+
+from modules.product_catalog.models import PRODUCT_SERIES, IMAGE_UPLOAD_FOLDER
+
+CUSTOMERS = 500
+DAYS = 730
+IMAGES = 200
+
+_WORDS = ['anillo', 'sincronizador', 'eje', 'rodaje', 'propulsor', 'canastilla', 'caja', 'aceite',
+          'bronce', 'acero', 'reforzado', 'delantero', 'trasero', 'cónico', '2T', '3T', '5ta', 'kit']
+
+
+def _uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def _dates(rng, count):
+    start = date.today() - timedelta(days=DAYS)
+    return [(start + timedelta(days=rng.randrange(DAYS))).isoformat() for _ in range(count)]
+
+
+def make_entries(rng, count):
+    return [{'id': _uuid(rng), 'date': day, 'name': f'Cliente {rng.randrange(CUSTOMERS):04d}',
+             'concept': f'Factura {n:06d}', 'amount_cents': rng.randrange(-20000, 500000)}
+            for n, day in enumerate(_dates(rng, count))]
+
+
+def make_transactions(rng, count):
+    return [{'id': _uuid(rng), 'date': day, 'concept': f'Venta {n:06d}',
+             'amount_cents': rng.randrange(-50000, 200000), 'type': rng.choice(('cash', 'bank_account'))}
+            for n, day in enumerate(_dates(rng, count))]
+
+
+def make_images(rng, folder):
+    """Write IMAGES small files named like uploads (hash of their content)."""
+    os.makedirs(folder, exist_ok=True)
+    names = []
+    for _ in range(IMAGES):
+        data = b'\xff\xd8\xff\xe0' + rng.randbytes(2048)
+        name = hashlib.sha256(data).hexdigest()[:32] + '.jpg'
+        with open(os.path.join(folder, name), 'wb') as f:
+            f.write(data)
+        names.append(name)
+    return names
+
+
+def make_products(rng, count, images):
+    products = []
+    for n in range(count):
+        cost = rng.randrange(100, 40000)
+        products.append({
+            'id': _uuid(rng), 'product_code': f'JBR-{n:06d}',
+            'name': ' '.join(rng.sample(_WORDS, 3)),
+            'price_fox_cents': round(cost * 1.1), 'cost_cents': cost,
+            'price_wholesale_cents': round(cost * 1.3), 'price_unit_cents': round(cost * 1.6),
+            'series': rng.choice(PRODUCT_SERIES),
+            'image_filename': rng.choice(images) if rng.random() < 0.8 else None,
+        })
+    return products
+
+
+def generate(directory, size, seed=0):
+    """Write ``size`` records per collection into ``directory``; returns a summary."""
+    rng = random.Random(seed)
+    images = make_images(rng, os.path.join(directory, IMAGE_UPLOAD_FOLDER))
+    collections = {
+        'accounts_receivable.json': make_entries(rng, size),
+        'cash_and_banks.json': make_transactions(rng, size),
+        'product_catalog.json': make_products(rng, size, images),
+    }
+    for filename, records in collections.items():
+        with open(os.path.join(directory, filename), 'w') as f:
+            json.dump(records, f, indent=4)
+    return {'records': size, 'images': len(images), 'seed': seed}
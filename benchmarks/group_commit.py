@@ -0,0 +1,109 @@
+"""Benchmark cash postings with and without group commit.
+
+    python -m benchmarks.group_commit
+    python -m benchmarks.group_commit --threads 1 8 32 --writes 2000
+    python -m benchmarks.group_commit --backend sqlite --max-delay-ms 1
+
+Threads post transactions through ``cash_and_banks.models.add_transaction``
+as concurrent requests would, first writing each one directly (one fsync
+per posting), then with group commit. Every run starts from an empty
+ledger in a temporary directory. Reports postings per second and the
+latency each caller saw.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from statistics import median, quantiles
+
+from .run import _meta
+
+DEFAULT_THREADS = (1, 4, 16, 64)
+DEFAULT_WRITES = 1000
+
+
+def run_burst(backend, threads, writes, group_commit):
+    """Post ``writes`` transactions from ``threads`` threads; returns the figures."""
+    from modules import storage
+    from modules.cash_and_banks import models as cb
+
+    workdir = tempfile.mkdtemp(prefix='bench-group-commit-')
+    cwd = os.getcwd()
+    try:
+        os.chdir(workdir)
+        # A fresh database per run; connections are cached per path
+        storage.configure(backend, os.path.join(workdir, 'erp.sqlite3'), group_commit=group_commit or False)
+        cb._ensure_data_file_exists()
+        latencies = [[] for _ in range(threads)]
+        start_line = threading.Barrier(threads + 1)
+
+        def post(n):
+            start_line.wait()
+            for i in range(n, writes, threads):
+                t = time.perf_counter()
+                cb.add_transaction({'date': '2026-01-%02d' % (i % 28 + 1), 'concept': f'Venta {i}',
+                                    'amount_cents': 100 + i, 'type': 'cash'})
+                latencies[n].append((time.perf_counter() - t) * 1000)
+
+        workers = [threading.Thread(target=post, args=(n,)) for n in range(threads)]
+        for worker in workers:
+            worker.start()
+        start_line.wait()
+        t = time.perf_counter()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - t
+        assert len(cb.get_all_transactions()) == writes
+        assert cb.calculate_totals()['total_cash'] == sum(100 + i for i in range(writes))
+        stats = cb._store.stats()['group_commit']
+        times = sorted(ms for per_thread in latencies for ms in per_thread)
+        return {
+            'writes_per_s': round(writes / elapsed, 1),
+            'median_ms': round(median(times), 3),
+            'p99_ms': round(quantiles(times, n=100)[98], 3) if len(times) > 1 else round(times[0], 3),
+            'batches': stats['batches'] if stats else writes,
+        }
+    finally:
+        storage.configure('json', group_commit=False)
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--threads', type=int, nargs='+', default=list(DEFAULT_THREADS))
+    parser.add_argument('--writes', type=int, default=DEFAULT_WRITES, help='Postings per run.')
+    parser.add_argument('--backend', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-delay-ms', type=float, default=0)
+    parser.add_argument('--output', help='Also write the results to this JSON file.')
+    args = parser.parse_args(argv)
+
+    group_commit = {'max_batch': args.max_batch, 'max_delay': args.max_delay_ms / 1000}
+    report = {'meta': dict(_meta(args.backend, None, 'json'), group_commit=group_commit), 'runs': []}
+    print(f"{'threads':>7} {'mode':<13} {'writes/s':>10} {'median ms':>10} {'p99 ms':>10} {'commits':>7}",
+          file=sys.stderr)
+    for threads in args.threads:
+        baseline = None
+        for mode, options in (('direct', None), ('group commit', group_commit)):
+            result = run_burst(args.backend, threads, args.writes, options)
+            result.update(threads=threads, mode=mode)
+            report['runs'].append(result)
+            baseline = baseline or result['writes_per_s']
+            print(f"{threads:>7} {mode:<13} {result['writes_per_s']:>10.1f} {result['median_ms']:>10.3f} "
+                  f"{result['p99_ms']:>10.3f} {result['batches']:>7}"
+                  + (f"  x{result['writes_per_s'] / baseline:.1f}" if options else ''), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Results written to {args.output}', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,274 @@
+"""Benchmark the models and routes at several data sizes.
+
+    python -m benchmarks.run                       # 1k, 10k and 100k records
+    python -m benchmarks.run --sizes 1000 --output before.json
+    python -m benchmarks.run --backend sqlite
+    python -m benchmarks.run --snapshot-format columnar
+
+Each size runs in a fresh process against generated data in a temporary
+directory, so runs are independent and repeatable (the data is seeded).
+Results are written as JSON; compare two runs with ``benchmarks.compare``.
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from importlib import metadata
+from statistics import mean, median
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+# Each operation is repeated until it has run for this long (seconds)...
+MIN_TIME = 0.2
+# ...at least MIN_REPS and at most MAX_REPS times; writes are capped lower
+# so they don't change the data size being measured.
+MIN_REPS = 3
+MAX_REPS = 1000
+MAX_WRITE_REPS = 50
+
+
+def measure(func, max_reps=MAX_REPS):
+    times = []
+    start = time.perf_counter()
+    while len(times) < max_reps and (len(times) < MIN_REPS or time.perf_counter() - start < MIN_TIME):
+        t = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - t) * 1000)
+    return {
+        'reps': len(times),
+        'min_ms': round(min(times), 4),
+        'median_ms': round(median(times), 4),
+        'mean_ms': round(mean(times), 4),
+        'max_ms': round(max(times), 4),
+    }
+
+
+def _cold(func):
+    t = time.perf_counter()
+    func()
+    return {'reps': 1, 'min_ms': round((time.perf_counter() - t) * 1000, 4)}
+
+
+def _cycle(items):
+    items = list(items)
+    state = {'n': 0}
+
+    def next_item():
+        state['n'] += 1
+        return items[state['n'] % len(items)]
+    return next_item
+
+
+def _rename(pc, product, n):
+    # The same fields the edit form sends
+    data = {field: product.get(field) for field in ('product_code', 'series') + pc.PRICE_CENTS_FIELDS}
+    data['name'] = f'renamed {n}'
+    return pc.update_product(product['id'], data)
+
+
+def bench_models(rng):
+    from modules.accounts_receivable import models as ar
+    from modules.cash_and_banks import models as cb
+    from modules.product_catalog import models as pc
+
+    results = {
+        # First access loads (or replays) each collection from disk
+        'ar.load': _cold(ar._ensure_data_file_exists),
+        'cb.load': _cold(cb._ensure_data_file_exists),
+        'pc.load': _cold(pc._ensure_data_file_exists),
+    }
+    entries = ar.get_all_entries()
+    transactions = cb.get_all_transactions()
+    products = pc.get_all_products()
+    entry_id = _cycle(rng.sample([e['id'] for e in entries], min(100, len(entries))))
+    sample = rng.sample(products, min(100, len(products)))
+    product_id = _cycle([p['id'] for p in sample])
+    product = _cycle(sample)
+    day = _cycle(rng.sample([t['date'] for t in transactions], min(100, len(transactions))))
+    series = _cycle(pc.PRODUCT_SERIES)
+    query = _cycle(['anillo', 'sincro bronce', 'JBR-0001', 'cónico 2T', 'kit'])
+    first_day, last_day = min(t['date'] for t in transactions), max(t['date'] for t in transactions)
+
+    reads = {
+        'ar.get_all_entries': ar.get_all_entries,
+        'ar.get_entry_by_id': lambda: ar.get_entry_by_id(entry_id()),
+        'ar.get_entries_page': lambda: ar.get_entries_page(0, 50),
+        'ar.get_aging_report': ar.get_aging_report,
+        'cb.get_all_transactions': cb.get_all_transactions,
+        'cb.get_transactions_by_date': lambda: cb.get_transactions_by_date(day()),
+        'cb.get_transactions_between': lambda: cb.get_transactions_between(first_day, last_day[:8] + '01'),
+        'cb.calculate_totals': cb.calculate_totals,
+        'cb.calculate_daily_totals': lambda: cb.calculate_daily_totals(day()),
+        'pc.get_all_products': pc.get_all_products,
+        'pc.get_product_by_id': lambda: pc.get_product_by_id(product_id()),
+        'pc.get_products_by_series': lambda: pc.get_products_by_series(series()),
+        'pc.get_products_page': lambda: pc.get_products_page(series(), 0, 50),
+        'pc.search_products': lambda: pc.search_products(query()),
+    }
+    for name, func in reads.items():
+        results[name] = measure(func)
+
+    counter = iter(range(10 ** 9))
+    added_entries, added_products = [], []
+    writes = {
+        'ar.add_entry': lambda: added_entries.append(ar.add_entry(
+            {'date': first_day, 'name': 'Bench', 'concept': 'x', 'amount_cents': 100})),
+        'ar.update_entry': lambda: ar.update_entry(entry_id(), {'concept': 'updated'}),
+        'cb.add_transaction': lambda: cb.add_transaction(
+            {'date': first_day, 'concept': 'x', 'amount_cents': 100, 'type': 'cash'}),
+        'pc.add_product': lambda: added_products.append(pc.add_product(
+            {'product_code': f'BENCH-{next(counter)}', 'name': 'bench', 'series': 'otros'}, None)),
+        'pc.update_product': lambda: _rename(pc, product(), next(counter)),
+        'ar.delete_entry': lambda: ar.delete_entry(added_entries.pop()['id']),
+        'pc.delete_product': lambda: pc.delete_product(added_products.pop()['id']),
+    }
+    for name, func in writes.items():
+        results[name] = measure(func, max_reps=MAX_WRITE_REPS)
+    return results
+
+
+def bench_routes(rng):
+    from app import app
+    from modules.cash_and_banks import models as cb
+
+    client = app.test_client(use_cookies=False)
+    transactions = cb.get_all_transactions()
+    day = rng.choice(transactions)['date']
+    routes = {
+        'GET /': '/',
+        'GET /accounts_receivable/': '/accounts_receivable/',
+        'GET /accounts_receivable/balances/': '/accounts_receivable/balances/',
+        'GET /cash_and_banks/': '/cash_and_banks/',
+        'GET /cash_and_banks/daily_report/': f'/cash_and_banks/daily_report/?date={day}',
+        'GET /cash_and_banks/report/': '/cash_and_banks/report/?preset=month&group_by=day',
+        'GET /cash_and_banks/corte_de_caja/': '/cash_and_banks/corte_de_caja/',
+        'GET /products/list/': '/products/list/',
+        'GET /products/list/?series': '/products/list/?series=anillos',
+        'GET /products/grid/': '/products/grid/',
+        'GET /products/grid/more/': '/products/grid/more/?series=anillos',
+        'GET /products/pricing/': '/products/pricing/?series=anillos',
+        'GET /products/search/': '/products/search/?q=anillo%20bronce',
+        'GET /api/v1/products/': '/api/v1/products/?per_page=100',
+        'GET /api/v1/cash_and_banks/totals': '/api/v1/cash_and_banks/totals',
+    }
+    results = {}
+    for name, url in routes.items():
+        separator = '&' if '?' in url else '?'
+        counter = iter(range(10 ** 9))
+
+        def uncached():
+            # A query argument the view ignores defeats the page cache
+            response = client.get(f'{url}{separator}_bench={next(counter)}')
+            assert response.status_code == 200, (url, response.status_code)
+            response.close()
+        results[name] = measure(uncached)
+        results[name + ' (cached)'] = measure(lambda: client.get(url).close())
+
+    form = {'date': day, 'concept': 'bench', 'amount': '1', 'type': 'cash'}
+    results['POST /cash_and_banks/'] = measure(lambda: client.post('/cash_and_banks/', data=form).close(),
+                                               max_reps=MAX_WRITE_REPS)
+    results['GET /cash_and_banks/export.csv'] = measure(
+        lambda: client.get('/cash_and_banks/export.csv').get_data(), max_reps=20)
+    return results
+
+
+def run_worker(size, backend, seed, snapshot_format='json'):
+    """Benchmark one data size in this process and return its results."""
+    sys.path.insert(0, PROJECT_ROOT)
+    workdir = tempfile.mkdtemp(prefix=f'bench-{size}-')
+    try:
+        os.chdir(workdir)
+        from benchmarks.data import generate
+        summary = generate(workdir, size, seed=seed)
+        # Loads are timed cold; a warm-up thread would load them first
+        os.environ['FLASK_WARM_UP'] = 'false'
+        if backend == 'sqlite':
+            os.environ['FLASK_STORAGE_BACKEND'] = 'sqlite'
+            # Importing the app registers every collection and selects the backend
+            importlib.import_module('app')
+            from modules.storage import all_stores
+            from modules.storage.migrate import migrate_to_sqlite
+            list(migrate_to_sqlite(all_stores(), 'erp.sqlite3'))
+        elif snapshot_format == 'columnar':
+            os.environ['FLASK_SNAPSHOT_FORMAT'] = 'columnar'
+            importlib.import_module('app')
+            from modules.storage import all_stores
+            for collection in all_stores():
+                if collection.columns:
+                    # Rewrites the generated JSON snapshot as a columnar one
+                    collection.compact()
+                    collection.unbind()
+        rng = random.Random(seed)
+        results = bench_models(rng)
+        results.update(bench_routes(rng))
+        return {'data': summary, 'results': results}
+    finally:
+        os.chdir(PROJECT_ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _meta(backend, seed, snapshot_format):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    try:
+        flask_version = metadata.version('flask')
+    except metadata.PackageNotFoundError:
+        flask_version = None
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'backend': backend,
+        'snapshot_format': snapshot_format,
+        'seed': seed,
+        'python': platform.python_version(),
+        'flask': flask_version,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES))
+    parser.add_argument('--backend', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--snapshot-format', choices=('json', 'columnar'), default='json')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        json.dump(run_worker(args.worker, args.backend, args.seed, args.snapshot_format), sys.stdout)
+        return 0
+
+    report = {'meta': _meta(args.backend, args.seed, args.snapshot_format), 'sizes': {}}
+    for size in args.sizes:
+        print(f'Benchmarking {size} records ({args.backend})...', file=sys.stderr)
+        completed = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.run', '--worker', str(size),
+             '--backend', args.backend, '--snapshot-format', args.snapshot_format, '--seed', str(args.seed)],
+            cwd=PROJECT_ROOT, stdout=subprocess.PIPE, check=True)
+        report['sizes'][str(size)] = json.loads(completed.stdout)
+        for name, stats in report['sizes'][str(size)]['results'].items():
+            print(f'  {name:<45} {stats.get("median_ms", stats["min_ms"]):>10.3f} ms', file=sys.stderr)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {args.output}', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+import heapq
+from datetime import date
+
+from ..storage import View, is_closing
+
+# (label, first day, last day) of age since the entry date
+AGING_BUCKETS = (('0-30', 0, 30), ('31-60', 31, 60), ('61-90', 61, 90), ('90+', 91, None))
+
+
+def _customer_key(name):
+    # "Juan Perez" and "juan perez " are the same customer
+    return (name or '').strip().casefold()
+
+
+def _bucket_index(entry_date, as_of):
+    try:
+        age = (as_of - date.fromisoformat(entry_date)).days
+    except (TypeError, ValueError):
+        age = 0
+    # Future-dated entries count as current
+    for index, (_, first, last) in enumerate(AGING_BUCKETS):
+        if last is None or age <= last:
+            return index
+
+
+class CustomerBalances(View):
+    """Per-customer balances and aging buckets of the AR ledger.
+
+    Kept up to date by the store on every mutation. Each customer keeps its
+    amounts summed per date, so the aging buckets, which depend on today's
+    date, are regrouped from those sums once per day and then maintained
+    incrementally like the balances. Amounts are integer cents. The closing
+    record of an archived month adds the month's sums from its summary
+    (see ``summarize``).
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.customers = {}
+        self._aging = {}
+        self._as_of = None
+
+    def _bump_customer(self, key, name, entry_date, amount, entries):
+        customer = self.customers.get(key)
+        if customer is None:
+            customer = self.customers[key] = {'name': name, 'balance': 0, 'entries': 0, 'by_date': {}}
+            self._aging[key] = [0] * len(AGING_BUCKETS)
+        customer['balance'] += amount
+        customer['entries'] += entries
+        # date -> [amount, entries]
+        day = customer['by_date'].setdefault(entry_date, [0, 0])
+        day[0] += amount
+        day[1] += entries
+        if not day[1]:
+            del customer['by_date'][entry_date]
+        if self._as_of is not None:
+            self._aging[key][_bucket_index(entry_date, self._as_of)] += amount
+        if not customer['entries']:
+            del self.customers[key]
+            del self._aging[key]
+
+    def _bump(self, entry, sign):
+        if is_closing(entry):
+            # The whole month at once, from the sums in its summary
+            for key, customer in entry['summary']['customers'].items():
+                for entry_date, (amount, entries) in customer['by_date'].items():
+                    self._bump_customer(key, customer['name'], entry_date, sign * amount, sign * entries)
+            return
+        self._bump_customer(_customer_key(entry.get('name')), (entry.get('name') or '').strip(), entry.get('date'),
+                            sign * (entry.get('amount_cents') or 0), sign)
+
+    @staticmethod
+    def summarize(entries):
+        """The figures of an archived month's closing record: its total, and each customer's sums per date."""
+        balances = CustomerBalances()
+        for entry in entries:
+            balances.add(entry)
+        return {
+            'amount_cents': sum(customer['balance'] for customer in balances.customers.values()),
+            'customers': {key: {'name': customer['name'], 'by_date': customer['by_date']}
+                          for key, customer in balances.customers.items()},
+        }
+
+    def add(self, entry):
+        self._bump(entry, 1)
+
+    def remove(self, entry):
+        self._bump(entry, -1)
+
+    def _regroup(self, as_of):
+        self._as_of = as_of
+        for key, customer in self.customers.items():
+            buckets = self._aging[key] = [0] * len(AGING_BUCKETS)
+            for entry_date, (amount, _) in customer['by_date'].items():
+                buckets[_bucket_index(entry_date, as_of)] += amount
+
+    def balances(self):
+        """Every customer's name, balance and entry count, by name."""
+        return sorted(({'name': c['name'], 'balance': c['balance'], 'entries': c['entries']}
+                       for c in self.customers.values()), key=lambda c: c['name'].casefold())
+
+    def top_debtors(self, n=10):
+        """The ``n`` customers owing the most, largest balance first."""
+        top = heapq.nlargest(n, (c for c in self.customers.values() if c['balance'] > 0),
+                             key=lambda c: c['balance'])
+        return [{'name': c['name'], 'balance': c['balance'], 'entries': c['entries']} for c in top]
+
+    def aging(self, as_of):
+        """Amounts per customer and age bucket as of the date ``as_of``.
+
+        Returns ``(rows, totals)``: rows are sorted by name and carry
+        ``name``, ``buckets`` (one amount per AGING_BUCKETS entry) and
+        ``total``; ``totals`` sums each bucket over all customers.
+        """
+        if as_of != self._as_of:
+            self._regroup(as_of)
+        rows = []
+        totals = [0] * len(AGING_BUCKETS)
+        for key, customer in self.customers.items():
+            buckets = list(self._aging[key])
+            for index, amount in enumerate(buckets):
+                totals[index] += amount
+            rows.append({'name': customer['name'], 'buckets': buckets, 'total': customer['balance']})
+        rows.sort(key=lambda row: row['name'].casefold())
+        return rows, totals
@@ -0,0 +1,22 @@
+import click
+from flask.cli import AppGroup
+
+from ..storage import parse_period
+from .models import close_periods
+
+ar_cli = AppGroup('ar', help='Accounts receivable maintenance.')
+
+
+@ar_cli.command('close-periods')
+@click.argument('before')
+def close_periods_command(before):
+    """Archive every month before BEFORE (YYYY-MM) into read-only segments."""
+    try:
+        parse_period(before)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='BEFORE')
+    closed = 0
+    for period, entries in close_periods(before):
+        click.echo(f'{period}: {entries} entries archived')
+        closed += 1
+    click.echo(f'Closed {closed} periods.' if closed else f'No open periods before {before}.')
@@ -1,76 +1,148 @@
-import json
 import uuid
-import os
+from datetime import datetime
+from ..money import to_cents, upgrade_amounts
+from ..storage import (get_store, SortedIndex, HashIndex, ClosedPeriods, PeriodArchive, PERIOD_FIELD,
+                       is_closing, period_of)
+from .aggregates import CustomerBalances
 
 DATA_FILE = 'accounts_receivable.json'
+# Stored in cents as amount_cents (see money)
+AMOUNT_FIELDS = ('amount',)
+# Schema of the optional columnar snapshot (see storage.columnar)
+COLUMNS = [('id', 'uuid'), ('date', 'date'), ('name', 'text'), ('concept', 'text'), ('amount_cents', 'int')]
+_balances = CustomerBalances()
+_closed = ClosedPeriods()
+
+def _upgrade(entry):
+    # Entries saved before amounts were kept in cents
+    return upgrade_amounts(entry, AMOUNT_FIELDS)
+
+_store = get_store(DATA_FILE, indexes=[SortedIndex('date'), HashIndex(PERIOD_FIELD)], views=[_balances, _closed],
+                   columns=COLUMNS, upgrade=_upgrade)
+# Closed months live in read-only segments; see storage.archive
+_archive = PeriodArchive(_store, _closed, CustomerBalances.summarize)
 
 def _ensure_data_file_exists():
-    if not os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'w') as f:
-            json.dump([], f)
-    else:
-        # Check if file is empty or contains invalid JSON
-        try:
-            with open(DATA_FILE, 'r') as f:
-                # Try to load the JSON data
-                data = json.load(f)
-                if not isinstance(data, list): # Ensure it's a list
-                    raise ValueError("Data is not a list")
-        except (json.JSONDecodeError, ValueError, FileNotFoundError):
-            # If file is empty, not valid JSON, or doesn't exist (should be caught by os.path.exists but as a fallback)
-            # Initialize with an empty list
-            with open(DATA_FILE, 'w') as f:
-                json.dump([], f)
+    # Loads (or creates) the data file once; later calls hit the store's cache
+    _store.ensure_exists()
+
 
+def data_version():
+    # Changes on every write to the collection; used for HTTP caching
+    return _store.version()
 
 def get_all_entries():
-    _ensure_data_file_exists()
+    # Archived months first (loading their segments), then the open ones
+    return _archive.all()
+
+def get_entries_page(offset, limit):
+    # Returns (entries, total) for one page of the list view: open months only
+    return _archive.open_page(offset, limit)
+
+def get_period_entries_page(period, offset, limit):
+    # The same for one archived month (YYYY-MM); empty if it is not closed
+    return _archive.page(period, offset, limit)
+
+def get_entries_between(start_date, end_date): # inclusive, YYYY-MM-DD
+    # By date, from the store and the segments of archived months
+    return _archive.find_range(start_date, end_date)
+
+def get_closed_periods():
+    """The archived months, oldest first, with their totals from the closing records."""
+    return [{
+        'period': closing['period'],
+        'entries': closing['records'],
+        'customers': len(closing['summary']['customers']),
+        'amount_cents': closing['summary']['amount_cents'],
+        'closed_at': closing['closed_at'],
+    } for closing in _archive.closed_periods()]
+
+def close_periods(before):
+    """Archive every month before ``before`` (YYYY-MM); yields (period, entries)."""
+    return _archive.close_before(before)
+
+def clean_entry_data(data):
+    """Validate entry fields from a form or CSV row.
+
+    Returns them with the amount in cents as ``amount_cents``; raises
+    ValueError with a message for the user if they are invalid.
+    """
+    # Values may be form strings or JSON numbers
+    cleaned = {field: str(data[field]).strip() if data.get(field) is not None else '' for field in ('date', 'name', 'concept', 'amount')}
+    if not all(cleaned.values()):
+        raise ValueError('All fields are required.')
     try:
-        with open(DATA_FILE, 'r') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, FileNotFoundError):
-        return []
+        datetime.strptime(cleaned['date'], '%Y-%m-%d')
+    except ValueError:
+        raise ValueError('Invalid date format. Please use YYYY-MM-DD.')
+    try:
+        cleaned['amount_cents'] = to_cents(cleaned.pop('amount'))
+    except ValueError:
+        raise ValueError('Invalid amount. Please enter a number.')
+    if _archive.is_closed(period_of(cleaned['date'])):
+        raise ValueError(f"The period {period_of(cleaned['date'])} is closed; its entries can no longer be changed.")
+    return cleaned
 
-def add_entry(data):
-    entries = get_all_entries()
-    new_entry = {
+def _new_entry(data):
+    return {
         'id': str(uuid.uuid4()),
         'date': data.get('date'),
         'name': data.get('name'),
         'concept': data.get('concept'),
-        'amount': data.get('amount')
+        'amount_cents': data.get('amount_cents')
     }
-    entries.append(new_entry)
-    with open(DATA_FILE, 'w') as f:
-        json.dump(entries, f, indent=4)
-    return new_entry
+
+def add_entries(entries):
+    # Bulk insert of cleaned entries in a single store write
+    return _store.put_many([_new_entry(data) for data in entries])
+
+def apply_batch(creates=(), updates=None, deletes=(), expected=()):
+    """Create, update and delete entries in a single store write.
+
+    ``creates`` are cleaned entries, ``updates`` maps ids to cleaned fields
+    and ``deletes`` lists ids; unknown ids are skipped. Raises ConflictError
+    if a record in ``expected`` (e.g. the entries ``updates`` were made
+    from) changed. Returns the created and the updated entries.
+    """
+    updates = updates or {}
+    created = [_new_entry(data) for data in creates]
+    updated = [dict(entry, **updates[entry['id']]) for entry in _store.get_many(updates) if not is_closing(entry)]
+    deletes = [entry['id'] for entry in _store.get_many(deletes) if not is_closing(entry)]
+    _store.write_batch(created + updated, deletes, expected=expected)
+    return created, updated
+
+def add_entry(data):
+    return _store.insert(_new_entry(data))
 
 def get_entry_by_id(entry_id):
-    entries = get_all_entries()
-    for entry in entries:
-        if entry['id'] == entry_id:
-            return entry
-    return None
+    # Archived entries are only read through their month
+    entry = _store.get(entry_id)
+    return None if entry is None or is_closing(entry) else entry
 
 def update_entry(entry_id, data):
-    entries = get_all_entries()
-    for i, entry in enumerate(entries):
-        if entry['id'] == entry_id:
-            entries[i]['date'] = data.get('date', entry['date'])
-            entries[i]['name'] = data.get('name', entry['name'])
-            entries[i]['concept'] = data.get('concept', entry['concept'])
-            entries[i]['amount'] = data.get('amount', entry['amount'])
-            with open(DATA_FILE, 'w') as f:
-                json.dump(entries, f, indent=4)
-            return entries[i]
-    return None
+    entry = get_entry_by_id(entry_id)
+    if entry is None:
+        return None
+    return _store.update(entry_id, {
+        'date': data.get('date', entry['date']),
+        'name': data.get('name', entry['name']),
+        'concept': data.get('concept', entry['concept']),
+        'amount_cents': data.get('amount_cents', entry.get('amount_cents'))
+    })
 
 def delete_entry(entry_id):
-    entries = get_all_entries()
-    original_length = len(entries)
-    entries = [entry for entry in entries if entry['id'] != entry_id]
-    if len(entries) < original_length:
-        with open(DATA_FILE, 'w') as f:
-            json.dump(entries, f, indent=4)
-        return True
-    return False
+    if get_entry_by_id(entry_id) is None:
+        return False
+    return _store.delete(entry_id)
+
+def get_customer_balances():
+    # Maintained incrementally by the store; see aggregates.CustomerBalances
+    return _store.read(_balances.balances)
+
+def get_top_debtors(n=10):
+    return _store.read(lambda: _balances.top_debtors(n))
+
+def get_aging_report(as_of=None):
+    """Return ``(rows, totals)`` of balances per age bucket (see aggregates.AGING_BUCKETS)."""
+    as_of = as_of or datetime.now().date()
+    return _store.read(lambda: _balances.aging(as_of))
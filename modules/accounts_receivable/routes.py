@@ -1,5 +1,15 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
-from .models import get_all_entries, add_entry, get_entry_by_id, update_entry, delete_entry
+from datetime import datetime
+from .models import (
+    get_all_entries, get_entries_page, add_entry, get_entry_by_id, update_entry, delete_entry, data_version,
+    clean_entry_data, get_customer_balances, get_top_debtors, get_aging_report, get_period_entries_page,
+    get_closed_periods
+)
+from .aggregates import AGING_BUCKETS
+from ..http_cache import cached_page
+from ..storage import ClosedPeriodError
+from ..exports import export_response
+from ..pagination import get_page_args, paginate, render_list_page
 
 accounts_receivable_bp = Blueprint(
     'accounts_receivable_bp', 
@@ -9,26 +19,49 @@ accounts_receivable_bp = Blueprint(
 )
 
 @accounts_receivable_bp.route('/', methods=['GET', 'POST'])
+@cached_page(data_version)
 def index():
     if request.method == 'POST':
-        date = request.form.get('date')
-        name = request.form.get('name')
-        concept = request.form.get('concept')
-        amount = request.form.get('amount')
-
-        if not date or not name or not concept or not amount:
-            flash('All fields are required.', 'error')
-        else:
-            try:
-                amount = float(amount) # Basic validation for amount
-                add_entry({'date': date, 'name': name, 'concept': concept, 'amount': amount})
-                flash('Entry added successfully!', 'success')
-            except ValueError:
-                flash('Invalid amount. Please enter a number.', 'error')
+        try:
+            add_entry(clean_entry_data(request.form))
+            flash('Entry added successfully!', 'success')
+        except (ValueError, ClosedPeriodError) as e:
+            flash(str(e), 'error')
         return redirect(url_for('accounts_receivable_bp.index'))
 
-    entries = get_all_entries()
-    return render_template('ar_index.html', entries=entries)
+    page, per_page = get_page_args()
+    closed_periods = get_closed_periods()
+    # ?period=YYYY-MM lists an archived month (read-only) instead of the open ones
+    period = request.args.get('period')
+    if period not in [closed['period'] for closed in closed_periods]:
+        period = None
+    if period:
+        pagination = paginate(lambda offset, limit: get_period_entries_page(period, offset, limit), page, per_page)
+    else:
+        pagination = paginate(get_entries_page, page, per_page)
+    return render_list_page('ar_index.html', pagination, entries=pagination.items,
+                            period=period, closed_periods=closed_periods)
+
+def _today():
+    return datetime.now().strftime('%Y-%m-%d')
+
+@accounts_receivable_bp.route('/balances/', methods=['GET'])
+@cached_page(data_version, _today)
+def balances():
+    rows, totals = get_aging_report()
+    return render_template('ar_balances.html',
+                           top_debtors=get_top_debtors(10),
+                           aging_rows=rows,
+                           aging_totals=totals,
+                           bucket_labels=[label for label, _, _ in AGING_BUCKETS],
+                           customer_count=len(get_customer_balances()),
+                           today_date_str=_today())
+
+@accounts_receivable_bp.route('/export.<fmt>', methods=['GET'])
+def export_entries(fmt):
+    # fmt is csv or xlsx; streamed as it is written
+    columns = [('date', 'Date'), ('name', 'Name'), ('concept', 'Concept'), ('amount_cents', 'Amount')]
+    return export_response(fmt, columns, get_all_entries(), 'accounts_receivable')
 
 @accounts_receivable_bp.route('/edit/<string:entry_id>', methods=['GET', 'POST'])
 def edit_entry_route(entry_id):
@@ -38,21 +71,11 @@ def edit_entry_route(entry_id):
         return redirect(url_for('accounts_receivable_bp.index'))
 
     if request.method == 'POST':
-        date = request.form.get('date')
-        name = request.form.get('name')
-        concept = request.form.get('concept')
-        amount = request.form.get('amount')
-
-        if not date or not name or not concept or not amount:
-            flash('All fields are required.', 'error')
-            return render_template('ar_edit_entry.html', entry=entry)
-        
         try:
-            amount = float(amount) # Basic validation for amount
-            update_entry(entry_id, {'date': date, 'name': name, 'concept': concept, 'amount': amount})
+            update_entry(entry_id, clean_entry_data(request.form))
             flash('Entry updated successfully!', 'success')
-        except ValueError:
-            flash('Invalid amount. Please enter a number.', 'error')
+        except (ValueError, ClosedPeriodError) as e:
+            flash(str(e), 'error')
             return render_template('ar_edit_entry.html', entry=entry)
         
         return redirect(url_for('accounts_receivable_bp.index'))
@@ -0,0 +1 @@
+# Empty for now
@@ -0,0 +1,232 @@
+from datetime import datetime
+
+from flask import Blueprint, jsonify, request
+
+from ..accounts_receivable import models as ar
+from ..cash_and_banks import models as cb
+from ..product_catalog import models as pc
+from ..money import cents_to_number, with_amounts
+from ..storage import ClosedPeriodError, ConflictError, DuplicateKeyError, parse_period, period_bounds, retry_on_conflict
+from ..http_cache import cached_page
+from ..pagination import get_page_args, paginate
+
+# Mutations accepted in one batch request
+MAX_BATCH_SIZE = 1000
+
+api_bp = Blueprint('api_bp', __name__)
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400, details=None):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+@api_bp.errorhandler(ApiError)
+def handle_api_error(e):
+    body = {'error': str(e)}
+    if e.details:
+        body['details'] = e.details
+    return jsonify(body), e.status
+
+
+@api_bp.errorhandler(DuplicateKeyError)
+@api_bp.errorhandler(ClosedPeriodError)
+@api_bp.errorhandler(ConflictError)
+def handle_conflict(e):
+    return jsonify({'error': str(e)}), 409
+
+
+def _page_response(fetch, amount_fields):
+    page, per_page = get_page_args()
+    pagination = paginate(fetch, page, per_page)
+    return jsonify({
+        'items': [with_amounts(record, amount_fields) for record in pagination.items],
+        'page': pagination.page,
+        'per_page': pagination.per_page,
+        'total': pagination.total,
+        'pages': pagination.pages,
+    })
+
+
+def _list_page(records):
+    # Pages an already filtered list the same way as the store's page()
+    return lambda offset, limit: (records[offset:offset + limit], len(records))
+
+
+def _found(record, amount_fields):
+    # Money is stored in cents (see money) but the API shows amounts
+    if record is None:
+        raise ApiError('Not found.', 404)
+    return jsonify(with_amounts(record, amount_fields))
+
+
+def _date_arg(name):
+    value = request.args.get(name)
+    if value:
+        try:
+            datetime.strptime(value, '%Y-%m-%d')
+        except ValueError:
+            raise ApiError(f'{name} must be a date in YYYY-MM-DD format.')
+    return value
+
+
+def _period_arg():
+    value = request.args.get('period')
+    if value:
+        try:
+            parse_period(value)
+        except ValueError as e:
+            raise ApiError(str(e))
+    return value
+
+
+def _json_body():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        raise ApiError('Expected a JSON object.')
+    return body
+
+
+def _run_batch(clean, get_by_id, apply_batch, amount_fields):
+    """Validate a ``{"create": [...], "update": [...], "delete": [...]}`` body and apply it.
+
+    Updates are objects with an ``id`` and the fields to change. Everything
+    is validated first; if any item is invalid nothing is written and the
+    problems are returned with their position. Otherwise all mutations are
+    applied in one store write, provided the updated records are still as
+    they were validated; if another request changed one meanwhile, the
+    batch is validated and applied again on top of it. ``amount_fields``
+    are the resource's money fields, sent and returned as amounts.
+    """
+    body = _json_body()
+    creates, updates, deletes = body.get('create', []), body.get('update', []), body.get('delete', [])
+    if not all(isinstance(items, list) for items in (creates, updates, deletes)):
+        raise ApiError('create, update and delete must be lists.')
+    if len(creates) + len(updates) + len(deletes) > MAX_BATCH_SIZE:
+        raise ApiError(f'At most {MAX_BATCH_SIZE} mutations per batch.', 413)
+
+    def validate_and_apply():
+        errors = []
+        cleaned_creates = []
+        for index, item in enumerate(creates):
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError('Expected an object.')
+                cleaned_creates.append(clean(item))
+            except ValueError as e:
+                errors.append({'op': 'create', 'index': index, 'error': str(e)})
+        cleaned_updates = {}
+        # The records the updates were merged into
+        expected = []
+        for index, item in enumerate(updates):
+            record = get_by_id(item['id']) if isinstance(item, dict) and isinstance(item.get('id'), str) else None
+            if record is None:
+                errors.append({'op': 'update', 'index': index, 'error': 'Not found.'})
+                continue
+            try:
+                cleaned_updates[record['id']] = clean(dict(with_amounts(record, amount_fields), **item))
+                expected.append(record)
+            except ValueError as e:
+                errors.append({'op': 'update', 'index': index, 'error': str(e)})
+        for index, record_id in enumerate(deletes):
+            if not isinstance(record_id, str) or get_by_id(record_id) is None:
+                errors.append({'op': 'delete', 'index': index, 'error': 'Not found.'})
+        if errors:
+            raise ApiError('Nothing was saved; fix the listed items.', 422, errors)
+        return apply_batch(cleaned_creates, cleaned_updates, deletes, expected=expected)
+
+    created, updated = retry_on_conflict(validate_and_apply)
+    return jsonify({
+        'created': [with_amounts(record, amount_fields) for record in created],
+        'updated': [with_amounts(record, amount_fields) for record in updated],
+        'deleted': deletes,
+    })
+
+
+# Accounts receivable
+
+@api_bp.route('/accounts_receivable/', methods=['GET'])
+@cached_page(ar.data_version)
+def list_entries():
+    # Entries of the open months, or of any one month with ?period=YYYY-MM
+    period = _period_arg()
+    if period:
+        return _page_response(_list_page(ar.get_entries_between(*period_bounds(period))), ar.AMOUNT_FIELDS)
+    return _page_response(ar.get_entries_page, ar.AMOUNT_FIELDS)
+
+@api_bp.route('/accounts_receivable/<string:entry_id>', methods=['GET'])
+def get_entry(entry_id):
+    return _found(ar.get_entry_by_id(entry_id), ar.AMOUNT_FIELDS)
+
+@api_bp.route('/accounts_receivable/batch', methods=['POST'])
+def batch_entries():
+    return _run_batch(ar.clean_entry_data, ar.get_entry_by_id, ar.apply_batch, ar.AMOUNT_FIELDS)
+
+
+# Cash and banks
+
+@api_bp.route('/cash_and_banks/', methods=['GET'])
+@cached_page(cb.data_version)
+def list_transactions():
+    # ?date=, ?period=YYYY-MM or ?start=&end= (inclusive), optionally &type=cash|bank_account;
+    # without them, the transactions of the open months
+    date = _date_arg('date')
+    period = _period_arg()
+    start, end = _date_arg('start'), _date_arg('end')
+    transaction_type = request.args.get('type')
+    if transaction_type and transaction_type not in cb.TRANSACTION_TYPES:
+        raise ApiError('type must be cash or bank_account.')
+    if not (date or start or end or period or transaction_type):
+        return _page_response(cb.get_transactions_page, cb.AMOUNT_FIELDS)
+    if date:
+        transactions = cb.get_transactions_by_date(date)
+    elif period:
+        transactions = cb.get_transactions_between(*period_bounds(period))
+    elif start or end:
+        transactions = cb.get_transactions_between(start or '0000-01-01', end or '9999-12-31')
+    else:
+        transactions = cb.get_all_transactions()
+    if transaction_type:
+        transactions = [t for t in transactions if t.get('type') == transaction_type]
+    return _page_response(_list_page(transactions), cb.AMOUNT_FIELDS)
+
+@api_bp.route('/cash_and_banks/<string:transaction_id>', methods=['GET'])
+def get_transaction(transaction_id):
+    return _found(cb.get_transaction_by_id(transaction_id), cb.AMOUNT_FIELDS)
+
+@api_bp.route('/cash_and_banks/batch', methods=['POST'])
+def batch_transactions():
+    return _run_batch(cb.clean_transaction_data, cb.get_transaction_by_id, cb.apply_batch, cb.AMOUNT_FIELDS)
+
+@api_bp.route('/cash_and_banks/totals', methods=['GET'])
+def transaction_totals():
+    # Same figures as calculate_totals(), or calculate_daily_totals() with ?date=
+    date = _date_arg('date')
+    totals = cb.calculate_daily_totals(date) if date else cb.calculate_totals()
+    totals = {name: cents_to_number(cents) for name, cents in totals.items()}
+    if date:
+        totals['date'] = date
+    return jsonify(totals)
+
+
+# Product catalog
+
+@api_bp.route('/products/', methods=['GET'])
+@cached_page(pc.data_version)
+def list_products():
+    # ?series= filters like the list view, ?q= searches (best matches first)
+    query = request.args.get('q', '').strip()
+    if query:
+        return _page_response(_list_page(pc.search_products(query, limit=1000)), pc.PRICE_FIELDS)
+    series = request.args.get('series') or None
+    return _page_response(lambda offset, limit: pc.get_products_page(series, offset, limit), pc.PRICE_FIELDS)
+
+@api_bp.route('/products/<string:product_id>', methods=['GET'])
+def get_product(product_id):
+    return _found(pc.get_product_by_id(product_id), pc.PRICE_FIELDS)
+
+@api_bp.route('/products/batch', methods=['POST'])
+def batch_products():
+    return _run_batch(pc.clean_product_data, pc.get_product_by_id, pc.apply_batch, pc.PRICE_FIELDS)
@@ -0,0 +1,106 @@
+from ..storage import View, is_closing
+
+
+class RunningTotals(View):
+    """Per-type grand totals and per-day, per-type subtotals of the ledger.
+
+    Kept up to date by the store on every mutation, so reading a total costs
+    a dictionary lookup no matter how much history the ledger holds. Totals
+    are integer cents, so they are exact: rounding never makes them drift.
+    The closing record of an archived month adds that month's figures from
+    its summary (see ``summarize``).
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.by_type = {}
+        self.by_day = {}
+        self._day_counts = {}
+
+    def _bump(self, transaction, sign):
+        if is_closing(transaction):
+            self._bump_closing(transaction, sign)
+            return
+        amount = sign * (transaction.get('amount_cents') or 0)
+        transaction_type = transaction['type']
+        date = transaction['date']
+        self.by_type[transaction_type] = self.by_type.get(transaction_type, 0) + amount
+        day = self.by_day.setdefault(date, {})
+        day[transaction_type] = day.get(transaction_type, 0) + amount
+        self._day_counts[date] = self._day_counts.get(date, 0) + sign
+        if not self._day_counts[date]:
+            del self._day_counts[date]
+            del self.by_day[date]
+
+    def _bump_closing(self, closing, sign):
+        # The whole month at once, from the figures in its summary
+        for date, amounts in closing['summary']['by_day'].items():
+            day = self.by_day.setdefault(date, {})
+            for transaction_type, amount in amounts.items():
+                self.by_type[transaction_type] = self.by_type.get(transaction_type, 0) + sign * amount
+                day[transaction_type] = day.get(transaction_type, 0) + sign * amount
+            self._day_counts[date] = self._day_counts.get(date, 0) + sign * closing['counts'][date]
+            if not self._day_counts[date]:
+                del self._day_counts[date]
+                del self.by_day[date]
+
+    def add(self, transaction):
+        self._bump(transaction, 1)
+
+    def remove(self, transaction):
+        self._bump(transaction, -1)
+
+    @staticmethod
+    def summarize(transactions):
+        """The figures of an archived month's closing record: cents per type, and per day and type."""
+        totals = RunningTotals()
+        for transaction in transactions:
+            totals.add(transaction)
+        return {'by_type': totals.by_type, 'by_day': totals.by_day}
+
+    def totals(self):
+        total_cash = self.by_type.get('cash', 0)
+        total_bank = self.by_type.get('bank_account', 0)
+        return {
+            'total_cash': total_cash,
+            'total_bank': total_bank,
+            'grand_total': total_cash + total_bank
+        }
+
+    def daily_totals(self, date_str):
+        day = self.by_day.get(date_str, {})
+        today_cash = day.get('cash', 0)
+        today_bank = day.get('bank_account', 0)
+        return {
+            'today_cash': today_cash,
+            'today_bank': today_bank,
+            'today_grand_total': today_cash + today_bank
+        }
+
+    def drift(self, transactions):
+        """Compare against totals recomputed from ``transactions``.
+
+        Returns a list of ``(scope, type, stored, expected)`` tuples for every
+        figure (in cents) that differs; ``scope`` is 'total' or a date.
+        """
+        expected = RunningTotals()
+        for transaction in transactions:
+            expected.add(transaction)
+        differences = []
+        scopes = [('total', self.by_type, expected.by_type)]
+        for date in sorted(set(self.by_day) | set(expected.by_day)):
+            scopes.append((date, self.by_day.get(date, {}), expected.by_day.get(date, {})))
+        for scope, stored, recomputed in scopes:
+            for transaction_type in sorted(set(stored) | set(recomputed)):
+                have = stored.get(transaction_type, 0)
+                want = recomputed.get(transaction_type, 0)
+                if have != want:
+                    differences.append((scope, transaction_type, have, want))
+        return differences
+
+    def rebuild(self, transactions):
+        self.clear()
+        for transaction in transactions:
+            self.add(transaction)
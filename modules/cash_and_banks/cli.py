@@ -0,0 +1,38 @@
+import click
+from flask.cli import AppGroup
+
+from ..money import format_cents
+from ..storage import parse_period
+from .models import verify_totals, close_periods
+
+cash_cli = AppGroup('cash', help='Cash and banks maintenance.')
+
+
+@cash_cli.command('verify-totals')
+@click.option('--rebuild', is_flag=True, help='Rebuild the running totals in every worker.')
+def verify_totals_command(rebuild):
+    """Recompute the corte de caja totals from every transaction and report drift."""
+    differences = verify_totals(rebuild=rebuild)
+    for scope, transaction_type, stored, expected in differences:
+        click.echo(f'{scope} {transaction_type}: running {format_cents(stored)}, recomputed {format_cents(expected)}')
+    if not differences:
+        click.echo('Running totals match the ledger.')
+    elif rebuild:
+        click.echo(f'Rebuilt {len(differences)} drifted figures.')
+    else:
+        raise click.ClickException(f'{len(differences)} figures drifted; rerun with --rebuild to fix.')
+
+
+@cash_cli.command('close-periods')
+@click.argument('before')
+def close_periods_command(before):
+    """Archive every month before BEFORE (YYYY-MM) into read-only segments."""
+    try:
+        parse_period(before)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='BEFORE')
+    closed = 0
+    for period, transactions in close_periods(before):
+        click.echo(f'{period}: {transactions} transactions archived')
+        closed += 1
+    click.echo(f'Closed {closed} periods.' if closed else f'No open periods before {before}.')
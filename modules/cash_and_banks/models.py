@@ -1,67 +1,160 @@
-import json
 import uuid
-import os
 from datetime import datetime
+from ..money import to_cents, upgrade_amounts
+from ..storage import (get_store, SortedIndex, HashIndex, ClosedPeriods, PeriodArchive, PERIOD_FIELD,
+                       is_closing, period_of)
+from .aggregates import RunningTotals
 
 DATA_FILE = 'cash_and_banks.json'
+TRANSACTION_TYPES = ('cash', 'bank_account')
+# Stored in cents as amount_cents (see money)
+AMOUNT_FIELDS = ('amount',)
+# Schema of the optional columnar snapshot (see storage.columnar)
+COLUMNS = [('id', 'uuid'), ('date', 'date'), ('concept', 'text'), ('amount_cents', 'int'), ('type', 'text')]
+_totals = RunningTotals()
+_closed = ClosedPeriods()
+
+def _upgrade(transaction):
+    # Transactions saved before amounts were kept in cents
+    return upgrade_amounts(transaction, AMOUNT_FIELDS)
+
+_store = get_store(DATA_FILE, indexes=[SortedIndex('date'), HashIndex(PERIOD_FIELD)], views=[_totals, _closed],
+                   columns=COLUMNS, upgrade=_upgrade)
+# Closed months live in read-only segments; see storage.archive
+_archive = PeriodArchive(_store, _closed, RunningTotals.summarize)
 
 def _ensure_data_file_exists():
-    if not os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'w') as f:
-            json.dump([], f)
-    else:
-        try:
-            with open(DATA_FILE, 'r') as f:
-                data = json.load(f)
-                if not isinstance(data, list):
-                    raise ValueError("Data is not a list")
-        except (json.JSONDecodeError, ValueError, FileNotFoundError):
-            with open(DATA_FILE, 'w') as f:
-                json.dump([], f)
+    _store.ensure_exists()
+
+def data_version():
+    # Changes on every write to the collection; used for HTTP caching
+    return _store.version()
 
 def get_all_transactions():
-    _ensure_data_file_exists()
+    # Archived months first (loading their segments), then the open ones
+    return _archive.all()
+
+def get_transactions_page(offset, limit):
+    # Returns (transactions, total) for one page of the list view: open months only
+    return _archive.open_page(offset, limit)
+
+def get_period_transactions_page(period, offset, limit):
+    # The same for one archived month (YYYY-MM); empty if it is not closed
+    return _archive.page(period, offset, limit)
+
+def get_closed_periods():
+    """The archived months, oldest first, with their totals from the closing records."""
+    periods = []
+    for closing in _archive.closed_periods():
+        by_type = closing['summary']['by_type']
+        periods.append({
+            'period': closing['period'],
+            'transactions': closing['records'],
+            'total_cash': by_type.get('cash', 0),
+            'total_bank': by_type.get('bank_account', 0),
+            'grand_total': sum(by_type.values()),
+            'closed_at': closing['closed_at'],
+        })
+    return periods
+
+def close_periods(before):
+    """Archive every month before ``before`` (YYYY-MM); yields (period, transactions)."""
+    return _archive.close_before(before)
+
+def clean_transaction_data(data):
+    """Validate transaction fields from a form or CSV row.
+
+    Returns them with the amount in cents as ``amount_cents``; raises
+    ValueError with a message for the user if they are invalid.
+    """
+    # Values may be form strings or JSON numbers
+    cleaned = {field: str(data[field]).strip() if data.get(field) is not None else '' for field in ('date', 'concept', 'amount', 'type')}
+    if not all(cleaned.values()):
+        raise ValueError('All fields are required.')
+    try:
+        datetime.strptime(cleaned['date'], '%Y-%m-%d')
+    except ValueError:
+        raise ValueError('Invalid date format. Please use YYYY-MM-DD.')
     try:
-        with open(DATA_FILE, 'r') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, FileNotFoundError):
-        return []
+        cleaned['amount_cents'] = to_cents(cleaned.pop('amount'))
+    except ValueError:
+        raise ValueError('Invalid amount. Please enter a number.')
+    if cleaned['type'] not in TRANSACTION_TYPES:
+        raise ValueError(f"Invalid type {cleaned['type']!r}; use cash or bank_account.")
+    if _archive.is_closed(period_of(cleaned['date'])):
+        raise ValueError(f"The period {period_of(cleaned['date'])} is closed; its transactions can no longer be changed.")
+    return cleaned
 
-def add_transaction(data):
-    transactions = get_all_transactions()
-    new_transaction = {
+def _new_transaction(data):
+    return {
         'id': str(uuid.uuid4()),
         'date': data.get('date'), # Expected format YYYY-MM-DD
         'concept': data.get('concept'),
-        'amount': float(data.get('amount')),
+        'amount_cents': data.get('amount_cents'),
         'type': data.get('type') # 'cash' or 'bank_account'
     }
-    transactions.append(new_transaction)
-    with open(DATA_FILE, 'w') as f:
-        json.dump(transactions, f, indent=4)
-    return new_transaction
+
+def add_transaction(data):
+    return _store.insert(_new_transaction(data))
+
+def add_transactions(transactions):
+    # Bulk insert of cleaned transactions in a single store write
+    return _store.put_many([_new_transaction(data) for data in transactions])
 
 def get_transactions_by_date(date_str): # date_str in YYYY-MM-DD format
-    transactions = get_all_transactions()
-    return [t for t in transactions if t['date'] == date_str]
+    # From the store, or the segment of an archived month
+    return _archive.find(date_str)
+
+def get_transactions_between(start_date, end_date): # inclusive, YYYY-MM-DD
+    return _archive.find_range(start_date, end_date)
+
+def get_transaction_dates_between(start_date, end_date):
+    # Dates (YYYY-MM-DD, ascending) in the range that have any transactions
+    return _archive.keys_between(start_date, end_date)
+
+def apply_batch(creates=(), updates=None, deletes=(), expected=()):
+    """Create, update and delete transactions in a single store write.
+
+    ``creates`` are cleaned transactions, ``updates`` maps ids to cleaned
+    fields and ``deletes`` lists ids; unknown ids are skipped. Raises
+    ConflictError if a record in ``expected`` (e.g. the transactions
+    ``updates`` were made from) changed. Returns the created and the
+    updated transactions.
+    """
+    updates = updates or {}
+    created = [_new_transaction(data) for data in creates]
+    updated = [dict(transaction, **updates[transaction['id']])
+               for transaction in _store.get_many(updates) if not is_closing(transaction)]
+    deletes = [transaction['id'] for transaction in _store.get_many(deletes) if not is_closing(transaction)]
+    _store.write_batch(created + updated, deletes, expected=expected)
+    return created, updated
+
+def get_transaction_by_id(transaction_id):
+    # Archived transactions are only read through their month
+    transaction = _store.get(transaction_id)
+    return None if transaction is None or is_closing(transaction) else transaction
 
 def calculate_totals():
-    transactions = get_all_transactions()
-    total_cash = sum(t['amount'] for t in transactions if t['type'] == 'cash')
-    total_bank = sum(t['amount'] for t in transactions if t['type'] == 'bank_account')
-    grand_total = total_cash + total_bank
-    return {
-        'total_cash': total_cash,
-        'total_bank': total_bank,
-        'grand_total': grand_total
-    }
+    # Maintained incrementally by the store; see aggregates.RunningTotals
+    return _store.read(_totals.totals)
 
 def calculate_daily_totals(date_str): # date_str in YYYY-MM-DD format
-    daily_transactions = get_transactions_by_date(date_str)
-    today_cash = sum(t['amount'] for t in daily_transactions if t['type'] == 'cash')
-    today_bank = sum(t['amount'] for t in daily_transactions if t['type'] == 'bank_account')
-    return {
-        'today_cash': today_cash,
-        'today_bank': today_bank,
-        'today_grand_total': today_cash + today_bank
-    }
+    return _store.read(lambda: _totals.daily_totals(date_str))
+
+def verify_totals(rebuild=False):
+    """Recompute all totals from scratch and return any drift found.
+
+    With ``rebuild`` the running totals are replaced by the recomputed ones,
+    and the store is compacted so every other worker reloads (and so
+    rebuilds) its own totals too.
+    """
+    def check():
+        transactions = _store.all()
+        differences = _totals.drift(transactions)
+        if rebuild:
+            _totals.rebuild(transactions)
+        return differences
+    differences = _store.read(check)
+    if rebuild:
+        _store.compact()
+    return differences
@@ -0,0 +1,80 @@
+from datetime import date, timedelta
+
+from ..instrumentation import measured
+from .models import get_transaction_dates_between, calculate_daily_totals
+
+GROUP_BY_OPTIONS = ('day', 'week', 'month')
+
+
+def _bucket_bounds(day, group_by):
+    # First and last calendar day of the bucket that contains `day`
+    if group_by == 'week':
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=6)
+    if group_by == 'month':
+        start = day.replace(day=1)
+        next_month = (start + timedelta(days=32)).replace(day=1)
+        return start, next_month - timedelta(days=1)
+    return day, day
+
+
+def _bucket_label(start, group_by):
+    if group_by == 'week':
+        year, week, _ = start.isocalendar()
+        return f'{year}-W{week:02d}'
+    if group_by == 'month':
+        return start.strftime('%Y-%m')
+    return start.isoformat()
+
+
+@measured('aggregate')
+def build_range_report(start_date, end_date, group_by='day'):
+    """Cash/bank totals for ``[start_date, end_date]`` rolled up per bucket.
+
+    Dates are ``YYYY-MM-DD`` strings. Only dates that have transactions are
+    visited (found through the ledger's sorted date index), and each day's
+    figures come from the precomputed daily totals, so the cost depends on
+    the length of the range and not on the size of the ledger.
+    """
+    buckets = []
+    current = None
+    for date_str in get_transaction_dates_between(start_date, end_date):
+        daily = calculate_daily_totals(date_str)
+        bucket_start, bucket_end = _bucket_bounds(date.fromisoformat(date_str), group_by)
+        if current is None or current['start'] != bucket_start.isoformat():
+            current = {
+                'label': _bucket_label(bucket_start, group_by),
+                'start': bucket_start.isoformat(),
+                'end': bucket_end.isoformat(),
+                'cash': 0,
+                'bank': 0,
+                'grand_total': 0,
+                'days': []
+            }
+            buckets.append(current)
+        current['cash'] += daily['today_cash']
+        current['bank'] += daily['today_bank']
+        current['grand_total'] += daily['today_grand_total']
+        current['days'].append({
+            'date': date_str,
+            'cash': daily['today_cash'],
+            'bank': daily['today_bank'],
+            'grand_total': daily['today_grand_total']
+        })
+
+    return {
+        'start': start_date,
+        'end': end_date,
+        'group_by': group_by,
+        'buckets': buckets,
+        'cash': sum(b['cash'] for b in buckets),
+        'bank': sum(b['bank'] for b in buckets),
+        'grand_total': sum(b['grand_total'] for b in buckets)
+    }
+
+
+def preset_range(preset, today=None):
+    """(start, end) date strings for the 'week' and 'month' containing today."""
+    today = today or date.today()
+    start, end = _bucket_bounds(today, preset)
+    return start.isoformat(), end.isoformat()
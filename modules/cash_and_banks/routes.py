@@ -1,8 +1,14 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from .models import (
-    get_all_transactions, add_transaction, get_transactions_by_date,
-    calculate_totals, calculate_daily_totals
+    get_all_transactions, get_transactions_page, add_transaction, get_transactions_by_date,
+    get_transactions_between, calculate_totals, calculate_daily_totals, data_version,
+    clean_transaction_data, get_period_transactions_page, get_closed_periods, TRANSACTION_TYPES
 )
+from ..http_cache import cached_page
+from ..storage import ClosedPeriodError
+from ..exports import export_response
+from ..pagination import get_page_args, paginate, render_list_page
+from .reports import build_range_report, preset_range, GROUP_BY_OPTIONS
 from datetime import datetime
 
 cash_and_banks_bp = Blueprint(
@@ -13,32 +19,29 @@ cash_and_banks_bp = Blueprint(
 )
 
 @cash_and_banks_bp.route('/', methods=['GET', 'POST'])
+@cached_page(data_version)
 def index():
     if request.method == 'POST':
-        date = request.form.get('date')
-        concept = request.form.get('concept')
-        amount = request.form.get('amount')
-        transaction_type = request.form.get('type')
-
-        if not date or not concept or not amount or not transaction_type:
-            flash('All fields are required.', 'error')
-        else:
-            try:
-                amount_float = float(amount)
-                add_transaction({
-                    'date': date,
-                    'concept': concept,
-                    'amount': amount_float,
-                    'type': transaction_type
-                })
-                flash('Transaction added successfully!', 'success')
-            except ValueError:
-                flash('Invalid amount. Please enter a number.', 'error')
+        try:
+            add_transaction(clean_transaction_data(request.form))
+            flash('Transaction added successfully!', 'success')
+        except (ValueError, ClosedPeriodError) as e:
+            flash(str(e), 'error')
         return redirect(url_for('cash_and_banks_bp.index'))
 
-    transactions = get_all_transactions()
+    page, per_page = get_page_args()
+    closed_periods = get_closed_periods()
+    # ?period=YYYY-MM lists an archived month instead of the open ones
+    period = request.args.get('period')
+    if period not in [closed['period'] for closed in closed_periods]:
+        period = None
+    if period:
+        pagination = paginate(lambda offset, limit: get_period_transactions_page(period, offset, limit), page, per_page)
+    else:
+        pagination = paginate(get_transactions_page, page, per_page)
     totals = calculate_totals()
-    return render_template('cb_index.html', transactions=transactions, totals=totals)
+    return render_list_page('cb_index.html', pagination, transactions=pagination.items, totals=totals,
+                            period=period, closed_periods=closed_periods)
 
 @cash_and_banks_bp.route('/daily_report/', methods=['GET'])
 def daily_report():
@@ -62,12 +65,79 @@ def daily_report():
                            selected_date=selected_date_str)
 
 
+@cash_and_banks_bp.route('/report/', methods=['GET'])
+def range_report():
+    preset = request.args.get('preset')
+    start_date = request.args.get('start')
+    end_date = request.args.get('end')
+    group_by = request.args.get('group_by', 'day')
+    if group_by not in GROUP_BY_OPTIONS:
+        group_by = 'day'
+    if preset in ('week', 'month'):
+        start_date, end_date = preset_range(preset)
+
+    report = None
+    if start_date and end_date:
+        try:
+            datetime.strptime(start_date, '%Y-%m-%d')
+            datetime.strptime(end_date, '%Y-%m-%d')
+        except ValueError:
+            flash('Invalid date format. Please use YYYY-MM-DD.', 'error')
+        else:
+            if start_date > end_date:
+                flash('The start date must not be after the end date.', 'error')
+            else:
+                report = build_range_report(start_date, end_date, group_by)
+                if not report['buckets']:
+                    flash(f'No transactions found between {start_date} and {end_date}.', 'info')
+
+    return render_template('cb_range_report.html',
+                           report=report,
+                           start_date=start_date,
+                           end_date=end_date,
+                           group_by=group_by,
+                           group_by_options=GROUP_BY_OPTIONS)
+
+
+@cash_and_banks_bp.route('/export.<fmt>', methods=['GET'])
+def export_transactions(fmt):
+    # ?date=, or ?start=&end= (inclusive), optionally &type=cash|bank_account
+    start_date = request.args.get('start') or request.args.get('date')
+    end_date = request.args.get('end') or request.args.get('date')
+    transaction_type = request.args.get('type') or None
+    try:
+        for value in (start_date, end_date):
+            if value:
+                datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        flash('Invalid date format. Please use YYYY-MM-DD.', 'error')
+        return redirect(url_for('cash_and_banks_bp.index'))
+    if transaction_type is not None and transaction_type not in TRANSACTION_TYPES:
+        flash('Invalid transaction type.', 'error')
+        return redirect(url_for('cash_and_banks_bp.index'))
+
+    if start_date and start_date == end_date:
+        transactions = get_transactions_by_date(start_date)
+    elif start_date or end_date:
+        transactions = get_transactions_between(start_date or '0000-01-01', end_date or '9999-12-31')
+    else:
+        transactions = get_all_transactions()
+    if transaction_type:
+        transactions = (t for t in transactions if t.get('type') == transaction_type)
+    columns = [('date', 'Date'), ('concept', 'Concept'), ('type', 'Type'), ('amount_cents', 'Amount')]
+    return export_response(fmt, columns, transactions, 'cash_and_banks')
+
+
+def _today():
+    return datetime.now().strftime('%Y-%m-%d')
+
 @cash_and_banks_bp.route('/corte_de_caja/', methods=['GET'])
+@cached_page(data_version, _today)
 def corte_de_caja():
     overall_totals = calculate_totals()
     
     # For "Today's" totals
-    today_str = datetime.now().strftime('%Y-%m-%d')
+    today_str = _today()
     daily_totals_data = calculate_daily_totals(today_str)
     
     return render_template('cb_corte_de_caja.html',
@@ -0,0 +1,165 @@
+import csv
+import io
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+from flask import Response, abort, stream_with_context
+
+from .money import CENTS_SUFFIX, cents_to_number
+
+EXPORT_FORMATS = ('csv', 'xlsx')
+# Rows written between two chunks handed to the server
+ROWS_PER_CHUNK = 500
+
+# Characters XML 1.0 does not allow, even escaped; Excel refuses a workbook
+# containing any of them
+_XML_ILLEGAL_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]')
+
+# Spreadsheets read text starting with these as a formula (CSV injection);
+# such values are exported with a leading apostrophe
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+_MIMETYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def _cell_value(record, field):
+    value = record.get(field)
+    if value is None:
+        return ''
+    if field.endswith(CENTS_SUFFIX):
+        # Money is kept in cents (see money) but exported as amounts
+        return cents_to_number(value)
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def iter_csv(columns, records):
+    """Yield a CSV file (UTF-8 with BOM so Excel reads accents) in chunks.
+
+    ``columns`` is a list of ``(field, heading)``; ``<field>_cents`` fields
+    are written as amounts, and text a spreadsheet would take for a formula
+    gets a leading apostrophe. The heading row is yielded on its own so the
+    download starts before any record is read.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([heading for _, heading in columns])
+    yield '\ufeff' + buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    for n, record in enumerate(records, 1):
+        writer.writerow([_cell_value(record, field) for field, _ in columns])
+        if n % ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+class _Sink:
+    """A write-only, unseekable file that hands out what was written so far.
+
+    ``zipfile`` supports such streams by writing sizes after each member's
+    data, so the archive never has to be held in memory or rewound.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+_XLSX_STATIC_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="{sheet}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'),
+}
+
+
+def _xlsx_row(values):
+    cells = []
+    for value in values:
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            cells.append('<c t="inlineStr"><is><t>%s</t></is></c>' % escape(_XML_ILLEGAL_RE.sub('', str(value))))
+        else:
+            cells.append('<c><v>%r</v></c>' % value)
+    return '<row>%s</row>' % ''.join(cells)
+
+
+def iter_xlsx(columns, records, sheet='Export'):
+    """Yield a one-sheet XLSX workbook in chunks, like ``iter_csv``.
+
+    Cells are written as inline strings and numbers, so no shared-strings
+    table has to be built up front.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_STATIC_PARTS.items():
+            archive.writestr(name, content.replace('{sheet}', escape(sheet)))
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as part:
+            part.write(('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                        '<sheetData>' + _xlsx_row([heading for _, heading in columns])).encode('utf-8'))
+            yield sink.drain()
+            rows = []
+            for n, record in enumerate(records, 1):
+                rows.append(_xlsx_row([_cell_value(record, field) for field, _ in columns]))
+                if n % ROWS_PER_CHUNK == 0:
+                    part.write(''.join(rows).encode('utf-8'))
+                    rows = []
+                    yield sink.drain()
+            part.write((''.join(rows) + '</sheetData></worksheet>').encode('utf-8'))
+    yield sink.drain()
+
+
+def export_response(fmt, columns, records, filename):
+    """Stream ``records`` as a CSV or XLSX download named ``filename.<fmt>``.
+
+    ``records`` can be any iterable; it is consumed while the response is
+    sent, so the file is never assembled in memory.
+    """
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+    chunks = iter_csv(columns, records) if fmt == 'csv' else iter_xlsx(columns, records, sheet=filename[:31])
+    response = Response(stream_with_context(chunks), mimetype=_MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    # Let proxies pass chunks through instead of buffering the whole download
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,102 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, make_response, request, session
+
+# Rendered pages kept per worker
+MAX_CACHED_PAGES = 256
+# Content-addressed uploads (see product_catalog.images) never change
+IMMUTABLE_PATH_RE = re.compile(r'^/static/uploads/products/(thumbs/\w+/)?[0-9a-f]{32}\.\w+$')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# What the default build identifier is taken from, relative to the app root
+BUILD_PATHS = ('app.py', 'modules', 'templates', 'static')
+BUILD_EXCLUDED_DIRS = ('__pycache__', 'uploads')
+
+_pages = OrderedDict()
+_pages_lock = threading.Lock()
+
+
+def _remember(key, response):
+    with _pages_lock:
+        _pages[key] = (response.get_data(), response.mimetype)
+        _pages.move_to_end(key)
+        while len(_pages) > MAX_CACHED_PAGES:
+            _pages.popitem(last=False)
+
+
+def _recall(key):
+    with _pages_lock:
+        page = _pages.get(key)
+        if page is not None:
+            _pages.move_to_end(key)
+        return page
+
+
+def build_id(root):
+    """Identify the code and templates under ``root`` by their newest mtime.
+
+    Used as the default ``BUILD_ID``, so ETags of cached pages change with a
+    deploy. Uploaded files are left out: they are data, not code.
+    """
+    newest = 0
+    for name in BUILD_PATHS:
+        path = os.path.join(root, name)
+        if os.path.isfile(path):
+            newest = max(newest, os.path.getmtime(path))
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames[:] = [dirname for dirname in dirnames if dirname not in BUILD_EXCLUDED_DIRS]
+            for filename in filenames:
+                newest = max(newest, os.path.getmtime(os.path.join(dirpath, filename)))
+    return str(int(newest))
+
+
+def cached_page(*version_funcs):
+    """Cache a GET view's HTML until the data it shows changes.
+
+    ``version_funcs`` return the versions of the collections the page is
+    built from (e.g. ``models.data_version``) or anything else the page
+    depends on, such as today's date. Together with the endpoint and its
+    query arguments and the app's ``BUILD_ID`` they form the cache key and a
+    strong ETag, so unchanged pages are answered with 304 or from memory
+    without touching templates, until the data or the deployed code changes.
+    Pages with pending flash messages are never cached.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or session.get('_flashes'):
+                return view(*args, **kwargs)
+            key = (current_app.config.get('BUILD_ID'),
+                   request.endpoint,
+                   tuple(sorted(kwargs.items())),
+                   tuple(sorted(request.args.items(multi=True))),
+                   tuple(str(func()) for func in version_funcs))
+            etag = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+            else:
+                page = _recall(key)
+                if page is not None:
+                    response = make_response(page[0])
+                    response.mimetype = page[1]
+                else:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.is_streamed:
+                        return response
+                    _remember(key, response)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+def add_immutable_cache_headers(response):
+    """``after_request`` hook giving hashed upload URLs far-future caching."""
+    if response.status_code == 200 and IMMUTABLE_PATH_RE.match(request.path):
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
@@ -0,0 +1,100 @@
+import csv
+
+from ..accounts_receivable.models import clean_entry_data, add_entries
+from ..cash_and_banks.models import clean_transaction_data, add_transactions
+from ..product_catalog.models import clean_product_data, upsert_products
+from ..storage import ClosedPeriodError
+
+# Rows validated before each store write
+DEFAULT_BATCH_SIZE = 500
+
+
+def _save_entries(entries):
+    add_entries(entries)
+    return len(entries), 0
+
+
+def _save_transactions(transactions):
+    add_transactions(transactions)
+    return len(transactions), 0
+
+
+# kind: (label, required columns, validate a row, save a batch -> (created, updated))
+IMPORTERS = {
+    'products': ('Products', ('product_code', 'name', 'series'), clean_product_data, upsert_products),
+    'ar': ('Accounts receivable', ('date', 'name', 'concept', 'amount'), clean_entry_data, _save_entries),
+    'cash': ('Cash and bank transactions', ('date', 'concept', 'amount', 'type'), clean_transaction_data, _save_transactions),
+}
+
+
+class ImportReport:
+    def __init__(self, kind):
+        self.kind = kind
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.errors = []  # (line number, message)
+        # Set when the import stops partway: (line number, message)
+        self.stopped = None
+        # Last line of the file whose rows are all saved
+        self.saved_line = 1
+
+    @property
+    def imported(self):
+        return self.created + self.updated
+
+
+def import_csv(kind, stream, batch_size=DEFAULT_BATCH_SIZE):
+    """Import the CSV text ``stream`` into the collection for ``kind``.
+
+    Rows are read and validated one at a time with the same rules as the
+    forms, and every ``batch_size`` valid rows are saved with a single store
+    write, so memory use and the number of writes don't depend on the size
+    of the file. Invalid rows are skipped and reported by line number.
+    Column names are matched case-insensitively. Raises ValueError if a
+    required column is missing.
+
+    Batches saved before an unreadable line or a failed write stay saved, so
+    such an error doesn't propagate: it ends the import and is recorded in
+    ``report.stopped``, with ``report.saved_line`` telling how far the file
+    was saved.
+    """
+    label, required, clean, save = IMPORTERS[kind]
+    report = ImportReport(kind)
+    reader = csv.DictReader(stream)
+    if reader.fieldnames is None:
+        return report
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    missing = [name for name in required if name not in reader.fieldnames]
+    if missing:
+        raise ValueError(f"Missing column(s): {', '.join(missing)}")
+
+    batch = []
+
+    def flush():
+        created, updated = save(batch)
+        report.created += created
+        report.updated += updated
+        report.saved_line = reader.line_num
+        batch.clear()
+
+    try:
+        for row in reader:
+            report.rows += 1
+            row.pop(None, None)  # extra cells without a header
+            try:
+                batch.append(clean(row))
+            except ValueError as e:
+                report.errors.append((reader.line_num, str(e)))
+                continue
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+        else:
+            report.saved_line = reader.line_num
+    except (ValueError, csv.Error, ClosedPeriodError) as e:
+        # UnicodeDecodeError is a ValueError too; ClosedPeriodError means the
+        # period was closed while the file was being imported
+        report.stopped = (reader.line_num, str(e))
+    return report
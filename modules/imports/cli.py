@@ -0,0 +1,26 @@
+import click
+from flask.cli import AppGroup
+
+from . import import_csv, IMPORTERS, DEFAULT_BATCH_SIZE
+
+import_cli = AppGroup('import', help='Bulk-import CSV files.')
+
+
+@import_cli.command('csv')
+@click.argument('kind', type=click.Choice(sorted(IMPORTERS)))
+@click.argument('csv_file', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True, help='Rows per store write.')
+def import_csv_command(kind, csv_file, batch_size):
+    """Import products (upserted by product_code), AR entries or cash transactions."""
+    try:
+        report = import_csv(kind, csv_file, batch_size=batch_size)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    for line, message in report.errors:
+        click.echo(f'line {line}: {message}', err=True)
+    click.echo(f'{report.rows} rows read: {report.created} created, {report.updated} updated, '
+               f'{len(report.errors)} rejected.')
+    if report.stopped:
+        line, message = report.stopped
+        raise click.ClickException(f'stopped after line {line}: {message}. '
+                                   f'Rows up to line {report.saved_line} were saved; later rows were not.')
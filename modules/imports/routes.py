@@ -0,0 +1,39 @@
+import io
+
+from flask import Blueprint, render_template, request, redirect, url_for, flash
+from . import import_csv, IMPORTERS
+
+# Errors listed on the result page; the counts always cover every row
+MAX_ERRORS_SHOWN = 200
+
+imports_bp = Blueprint(
+    'imports_bp',
+    __name__,
+    template_folder='../../templates/imports',
+    static_folder='../../static'
+)
+
+@imports_bp.route('/', methods=['GET', 'POST'])
+def import_file():
+    if request.method == 'POST':
+        kind = request.form.get('kind')
+        csv_file = request.files.get('csv_file')
+        if kind not in IMPORTERS or not csv_file or not csv_file.filename:
+            flash('Choose what to import and a CSV file.', 'error')
+            return redirect(url_for('imports_bp.import_file'))
+        # Decode the upload as it is read instead of loading it whole
+        stream = io.TextIOWrapper(csv_file.stream, encoding='utf-8-sig', newline='')
+        try:
+            report = import_csv(kind, stream)
+        except ValueError as e:
+            flash(f'Could not import {csv_file.filename}: {e}', 'error')
+            return redirect(url_for('imports_bp.import_file'))
+        if report.stopped:
+            line, message = report.stopped
+            flash(f'Import of {csv_file.filename} stopped after line {line}: {message}. '
+                  f'Rows up to line {report.saved_line} were saved; later rows were not.', 'error')
+        flash(f'{report.imported} of {report.rows} rows imported.', 'success' if not (report.errors or report.stopped) else 'info')
+        return render_template('import.html', importers=IMPORTERS, report=report,
+                               errors=report.errors[:MAX_ERRORS_SHOWN], selected=kind)
+
+    return render_template('import.html', importers=IMPORTERS, report=None, selected=request.args.get('kind'))
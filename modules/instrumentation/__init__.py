@@ -0,0 +1,138 @@
+"""Opt-in per-request instrumentation.
+
+Code on hot paths marks what it is doing with ``timed(phase)`` (or the
+``measured(phase)`` decorator) and ``count(counter)``. Both do nothing
+unless the current thread is measuring a request (see ``web.init_app``),
+so they are cheap to leave in place when instrumentation is off.
+
+Phases are timed exclusively: time spent in a nested phase (say a JSON
+parse during a storage read) is only counted for the inner one, so the
+phases of a request add up to at most its total time.
+"""
+import threading
+import time
+from functools import wraps
+
+PHASES = ('storage_read', 'json_parse', 'storage_write', 'lock_wait', 'aggregate', 'render')
+COUNTERS = ('file_reads', 'file_writes', 'file_stats', 'bytes_read', 'bytes_written', 'sql_statements')
+
+_settings = {'enabled': False}
+_local = threading.local()
+
+
+class RequestStats:
+    """Time per phase and operation counts for one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.status = None
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        # [phase, start of its current slice] for each open phase
+        self._open = []
+
+    def enter(self, phase):
+        now = time.perf_counter()
+        if self._open:
+            outer = self._open[-1]
+            self.phases[outer[0]] += now - outer[1]
+        self._open.append([phase, now])
+
+    def exit(self):
+        now = time.perf_counter()
+        phase, start = self._open.pop()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - start
+        if self._open:
+            self._open[-1][1] = now
+
+    def finish(self):
+        # Phases left open by an exception are closed at the end
+        while self._open:
+            self.exit()
+        self.finished = time.perf_counter()
+
+    @property
+    def total(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+
+class _Phase:
+    __slots__ = ('stats', 'phase')
+
+    def __init__(self, stats, phase):
+        self.stats = stats
+        self.phase = phase
+
+    def __enter__(self):
+        self.stats.enter(self.phase)
+
+    def __exit__(self, *exc_info):
+        self.stats.exit()
+
+
+class _NoPhase:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_PHASE = _NoPhase()
+
+
+def configure(enabled=False):
+    _settings['enabled'] = bool(enabled)
+
+
+def enabled():
+    return _settings['enabled']
+
+
+def begin():
+    """Start measuring a request on this thread and return its stats."""
+    stats = _local.stats = RequestStats()
+    return stats
+
+
+def end():
+    """Stop measuring on this thread and return the finished stats (or None)."""
+    stats = getattr(_local, 'stats', None)
+    _local.stats = None
+    if stats is not None:
+        stats.finish()
+    return stats
+
+
+def current():
+    return getattr(_local, 'stats', None)
+
+
+def timed(phase):
+    """Context manager attributing the time spent inside it to ``phase``."""
+    stats = getattr(_local, 'stats', None)
+    return _NO_PHASE if stats is None else _Phase(stats, phase)
+
+
+def measured(phase):
+    """Decorator form of ``timed``."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            stats = getattr(_local, 'stats', None)
+            if stats is None:
+                return func(*args, **kwargs)
+            stats.enter(phase)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats.exit()
+        return wrapper
+    return decorator
+
+
+def count(counter, n=1):
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        stats.counters[counter] = stats.counters.get(counter, 0) + n
@@ -0,0 +1,102 @@
+import os
+import threading
+from bisect import bisect_left
+
+from . import PHASES
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _RouteMetrics:
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.seconds = 0.0
+        self.phases = {}
+        self.counters = {}
+        self.statuses = {}
+
+
+class Registry:
+    """Request metrics of this worker process, by route and method.
+
+    Every worker keeps its own registry (like the store cache counters), so
+    each series carries a ``worker`` label with the process id.
+    """
+
+    def __init__(self):
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route, method, status, stats):
+        with self._lock:
+            metrics = self._routes.get((route, method))
+            if metrics is None:
+                metrics = self._routes[(route, method)] = _RouteMetrics()
+            total = stats.total
+            metrics.buckets[bisect_left(LATENCY_BUCKETS, total)] += 1
+            metrics.count += 1
+            metrics.seconds += total
+            for phase, seconds in stats.phases.items():
+                metrics.phases[phase] = metrics.phases.get(phase, 0.0) + seconds
+            for counter, n in stats.counters.items():
+                metrics.counters[counter] = metrics.counters.get(counter, 0) + n
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+    def render(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        worker = str(os.getpid())
+        with self._lock:
+            routes = sorted(self._routes.items())
+            lines = [
+                '# HELP erp_request_duration_seconds Request latency by route.',
+                '# TYPE erp_request_duration_seconds histogram',
+            ]
+            for (route, method), metrics in routes:
+                labels = {'route': route, 'method': method, 'worker': worker}
+                cumulative = 0
+                for bound, n in zip(LATENCY_BUCKETS + ('+Inf',), metrics.buckets):
+                    cumulative += n
+                    lines.append(_sample('erp_request_duration_seconds_bucket', dict(labels, le=str(bound)), cumulative))
+                lines.append(_sample('erp_request_duration_seconds_sum', labels, metrics.seconds))
+                lines.append(_sample('erp_request_duration_seconds_count', labels, metrics.count))
+
+            lines += ['# HELP erp_requests_total Requests by route and response status.',
+                      '# TYPE erp_requests_total counter']
+            for (route, method), metrics in routes:
+                for status, n in sorted(metrics.statuses.items()):
+                    lines.append(_sample('erp_requests_total',
+                                         {'route': route, 'method': method, 'status': str(status), 'worker': worker}, n))
+
+            lines += ['# HELP erp_request_phase_seconds_total Time spent per phase ('
+                      + ', '.join(PHASES) + ') by route.',
+                      '# TYPE erp_request_phase_seconds_total counter']
+            for (route, method), metrics in routes:
+                for phase, seconds in sorted(metrics.phases.items()):
+                    lines.append(_sample('erp_request_phase_seconds_total',
+                                         {'route': route, 'method': method, 'phase': phase, 'worker': worker}, seconds))
+
+            lines += ['# HELP erp_request_operations_total File and database operations by route.',
+                      '# TYPE erp_request_operations_total counter']
+            for (route, method), metrics in routes:
+                for counter, n in sorted(metrics.counters.items()):
+                    lines.append(_sample('erp_request_operations_total',
+                                         {'route': route, 'method': method, 'operation': counter, 'worker': worker}, n))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _sample(name, labels, value):
+    label_text = ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+    return f'{name}{{{label_text}}} {value!r}' if isinstance(value, float) else f'{name}{{{label_text}}} {value}'
+
+
+registry = Registry()
@@ -0,0 +1,106 @@
+import cProfile
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+from flask import Response, before_render_template, g, request, template_rendered
+
+from . import begin, configure, current, end
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Profiles kept on disk at most; further slow requests are only logged
+MAX_PROFILES = 200
+
+# cProfile can only profile one request at a time per process
+_profiler_lock = threading.Lock()
+
+
+def init_app(app):
+    """Install the request hooks if ``INSTRUMENTATION`` is on in ``app.config``.
+
+    Each measured request gets a ``Server-Timing`` header with its phase
+    breakdown and is recorded in the metrics served at ``/metrics``. With
+    ``PROFILE_SLOW_REQUESTS_MS`` set (which also turns instrumentation on),
+    a ``PROFILE_SAMPLE_RATE`` fraction of requests run under cProfile and
+    the stats of those slower than the threshold are dumped to
+    ``PROFILE_DIR`` for ``python -m pstats`` or snakeviz.
+    """
+    slow_ms = app.config.get('PROFILE_SLOW_REQUESTS_MS')
+    if not (app.config.get('INSTRUMENTATION') or slow_ms):
+        return
+    configure(enabled=True)
+    # Relative to the working directory, like the data files
+    profile_dir = app.config.get('PROFILE_DIR', 'profiles')
+    sample_rate = float(app.config.get('PROFILE_SAMPLE_RATE', 1.0))
+
+    @app.before_request
+    def start_measuring():
+        begin()
+        if slow_ms and random.random() < sample_rate and _profiler_lock.acquire(blocking=False):
+            g._profiler = cProfile.Profile()
+            g._profiler.enable()
+
+    @app.after_request
+    def add_server_timing(response):
+        stats = current()
+        if stats is not None:
+            stats.status = response.status_code
+            # Shown per request in the browser's network panel
+            response.headers['Server-Timing'] = ', '.join(
+                [f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in stats.phases.items() if seconds] +
+                [f'total;dur={stats.total * 1000:.2f}'])
+        return response
+
+    # Runs after a streamed response has been sent, so exports are timed in full
+    @app.teardown_request
+    def finish_measuring(exc):
+        profiler = g.pop('_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            _profiler_lock.release()
+        stats = end()
+        if stats is None:
+            return
+        route = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+        status = 500 if exc is not None or stats.status is None else stats.status
+        registry.observe(route, request.method, status, stats)
+        if profiler is not None and stats.total * 1000 >= slow_ms:
+            _dump_profile(profiler, profile_dir, request.endpoint or 'unmatched', stats)
+
+    before_render_template.connect(_start_render, app)
+    template_rendered.connect(_end_render, app)
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+def _start_render(sender, template, context, **extra):
+    stats = current()
+    if stats is not None:
+        stats.enter('render')
+
+
+def _end_render(sender, template, context, **extra):
+    stats = current()
+    if stats is not None:
+        stats.exit()
+
+
+def _dump_profile(profiler, directory, endpoint, stats):
+    os.makedirs(directory, exist_ok=True)
+    breakdown = ', '.join(f'{phase} {seconds * 1000:.1f}ms' for phase, seconds in stats.phases.items() if seconds)
+    if len(os.listdir(directory)) >= MAX_PROFILES:
+        logger.warning('Slow request %s %s: %.1fms (%s); profile not kept, %s is full',
+                       request.method, request.path, stats.total * 1000, breakdown, directory)
+        return
+    name = '{}-{}-{}-{:.0f}ms.prof'.format(time.strftime('%Y%m%d-%H%M%S'), os.getpid(),
+                                           re.sub(r'[^\w.]+', '_', endpoint), stats.total * 1000)
+    profiler.dump_stats(os.path.join(directory, name))
+    logger.warning('Slow request %s %s: %.1fms (%s); profile in %s',
+                   request.method, request.path, stats.total * 1000, breakdown, name)
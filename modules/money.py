@@ -0,0 +1,111 @@
+"""Money as integer cents.
+
+Amounts are stored and added up as whole cents under ``<field>_cents`` keys
+(``amount_cents``, ``price_unit_cents``...), so totals are exact. Parsing
+and formatting happen at the edges: ``to_cents`` reads what forms, CSV
+files and the API send, ``format_cents`` and ``cents_to_number`` turn cents
+back into amounts for pages, exports and JSON.
+
+Records saved before amounts were kept in cents hold a float under the
+plain field name; ``upgrade_amounts`` converts them as they are loaded.
+"""
+import logging
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+logger = logging.getLogger(__name__)
+
+CENTS_SUFFIX = '_cents'
+_CENT = Decimal('0.01')
+
+
+def cents_field(field):
+    return field + CENTS_SUFFIX
+
+
+def to_cents(value):
+    """Parse an amount (a string, int, float or Decimal) into integer cents.
+
+    Rounds half up to the cent. Raises ValueError if ``value`` is not a
+    finite number.
+    """
+    if isinstance(value, bool):
+        raise ValueError(f'{value!r} is not an amount')
+    if isinstance(value, float):
+        # The shortest repr is the decimal that was typed in, e.g. 0.1
+        value = repr(value)
+    elif isinstance(value, str):
+        value = value.strip()
+    try:
+        amount = Decimal(value)
+        if not amount.is_finite():
+            raise ValueError(f'{value!r} is not an amount')
+        return int(amount.quantize(_CENT, rounding=ROUND_HALF_UP).scaleb(2))
+    except (InvalidOperation, TypeError):
+        raise ValueError(f'{value!r} is not an amount')
+
+
+def optional_cents(value):
+    """Like ``to_cents``, but None or a blank string give None."""
+    if value is None or isinstance(value, str) and not value.strip():
+        return None
+    return to_cents(value)
+
+
+def cents_to_decimal(cents):
+    return None if cents is None else Decimal(cents).scaleb(-2)
+
+
+def cents_to_number(cents):
+    """Cents as a float amount, for JSON and spreadsheets.
+
+    ``cents / 100`` is the float closest to the exact amount, so it prints
+    as the amount itself (``1050`` gives ``10.5``), without rounding noise.
+    """
+    return None if cents is None else cents / 100
+
+
+def format_cents(cents):
+    """Format cents as ``'1234.50'`` (``'-0.05'``) without floats.
+
+    A missing or unreadable amount (anything but an int) gives ``''``.
+    """
+    if not isinstance(cents, int) or isinstance(cents, bool):
+        return ''
+    whole, rest = divmod(abs(cents), 100)
+    return f"{'-' if cents < 0 else ''}{whole}.{rest:02d}"
+
+
+def upgrade_amounts(record, fields):
+    """Return ``record`` with legacy float ``fields`` converted to ``<field>_cents``.
+
+    Keys keep their position. A value that is not an amount is left as it
+    was (and counts as no amount). Records already in cents are returned
+    unchanged, so this is cheap to apply to every record loaded.
+    """
+    if not any(field in record for field in fields):
+        return record
+    upgraded = {}
+    for key, value in record.items():
+        if key in fields and cents_field(key) not in record:
+            try:
+                value = optional_cents(value)
+            except ValueError:
+                logger.warning('Keeping unreadable %s %r of record %s as is', key, value, record.get('id'))
+            else:
+                key = cents_field(key)
+        upgraded[key] = value
+    return upgraded
+
+
+def with_amounts(record, fields):
+    """Return a copy of ``record`` showing each ``<field>_cents`` as ``<field>``.
+
+    The amounts are numbers (see ``cents_to_number``); this is the shape the
+    JSON API and exports use.
+    """
+    shown = {}
+    for key, value in record.items():
+        if key.endswith(CENTS_SUFFIX) and key[:-len(CENTS_SUFFIX)] in fields:
+            key, value = key[:-len(CENTS_SUFFIX)], cents_to_number(value)
+        shown[key] = value
+    return shown
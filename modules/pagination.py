@@ -0,0 +1,61 @@
+from flask import render_template, request, session, stream_template
+
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 1000
+# Pages at least this long are streamed to the browser as they render
+STREAM_THRESHOLD = 200
+
+
+class Page:
+    """One page of a list view plus what the pager needs to link around it."""
+
+    def __init__(self, items, page, per_page, total):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+
+    @property
+    def pages(self):
+        return max(1, -(-self.total // self.per_page))
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def has_next(self):
+        return self.page < self.pages
+
+    @property
+    def prev_num(self):
+        return self.page - 1
+
+    @property
+    def next_num(self):
+        return self.page + 1
+
+
+def get_page_args(default_per_page=DEFAULT_PER_PAGE):
+    """Read ``page`` and ``per_page`` from the query string, clamped to sane values."""
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', default_per_page, type=int)
+    return max(page, 1), min(max(per_page, 1), MAX_PER_PAGE)
+
+
+def paginate(fetch, page, per_page):
+    """Build a Page from ``fetch(offset, limit) -> (items, total)``."""
+    items, total = fetch((page - 1) * per_page, per_page)
+    return Page(items, page, per_page, total)
+
+
+def render_list_page(template_name, page, **context):
+    """Render a list view, streaming it when the page is long.
+
+    Flashed messages are popped from the session while the layout renders,
+    which cannot be saved once streaming has started, so pages with pending
+    messages are always rendered in one go.
+    """
+    if len(page.items) >= STREAM_THRESHOLD and not session.get('_flashes'):
+        return stream_template(template_name, pagination=page, **context)
+    return render_template(template_name, pagination=page, **context)
@@ -0,0 +1,55 @@
+import os
+
+import click
+from flask.cli import AppGroup
+
+from ..money import format_cents
+from .images import schedule_thumbnails, Image
+from .models import (
+    get_all_products, collect_orphaned_product_images, reprice_products, IMAGE_UPLOAD_FOLDER, PRICE_FIELDS, PRODUCT_SERIES
+)
+
+products_cli = AppGroup('products', help='Product catalog maintenance.')
+
+
+@products_cli.command('gc-images')
+def gc_images_command():
+    """Delete uploaded images and thumbnails that no product uses."""
+    removed = collect_orphaned_product_images()
+    for path in removed:
+        click.echo(f'removed {path}')
+    click.echo(f'{len(removed)} orphaned files removed.')
+
+
+@products_cli.command('build-thumbnails')
+def build_thumbnails_command():
+    """Generate any missing thumbnails and placeholders, e.g. for images uploaded before they existed."""
+    if Image is None:
+        raise click.ClickException('Pillow is not installed; run `pip install Pillow`.')
+    filenames = {p['image_filename'] for p in get_all_products() if p.get('image_filename')}
+    jobs = [schedule_thumbnails(name, IMAGE_UPLOAD_FOLDER) for name in sorted(filenames)
+            if os.path.exists(os.path.join(IMAGE_UPLOAD_FOLDER, name))]
+    for job in jobs:
+        job.result()
+    click.echo(f'Checked thumbnails for {len(jobs)} images.')
+
+
+@products_cli.command('reprice')
+@click.argument('series', type=click.Choice(PRODUCT_SERIES))
+@click.argument('field', type=click.Choice(PRICE_FIELDS))
+@click.argument('percent')
+@click.option('--base', type=click.Choice(PRICE_FIELDS), help='Price to start from (default: FIELD itself).')
+@click.option('--dry-run', is_flag=True, help='Only list the new prices.')
+def reprice_command(series, field, percent, base, dry_run):
+    """Set FIELD of every product in SERIES to its base price plus PERCENT, in one write.
+
+    E.g. `flask products reprice rodajes price_unit 5` raises unit prices by
+    5%, and `--base cost` with 30 sets them to cost plus 30%.
+    """
+    try:
+        changes = reprice_products(series, field, percent, base=base, dry_run=dry_run)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    for product, old_cents, new_cents in changes:
+        click.echo(f"{product['product_code']}: {format_cents(old_cents) or 'N/A'} -> {format_cents(new_cents)}")
+    click.echo(f"{len(changes)} products {'would be ' if dry_run else ''}repriced.")
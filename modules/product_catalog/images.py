@@ -0,0 +1,199 @@
+import base64
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.utils import secure_filename
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; without it pages use the originals
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Thumbnails are twice the size they are shown at, for high-density screens
+THUMBNAIL_SIZES = {
+    'grid': (300, 300),
+    'list': (100, 100),
+}
+THUMBNAIL_DIR = 'thumbs'
+# A few pixels of the image, inlined into pages as a blurry preview until
+# the real image has loaded
+PLACEHOLDER_SIZE = (8, 8)
+# Unfinished uploads older than this are treated as garbage
+STALE_UPLOAD_SECONDS = 3600
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def warn_if_unavailable():
+    """Log a warning if Pillow is missing, so pages will show full-size originals."""
+    if Image is None:
+        logger.warning('Pillow is not installed: no thumbnails or previews will be generated '
+                       'and pages will show the original images (pip install -r requirements.txt)')
+
+
+def _thumbnail_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='thumbnails')
+        return _executor
+
+
+def _extension(original_filename):
+    ext = os.path.splitext(secure_filename(original_filename or ''))[1].lower()
+    return ext or '.bin'
+
+
+def save_image(image_file, folder):
+    """Store an upload under the SHA-256 of its content and return the filename.
+
+    Identical uploads share one file. The name never changes for a given
+    content, so it can be cached by browsers forever.
+    """
+    os.makedirs(folder, exist_ok=True)
+    digest = hashlib.sha256()
+    tmp_path = os.path.join(folder, f'.upload-{os.getpid()}-{threading.get_ident()}')
+    with open(tmp_path, 'wb') as f:
+        for chunk in iter(lambda: image_file.stream.read(64 * 1024), b''):
+            digest.update(chunk)
+            f.write(chunk)
+    filename = digest.hexdigest()[:32] + _extension(image_file.filename)
+    final_path = os.path.join(folder, filename)
+    if os.path.exists(final_path):
+        os.remove(tmp_path)
+        # Marks it as in use for collect_orphaned_images
+        os.utime(final_path)
+    else:
+        os.replace(tmp_path, final_path)
+    schedule_thumbnails(filename, folder)
+    return filename
+
+
+def thumbnail_name(filename, size):
+    return f'{THUMBNAIL_DIR}/{size}/{os.path.splitext(filename)[0]}.jpg'
+
+
+def placeholder_name(filename):
+    return f'{THUMBNAIL_DIR}/placeholder/{os.path.splitext(filename)[0]}.png'
+
+
+def _make_thumbnails(filename, folder):
+    source = os.path.join(folder, filename)
+    # name -> (box, format, save options)
+    targets = {thumbnail_name(filename, size): (box, 'JPEG', {'quality': 80, 'optimize': True})
+               for size, box in THUMBNAIL_SIZES.items()}
+    targets[placeholder_name(filename)] = (PLACEHOLDER_SIZE, 'PNG', {'optimize': True})
+    try:
+        with Image.open(source) as image:
+            image = image.convert('RGB')
+            for name, (box, image_format, options) in targets.items():
+                target = os.path.join(folder, name)
+                if os.path.exists(target):
+                    continue
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                thumb = image.copy()
+                thumb.thumbnail(box)
+                tmp_target = target + '.tmp'
+                thumb.save(tmp_target, image_format, **options)
+                os.replace(tmp_target, target)
+    except (OSError, ValueError) as e:
+        logger.warning("Could not make thumbnails for %s: %s", source, e)
+
+
+def schedule_thumbnails(filename, folder):
+    """Build the thumbnails and placeholder for ``filename`` in the background, if Pillow is installed."""
+    if Image is None:
+        return None
+    return _thumbnail_executor().submit(_make_thumbnails, filename, folder)
+
+
+def image_url_filename(filename, size, folder):
+    """Path under the uploads folder to show ``filename`` at ``size``.
+
+    Falls back to the original until its thumbnail has been generated.
+    """
+    thumbnail = thumbnail_name(filename, size)
+    if os.path.exists(os.path.join(folder, thumbnail)):
+        return thumbnail
+    return filename
+
+
+def thumbnails_version(folder):
+    """Changes whenever a thumbnail or placeholder is added or removed.
+
+    Pages showing images depend on it as well as on the catalog: until an
+    upload's thumbnails exist they link the original instead. It is the
+    modification times of the thumbnail directories, which any process
+    writing them (the background task, ``flask products build-thumbnails``)
+    updates.
+    """
+    version = []
+    for name in list(THUMBNAIL_SIZES) + ['placeholder']:
+        try:
+            version.append(os.stat(os.path.join(folder, THUMBNAIL_DIR, name)).st_mtime_ns)
+        except OSError:
+            version.append(None)
+    return tuple(version)
+
+
+# filename -> data URI; uploads never change, so neither do their placeholders
+_placeholders = {}
+
+
+def placeholder_data_uri(filename, folder):
+    """The placeholder of ``filename`` as a ``data:`` URI, or None until it exists."""
+    uri = _placeholders.get(filename)
+    if uri is None:
+        try:
+            with open(os.path.join(folder, placeholder_name(filename)), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        uri = _placeholders[filename] = 'data:image/png;base64,' + base64.b64encode(data).decode('ascii')
+    return uri
+
+
+def _image_files(filename, folder):
+    yield os.path.join(folder, filename)
+    for size in THUMBNAIL_SIZES:
+        yield os.path.join(folder, thumbnail_name(filename, size))
+    yield os.path.join(folder, placeholder_name(filename))
+
+
+def collect_orphaned_images(referenced, folder):
+    """Delete uploads and thumbnails that no product refers to.
+
+    ``referenced`` is the set of image filenames still in use. Images
+    uploaded (or uploaded again) within ``STALE_UPLOAD_SECONDS`` are kept
+    too, with their thumbnails: the product using them may not be saved
+    yet. Returns the paths that were removed.
+    """
+    now = time.time()
+    referenced = set(referenced)
+    if os.path.isdir(folder):
+        for entry in os.scandir(folder):
+            if entry.is_file() and now - entry.stat().st_mtime < STALE_UPLOAD_SECONDS:
+                referenced.add(entry.name)
+    keep = set()
+    for filename in referenced:
+        keep.update(os.path.normpath(p) for p in _image_files(filename, folder))
+    removed = []
+    for root, _, files in os.walk(folder):
+        for name in files:
+            path = os.path.normpath(os.path.join(root, name))
+            if path in keep:
+                continue
+            if name.startswith('.upload-') or name.endswith('.tmp'):
+                # Possibly an upload in progress
+                if now - os.path.getmtime(path) < STALE_UPLOAD_SECONDS:
+                    continue
+            os.remove(path)
+            removed.append(path)
+    return removed
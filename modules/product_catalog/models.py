@@ -1,7 +1,11 @@
-import json
 import uuid
 import os
-from werkzeug.utils import secure_filename
+from ..money import cents_field, optional_cents, upgrade_amounts
+from ..startup import on_warm_up
+from ..storage import get_store, HashIndex, UniqueIndex, DuplicateKeyError, retry_on_conflict
+from .search import SearchIndex
+from .pricing import SeriesPricing, parse_percent, product_pricing, repriced_cents
+from .images import save_image, collect_orphaned_images
 
 DATA_FILE = 'product_catalog.json'
 IMAGE_UPLOAD_FOLDER = 'static/uploads/products/' # Relative to the app's static folder
@@ -11,19 +15,26 @@ PRODUCT_SERIES = [
     "propulsores", "canastillas", "rodajes", "cajas", "otros"
 ]
 
+PRICE_FIELDS = ('price_fox', 'cost', 'price_wholesale', 'price_unit')
+# How prices are stored: in cents, as price_fox_cents etc. (see money)
+PRICE_CENTS_FIELDS = tuple(cents_field(field) for field in PRICE_FIELDS)
+
+_search_index = SearchIndex()
+_pricing = SeriesPricing()
+
+def _upgrade(product):
+    # Products saved before prices were kept in cents
+    return upgrade_amounts(product, PRICE_FIELDS)
+
+_store = get_store(DATA_FILE, indexes=[HashIndex('series'), UniqueIndex('product_code'), HashIndex('image_filename')], views=[_search_index, _pricing], upgrade=_upgrade)
+
 def _ensure_data_file_exists():
-    if not os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'w') as f:
-            json.dump([], f)
-    else:
-        try:
-            with open(DATA_FILE, 'r') as f:
-                data = json.load(f)
-                if not isinstance(data, list):
-                    raise ValueError("Data is not a list")
-        except (json.JSONDecodeError, ValueError, FileNotFoundError):
-            with open(DATA_FILE, 'w') as f:
-                json.dump([], f)
+    _store.ensure_exists()
+
+@on_warm_up
+def _build_search_index():
+    # Otherwise built by the first search; see SearchIndex
+    _store.read(_search_index.index_pending)
 
 def _ensure_image_upload_folder_exists():
     # Create the full path by joining with the 'static' directory,
@@ -61,119 +72,235 @@ def _ensure_image_upload_folder_exists():
         os.makedirs(IMAGE_UPLOAD_FOLDER, exist_ok=True)
 
 
-def get_all_products():
-    _ensure_data_file_exists()
+def data_version():
+    # Changes on every write to the collection; used for HTTP caching
+    return _store.version()
+
+def clean_product_data(data):
+    """Validate product fields from a form or CSV row.
+
+    Prices are returned in cents as ``price_fox_cents`` etc. and blank ones
+    become None. Fields missing from ``data`` are left out. Raises ValueError with a message for the
+    user if the data is invalid.
+    """
+    cleaned = {}
+    for field in ('product_code', 'name', 'series') + PRICE_FIELDS:
+        if field in data:
+            value = data.get(field)
+            cleaned[field] = value.strip() if isinstance(value, str) else value
+    if not all([cleaned.get('product_code'), cleaned.get('name'), cleaned.get('series')]):
+        raise ValueError('Product Code, Name, and Series are required.')
+    if cleaned['series'] not in PRODUCT_SERIES:
+        raise ValueError(f"Unknown series {cleaned['series']!r}.")
     try:
-        with open(DATA_FILE, 'r') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, FileNotFoundError):
-        return []
+        for field in PRICE_FIELDS:
+            if field in cleaned:
+                cleaned[cents_field(field)] = optional_cents(cleaned.pop(field))
+    except ValueError:
+        raise ValueError('Invalid number format for one of the price/cost fields.')
+    return cleaned
+
+def upsert_products(products):
+    """Create or update cleaned products by ``product_code`` in one store write.
+
+    Existing products keep their id, image and any field not given. A code
+    repeated in ``products`` is applied in order. If another request changes
+    one of the products meanwhile, the rows are applied again on top of it.
+    Returns ``(created, updated)``.
+    """
+    def upsert():
+        pending = {}
+        existing = []
+        created = updated = 0
+        for data in products:
+            code = data['product_code']
+            current = pending.get(code)
+            if current is None:
+                current = get_product_by_code(code)
+                if current is not None:
+                    existing.append(current)
+            if current is None:
+                created += 1
+                current = {'id': str(uuid.uuid4()), 'product_code': code, 'image_filename': None}
+                current.update({field: None for field in PRICE_CENTS_FIELDS})
+            elif code not in pending:
+                updated += 1
+            pending[code] = dict(current, **data)
+        _store.write_batch(list(pending.values()), expected=existing)
+        return created, updated
+    return retry_on_conflict(upsert)
+
+def apply_batch(creates=(), updates=None, deletes=(), expected=()):
+    """Create, update and delete products in a single store write.
+
+    ``creates`` are cleaned products (without images), ``updates`` maps ids
+    to cleaned fields and ``deletes`` lists ids; unknown ids are skipped.
+    Raises DuplicateKeyError if a product code would be used twice, and
+    ConflictError if a record in ``expected`` (e.g. the products
+    ``updates`` were made from) changed. Returns the created and the
+    updated products.
+    """
+    updates = updates or {}
+    created = []
+    for data in creates:
+        product = {'id': str(uuid.uuid4()), 'image_filename': None}
+        product.update({field: None for field in PRICE_CENTS_FIELDS})
+        product.update(data)
+        created.append(product)
+    updated = [dict(product, **updates[product['id']]) for product in _store.get_many(updates)]
+    codes = [product['product_code'] for product in created + updated]
+    if len(codes) != len(set(codes)):
+        duplicate = next(code for code in codes if codes.count(code) > 1)
+        raise DuplicateKeyError('product_code', duplicate)
+    _store.write_batch(created + updated, deletes, expected=expected)
+    return created, updated
+
+def get_all_products():
+    return _store.all()
 
 def add_product(data, image_file):
+    # Refuse duplicate codes before the image is saved; the store re-checks
+    # under its write lock. Raises DuplicateKeyError.
+    if data.get('product_code') and get_product_by_code(data.get('product_code')):
+        raise DuplicateKeyError('product_code', data.get('product_code'))
     _ensure_image_upload_folder_exists()
-    products = get_all_products()
     
     filename = None
     if image_file and image_file.filename:
-        filename = secure_filename(image_file.filename)
-        # The UPLOAD_FOLDER config in Flask app should point to the correct absolute path
-        # For now, we construct it assuming IMAGE_UPLOAD_FOLDER is relative to project root
-        image_save_path = os.path.join(IMAGE_UPLOAD_FOLDER, filename)
-        image_file.save(image_save_path)
+        # Stored under a hash of its content; thumbnails are made in the background
+        filename = save_image(image_file, IMAGE_UPLOAD_FOLDER)
 
     new_product = {
         'id': str(uuid.uuid4()),
         'product_code': data.get('product_code'),
         'name': data.get('name'),
-        'price_fox': data.get('price_fox'),
-        'cost': data.get('cost'),
-        'price_wholesale': data.get('price_wholesale'),
-        'price_unit': data.get('price_unit'),
+        'price_fox_cents': data.get('price_fox_cents'),
+        'cost_cents': data.get('cost_cents'),
+        'price_wholesale_cents': data.get('price_wholesale_cents'),
+        'price_unit_cents': data.get('price_unit_cents'),
         'series': data.get('series'),
         'image_filename': filename
     }
-    products.append(new_product)
-    with open(DATA_FILE, 'w') as f:
-        json.dump(products, f, indent=4)
-    return new_product
+    return _store.insert(new_product)
 
 def get_product_by_id(product_id):
-    products = get_all_products()
-    for product in products:
-        if product['id'] == product_id:
-            return product
-    return None
+    return _store.get(product_id)
+
+def get_product_by_code(product_code):
+    return _store.find_one('product_code', product_code)
 
 def update_product(product_id, data, image_file=None):
+    """Apply the cleaned ``data`` (and a new image, if given) to a product.
+
+    The product is written back only if nobody changed it since it was
+    read; otherwise ``data`` is applied again on top of the new version.
+    Returns the updated product, or None if there is no such product.
+    Raises DuplicateKeyError if the code belongs to another product.
+    """
     _ensure_image_upload_folder_exists()
-    products = get_all_products()
-    product_found = False
-    for i, product in enumerate(products):
-        if product['id'] == product_id:
-            # Handle image update
-            if image_file and image_file.filename:
-                # Delete old image if it exists and is different
-                if product.get('image_filename'):
-                    old_image_path = os.path.join(IMAGE_UPLOAD_FOLDER, product['image_filename'])
-                    if os.path.exists(old_image_path):
-                        # Only delete if the new filename is different, or if we always replace
-                        # For simplicity, let's assume we might be overwriting with the same name
-                        # or a new name. If it's a new name, the old one should be deleted.
-                        # If it's the same name, werkzeug.secure_filename will handle it.
-                         pass # Decide on deletion strategy later if needed.
-
-                filename = secure_filename(image_file.filename)
-                image_save_path = os.path.join(IMAGE_UPLOAD_FOLDER, filename)
-                image_file.save(image_save_path)
-                products[i]['image_filename'] = filename
-            
-            # Update other fields
-            products[i]['product_code'] = data.get('product_code', product['product_code'])
-            products[i]['name'] = data.get('name', product['name'])
-            products[i]['price_fox'] = data.get('price_fox', product['price_fox'])
-            products[i]['cost'] = data.get('cost', product['cost'])
-            products[i]['price_wholesale'] = data.get('price_wholesale', product['price_wholesale'])
-            products[i]['price_unit'] = data.get('price_unit', product['price_unit'])
-            products[i]['series'] = data.get('series', product['series'])
-            product_found = True
-            break
-            
-    if product_found:
-        with open(DATA_FILE, 'w') as f:
-            json.dump(products, f, indent=4)
-        return products[i] if product_found else None # Should be product_found here
-    return None
+    if _store.get(product_id) is None:
+        return None
+    other = get_product_by_code(data.get('product_code'))
+    if other is not None and other['id'] != product_id:
+        raise DuplicateKeyError('product_code', data.get('product_code'))
+
+    image_filename = None
+    if image_file and image_file.filename:
+        image_filename = save_image(image_file, IMAGE_UPLOAD_FOLDER)
+
+    def update():
+        product = _store.get(product_id)
+        if product is None:
+            return None
+        changes = {}
+        if image_filename:
+            changes['image_filename'] = image_filename
+        changes['product_code'] = data.get('product_code', product['product_code'])
+        changes['name'] = data.get('name', product['name'])
+        for field in PRICE_CENTS_FIELDS:
+            changes[field] = data.get(field, product.get(field))
+        changes['series'] = data.get('series', product['series'])
+        updated = dict(product, **changes)
+        _store.write_batch([updated], expected=[product])
+        return updated
+    return retry_on_conflict(update)
 
 
 def delete_product(product_id):
-    products = get_all_products()
-    product_to_delete = None
-    for product in products:
-        if product['id'] == product_id:
-            product_to_delete = product
-            break
-
-    if not product_to_delete:
-        return False
-
-    # Delete image file if it exists
-    if product_to_delete.get('image_filename'):
-        image_path = os.path.join(IMAGE_UPLOAD_FOLDER, product_to_delete['image_filename'])
-        if os.path.exists(image_path):
-            try:
-                os.remove(image_path)
-            except OSError as e:
-                print(f"Error deleting image {image_path}: {e}") # Log this instead of print
-
-    new_products = [p for p in products if p['id'] != product_id]
-    if len(new_products) < len(products):
-        with open(DATA_FILE, 'w') as f:
-            json.dump(new_products, f, indent=4)
-        return True
-    return False
+    # Identical uploads share a file, and another request may be saving a
+    # product with this image right now, so images are only deleted by
+    # collect_orphaned_product_images (`flask products gc-images`)
+    return _store.delete(product_id)
+
+def collect_orphaned_product_images():
+    """Delete uploaded images and thumbnails no product refers to; returns their paths."""
+    referenced = {filename for filename in _store.keys('image_filename') if filename}
+    return collect_orphaned_images(referenced, IMAGE_UPLOAD_FOLDER)
+
+def get_products_page(series_name, offset, limit):
+    # Returns (products, total) for one page, filtered like get_products_by_series
+    if not series_name:
+        return _store.page(offset, limit)
+    return _store.page(offset, limit, field='series', value=series_name)
+
+def get_products_after(series_name, after_id, limit):
+    # Returns (products, cursor) for cursor pagination, filtered like
+    # get_products_by_series; see JsonStore.page_after
+    if not series_name:
+        return _store.page_after(after_id, limit)
+    return _store.page_after(after_id, limit, field='series', value=series_name)
 
 def get_products_by_series(series_name):
-    products = get_all_products()
     if not series_name: # If series_name is empty or None, return all products
-        return products
-    return [product for product in products if product.get('series') == series_name]
+        return get_all_products()
+    return _store.find('series', series_name)
+
+def search_products(query, limit=50):
+    # Accent/case-insensitive match on code, name and series, best matches first
+    product_ids = _store.read(lambda: _search_index.search(query, limit))
+    return _store.get_many(product_ids)
+
+def get_pricing_summary():
+    # Maintained incrementally by the store; see pricing.SeriesPricing
+    return _store.read(lambda: _pricing.summary(PRODUCT_SERIES))
+
+def with_pricing(products):
+    # Pairs each product with its margins per tier, for the pricing page
+    return [(product, product_pricing(product)) for product in products]
+
+def reprice_products(series_name, field, percent, base=None, dry_run=False):
+    """Set ``field`` of every product in ``series_name`` to ``base`` plus ``percent``.
+
+    ``base`` is the price or cost the new price is computed from; by
+    default ``field`` itself, so ``reprice_products('rodajes', 'price_unit',
+    '5')`` raises unit prices of the series by 5%, and ``base='cost'`` with
+    30 sets them to cost plus a 30% markup. Products without a ``base`` are
+    left alone. All changes are saved in one store write, unless
+    ``dry_run``; if another request changes one of the products meanwhile,
+    the series is repriced again from the new figures. Raises ValueError
+    with a message for the user if the rule is invalid. Returns
+    ``(product, old_cents, new_cents)`` for every product whose price
+    changes.
+    """
+    base = base or field
+    if field not in PRICE_FIELDS or base not in PRICE_FIELDS:
+        raise ValueError(f"Prices to reprice are {', '.join(PRICE_FIELDS)}.")
+    if series_name not in PRODUCT_SERIES:
+        raise ValueError(f'Unknown series {series_name!r}.')
+    percent = parse_percent(percent)
+
+    def reprice():
+        changes = []
+        for product in get_products_by_series(series_name):
+            base_cents = product.get(cents_field(base))
+            if base_cents is None:
+                continue
+            old_cents = product.get(cents_field(field))
+            new_cents = repriced_cents(base_cents, percent)
+            if new_cents != old_cents:
+                changes.append((product, old_cents, new_cents))
+        if changes and not dry_run:
+            _store.write_batch([dict(product, **{cents_field(field): new_cents}) for product, _, new_cents in changes],
+                               expected=[product for product, _, _ in changes])
+        return changes
+    return retry_on_conflict(reprice)
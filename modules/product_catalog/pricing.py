@@ -0,0 +1,215 @@
+"""Margins, markups and repricing for the product catalog.
+
+For each price tier a product's margin is the share of the price left
+after cost, ``(price - cost) / price``, and its markup what was added on
+top of cost, ``(price - cost) / cost``. Both are whole basis points
+(hundredths of a percent, ``1250`` is 12.50%), rounded half up, so the
+per-series sums stay exact like the amounts in cents they come from.
+"""
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from ..money import cents_field
+from ..storage import View
+
+# The prices margins are computed for; cost is what they are compared to
+PRICE_TIERS = ('price_fox', 'price_wholesale', 'price_unit')
+COST_FIELD = 'cost'
+_COST_KEY = cents_field(COST_FIELD)
+_PRICE_KEYS = {tier: cents_field(tier) for tier in PRICE_TIERS}
+
+
+def _divide_half_up(numerator, denominator):
+    # numerator / denominator (> 0) rounded half up like money.to_cents,
+    # in integers: this runs for every product the catalog loads
+    quotient = (2 * abs(numerator) + denominator) // (2 * denominator)
+    return quotient if numerator >= 0 else -quotient
+
+
+def _basis_points(numerator, denominator):
+    return _divide_half_up(numerator * 10000, denominator)
+
+
+def format_basis_points(basis_points):
+    """Format basis points as a percentage, ``'12.50%'``; None gives ``''``."""
+    if not isinstance(basis_points, int) or isinstance(basis_points, bool):
+        return ''
+    whole, rest = divmod(abs(basis_points), 100)
+    return f"{'-' if basis_points < 0 else ''}{whole}.{rest:02d}%"
+
+
+def tier_pricing(product, tier):
+    """Margin figures of one price tier of ``product``, or None if it has no price.
+
+    Returns a dict with ``price_cents``, ``margin_cents`` (price minus cost),
+    ``margin_bp`` and ``markup_bp``; the last three are None when the cost is
+    unknown, and a ratio is None when what it divides by is not positive.
+    """
+    price = product.get(_PRICE_KEYS[tier])
+    if price is None:
+        return None
+    cost = product.get(_COST_KEY)
+    figures = {'price_cents': price, 'margin_cents': None, 'margin_bp': None, 'markup_bp': None}
+    if cost is not None:
+        figures['margin_cents'] = price - cost
+        if price > 0:
+            figures['margin_bp'] = _basis_points(price - cost, price)
+        if cost > 0:
+            figures['markup_bp'] = _basis_points(price - cost, cost)
+    return figures
+
+
+def product_pricing(product):
+    """``tier_pricing`` for every tier of ``product``, keyed by tier."""
+    return {tier: tier_pricing(product, tier) for tier in PRICE_TIERS}
+
+
+class _TierStats:
+    # Running figures of one tier over a set of products
+    def __init__(self):
+        self.priced = 0
+        self.price_cents = 0
+        self.margin_count = 0
+        self.margin_bp = 0
+        self.markup_count = 0
+        self.markup_bp = 0
+        # How many products have each margin, for the lowest and highest;
+        # those are cached in _bounds, which is None when unknown
+        self.margins = {}
+        self._bounds = None
+
+    def _add_margin(self, margin):
+        self.margins[margin] = self.margins.get(margin, 0) + 1
+        if self._bounds is not None:
+            self._bounds = (min(self._bounds[0], margin), max(self._bounds[1], margin))
+        elif len(self.margins) == 1:
+            self._bounds = (margin, margin)
+
+    def _remove_margin(self, margin):
+        left = self.margins[margin] - 1
+        if left:
+            self.margins[margin] = left
+            return
+        del self.margins[margin]
+        if self._bounds is not None and margin in self._bounds:
+            # Found again by the next summary
+            self._bounds = None
+
+    def bump(self, figures, sign):
+        self.priced += sign
+        self.price_cents += sign * figures['price_cents']
+        margin = figures['margin_bp']
+        if margin is not None:
+            self.margin_count += sign
+            self.margin_bp += sign * margin
+            if sign > 0:
+                self._add_margin(margin)
+            else:
+                self._remove_margin(margin)
+        if figures['markup_bp'] is not None:
+            self.markup_count += sign
+            self.markup_bp += sign * figures['markup_bp']
+
+    def summary(self):
+        if self._bounds is None and self.margins:
+            self._bounds = (min(self.margins), max(self.margins))
+        low, high = self._bounds if self.margins else (None, None)
+        return {
+            'priced': self.priced,
+            'value_cents': self.price_cents,
+            'with_margin': self.margin_count,
+            'min_margin_bp': low,
+            'max_margin_bp': high,
+            'avg_margin_bp': _divide_half_up(self.margin_bp, self.margin_count) if self.margin_count else None,
+            'avg_markup_bp': _divide_half_up(self.markup_bp, self.markup_count) if self.markup_count else None,
+        }
+
+
+class _SeriesStats:
+    def __init__(self):
+        self.products = 0
+        self.costed = 0
+        self.cost_cents = 0
+        self.tiers = {tier: _TierStats() for tier in PRICE_TIERS}
+
+    def bump(self, cost, pricing, sign):
+        self.products += sign
+        if cost is not None:
+            self.costed += sign
+            self.cost_cents += sign * cost
+        for tier, figures in pricing.items():
+            if figures is not None:
+                self.tiers[tier].bump(figures, sign)
+
+    def summary(self):
+        return {
+            'products': self.products,
+            'costed': self.costed,
+            'cost_cents': self.cost_cents,
+            'tiers': {tier: stats.summary() for tier, stats in self.tiers.items()},
+        }
+
+
+class SeriesPricing(View):
+    """Per-series margin and markup statistics of the product catalog.
+
+    Kept up to date by the store on every mutation, so the pricing page
+    reads them instead of walking the catalog. For each series and tier it
+    holds how many products are priced, their summed price and cost (the
+    catalog's value, one unit of each, as there is no stock count), and
+    the lowest, highest and average margin and average markup.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.series = {}
+        self.overall = _SeriesStats()
+
+    def _bump(self, product, sign):
+        series = product.get('series')
+        stats = self.series.get(series)
+        if stats is None:
+            stats = self.series[series] = _SeriesStats()
+        cost, pricing = product.get(_COST_KEY), product_pricing(product)
+        stats.bump(cost, pricing, sign)
+        self.overall.bump(cost, pricing, sign)
+        if not stats.products:
+            del self.series[series]
+
+    def add(self, product):
+        self._bump(product, 1)
+
+    def remove(self, product):
+        self._bump(product, -1)
+
+    def summary(self, series_order=()):
+        """Return ``(rows, overall)``: one summary per series, then all of them.
+
+        Series in ``series_order`` come first, in that order, then any other
+        series found in the data. Each row has ``series``, ``products``,
+        ``costed``, ``cost_cents`` and ``tiers`` (see ``_TierStats.summary``).
+        """
+        names = [name for name in series_order if name in self.series]
+        names += sorted((name for name in self.series if name not in names), key=str)
+        rows = [dict(self.series[name].summary(), series=name) for name in names]
+        return rows, dict(self.overall.summary(), series=None)
+
+
+def parse_percent(value):
+    """Parse a repricing percentage such as ``'5'`` or ``'-2.5'`` into a Decimal.
+
+    Raises ValueError unless it is a finite number above -100.
+    """
+    try:
+        percent = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError(f'{value!r} is not a percentage')
+    if not percent.is_finite() or percent <= -100:
+        raise ValueError('The percentage must be a number above -100.')
+    return percent
+
+
+def repriced_cents(base_cents, percent):
+    """``base_cents`` raised by ``percent`` (lowered if negative), rounded half up to the cent."""
+    return int((Decimal(base_cents) * (100 + percent) / 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
@@ -3,9 +3,20 @@ from werkzeug.utils import secure_filename
 import os
 from .models import (
     get_all_products, add_product, get_product_by_id,
-    update_product, delete_product, get_products_by_series,
-    PRODUCT_SERIES, IMAGE_UPLOAD_FOLDER
+    update_product, delete_product, get_products_by_series, get_products_page, get_products_after, search_products,
+    PRODUCT_SERIES, PRICE_FIELDS, IMAGE_UPLOAD_FOLDER, DuplicateKeyError, data_version, clean_product_data,
+    get_pricing_summary, with_pricing, reprice_products
 )
+from ..http_cache import cached_page
+from ..exports import export_response
+from .images import image_url_filename, placeholder_data_uri, thumbnails_version, warn_if_unavailable
+from .pricing import format_basis_points, PRICE_TIERS
+from ..pagination import Page, get_page_args, paginate, render_list_page
+
+# Product cards rendered with the grid page (about one tablet screen), and
+# per fragment fetched while scrolling
+GRID_FIRST_SCREEN = 12
+GRID_BATCH_SIZE = 24
 
 product_catalog_bp = Blueprint(
     'product_catalog_bp',
@@ -22,58 +33,126 @@ def _configure_upload_folder(app):
     if not os.path.exists(app.config['UPLOAD_FOLDER']):
         os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-@product_catalog_bp.before_app_first_request
-def setup_upload_folder():
-    _configure_upload_folder(current_app)
+# Once, when the blueprint is registered (before_app_first_request is gone
+# from Flask)
+@product_catalog_bp.record_once
+def setup_upload_folder(state):
+    _configure_upload_folder(state.app)
+    warn_if_unavailable()
+
+
+@product_catalog_bp.app_template_global()
+def product_image_url(image_filename, size):
+    # Serves the 'grid'/'list' thumbnail once it exists, the original until then
+    return url_for('static', filename='uploads/products/' + image_url_filename(image_filename, size, IMAGE_UPLOAD_FOLDER))
+
+
+@product_catalog_bp.app_template_global()
+def product_image_placeholder(image_filename):
+    # Tiny inline preview shown while the image loads; None until generated
+    return placeholder_data_uri(image_filename, IMAGE_UPLOAD_FOLDER)
+
+
+def _thumbnails_version():
+    # Pages with images change when their thumbnails are generated
+    return thumbnails_version(IMAGE_UPLOAD_FOLDER)
+
+
+# {{ margin_bp|percent }} shows basis points as e.g. 12.50%
+product_catalog_bp.add_app_template_filter(format_basis_points, 'percent')
 
 
 @product_catalog_bp.route('/', methods=['GET']) # Changed to root of blueprint
 @product_catalog_bp.route('/list/', methods=['GET'])
+@cached_page(data_version, _thumbnails_version)
 def list_products():
     series_filter = request.args.get('series', None)
-    products = get_products_by_series(series_filter)
-    return render_template('pc_list_view.html', products=products, product_series_list=PRODUCT_SERIES, current_series=series_filter)
+    page, per_page = get_page_args()
+    pagination = paginate(lambda offset, limit: get_products_page(series_filter, offset, limit), page, per_page)
+    return render_list_page('pc_list_view.html', pagination, products=pagination.items, product_series_list=PRODUCT_SERIES, current_series=series_filter)
 
 @product_catalog_bp.route('/grid/', methods=['GET'])
+@cached_page(data_version, _thumbnails_version)
 def grid_products():
+    # Only the first screen of cards; the rest come from grid_products_more
+    # as the user scrolls. ?after= continues from a card (the "More" link)
     series_filter = request.args.get('series', None)
-    products = get_products_by_series(series_filter)
-    return render_template('pc_grid_view.html', products=products, product_series_list=PRODUCT_SERIES, current_series=series_filter)
+    products, next_cursor = get_products_after(series_filter, request.args.get('after') or None, GRID_FIRST_SCREEN)
+    return render_template('pc_grid_view.html', products=products, next_cursor=next_cursor, product_series_list=PRODUCT_SERIES, current_series=series_filter)
+
+@product_catalog_bp.route('/grid/more/', methods=['GET'])
+@cached_page(data_version, _thumbnails_version)
+def grid_products_more():
+    # The next cards after ?after= as an HTML fragment, for infinite scroll
+    series_filter = request.args.get('series', None)
+    products, next_cursor = get_products_after(series_filter, request.args.get('after') or None, GRID_BATCH_SIZE)
+    return render_template('_pc_grid_cards.html', products=products, next_cursor=next_cursor, current_series=series_filter)
+
+@product_catalog_bp.route('/pricing/', methods=['GET'])
+@cached_page(data_version)
+def pricing():
+    # Per-series figures come precomputed from the store; ?series= also
+    # lists that series' products with their margins, a page at a time
+    series_filter = request.args.get('series') or None
+    rows, overall = get_pricing_summary()
+    pagination = None
+    if series_filter:
+        page, per_page = get_page_args()
+        pagination = paginate(lambda offset, limit: get_products_page(series_filter, offset, limit), page, per_page)
+    return render_template('pc_pricing.html', series_rows=rows, overall=overall, pagination=pagination,
+                           products=with_pricing(pagination.items) if pagination else [],
+                           price_tiers=PRICE_TIERS, price_fields=PRICE_FIELDS,
+                           product_series_list=PRODUCT_SERIES, current_series=series_filter)
+
+@product_catalog_bp.route('/pricing/reprice/', methods=['POST'])
+def reprice_route():
+    series_name = request.form.get('series', '')
+    try:
+        changes = reprice_products(series_name, request.form.get('field', ''), request.form.get('percent', ''),
+                                   base=request.form.get('base') or None)
+    except ValueError as e:
+        flash(str(e), 'error')
+    else:
+        flash(f'Repriced {len(changes)} products in {series_name}.', 'success')
+    return redirect(url_for('product_catalog_bp.pricing', series=series_name or None))
+
+@product_catalog_bp.route('/export.<fmt>', methods=['GET'])
+def export_products(fmt):
+    # All price columns; ?series= limits the export like the list view filter
+    columns = [('product_code', 'Product Code'), ('name', 'Name'), ('series', 'Series'),
+               ('price_fox_cents', 'Price (FOX)'), ('cost_cents', 'Cost'),
+               ('price_wholesale_cents', 'Wholesale Price'), ('price_unit_cents', 'Unit Price')]
+    products = get_products_by_series(request.args.get('series') or None)
+    return export_response(fmt, columns, products, 'product_catalog')
+
+@product_catalog_bp.route('/search/', methods=['GET'])
+def search_products_route():
+    query = request.args.get('q', '').strip()
+    products = search_products(query) if query else []
+    if query and not products:
+        flash(f'No products match "{query}".', 'info')
+    pagination = Page(products, 1, max(len(products), 1), len(products))
+    return render_template('pc_list_view.html', pagination=pagination, products=products, product_series_list=PRODUCT_SERIES, current_series=None, search_query=query)
 
 @product_catalog_bp.route('/add/', methods=['GET', 'POST'])
 def add_product_route():
     if request.method == 'POST':
-        product_data = {
-            'product_code': request.form.get('product_code'),
-            'name': request.form.get('name'),
-            'price_fox': request.form.get('price_fox'),
-            'cost': request.form.get('cost'),
-            'price_wholesale': request.form.get('price_wholesale'),
-            'price_unit': request.form.get('price_unit'),
-            'series': request.form.get('series')
-        }
-        
         image_file = request.files.get('image')
 
-        if not all([product_data['product_code'], product_data['name'], product_data['series']]):
-            flash('Product Code, Name, and Series are required.', 'error')
-            # Pass current_app.config for UPLOAD_FOLDER if needed directly in template, or rely on static path construction
-            return render_template('pc_form.html', product={}, product_series_list=PRODUCT_SERIES, form_action_url=url_for('product_catalog_bp.add_product_route'))
-
-        # Basic validation for numeric fields
         try:
-            if product_data['price_fox']: product_data['price_fox'] = float(product_data['price_fox'])
-            if product_data['cost']: product_data['cost'] = float(product_data['cost'])
-            if product_data['price_wholesale']: product_data['price_wholesale'] = float(product_data['price_wholesale'])
-            if product_data['price_unit']: product_data['price_unit'] = float(product_data['price_unit'])
-        except ValueError:
-            flash('Invalid number format for one of the price/cost fields.', 'error')
-            return render_template('pc_form.html', product=product_data, product_series_list=PRODUCT_SERIES, form_action_url=url_for('product_catalog_bp.add_product_route'))
+            product_data = clean_product_data(request.form.to_dict())
+        except ValueError as e:
+            flash(str(e), 'error')
+            return render_template('pc_form.html', product=request.form.to_dict(), product_series_list=PRODUCT_SERIES, form_action_url=url_for('product_catalog_bp.add_product_route'))
 
         # Ensure UPLOAD_FOLDER is available
         _configure_upload_folder(current_app)
 
-        add_product(product_data, image_file)
+        try:
+            add_product(product_data, image_file)
+        except DuplicateKeyError:
+            flash('A product with this code already exists.', 'error')
+            return render_template('pc_form.html', product=request.form.to_dict(), product_series_list=PRODUCT_SERIES, form_action_url=url_for('product_catalog_bp.add_product_route'))
         flash('Product added successfully!', 'success')
         return redirect(url_for('product_catalog_bp.list_products'))
 
@@ -88,42 +167,26 @@ def edit_product_route(product_id):
         return redirect(url_for('product_catalog_bp.list_products'))
 
     if request.method == 'POST':
-        product_data = {
-            'product_code': request.form.get('product_code'),
-            'name': request.form.get('name'),
-            'price_fox': request.form.get('price_fox'),
-            'cost': request.form.get('cost'),
-            'price_wholesale': request.form.get('price_wholesale'),
-            'price_unit': request.form.get('price_unit'),
-            'series': request.form.get('series')
-        }
         image_file = request.files.get('image')
 
-        if not all([product_data['product_code'], product_data['name'], product_data['series']]):
-            flash('Product Code, Name, and Series are required.', 'error')
-            return render_template('pc_form.html', product=product, product_series_list=PRODUCT_SERIES, form_action_url=url_for('product_catalog_bp.edit_product_route', product_id=product_id))
-        
-        # Basic validation for numeric fields
         try:
-            if product_data['price_fox']: product_data['price_fox'] = float(product_data['price_fox'])
-            else: product_data['price_fox'] = None # Allow clearing
-            if product_data['cost']: product_data['cost'] = float(product_data['cost'])
-            else: product_data['cost'] = None
-            if product_data['price_wholesale']: product_data['price_wholesale'] = float(product_data['price_wholesale'])
-            else: product_data['price_wholesale'] = None
-            if product_data['price_unit']: product_data['price_unit'] = float(product_data['price_unit'])
-            else: product_data['price_unit'] = None
-        except ValueError:
-            flash('Invalid number format for one of the price/cost fields.', 'error')
+            product_data = clean_product_data(request.form.to_dict())
+        except ValueError as e:
+            flash(str(e), 'error')
             # Repopulate form with current (potentially invalid) data for correction
             current_form_data = product.copy()
             current_form_data.update(request.form.to_dict()) # Merge POSTed values
             return render_template('pc_form.html', product=current_form_data, product_series_list=PRODUCT_SERIES, form_action_url=url_for('product_catalog_bp.edit_product_route', product_id=product_id))
 
-
         _configure_upload_folder(current_app) # Ensure UPLOAD_FOLDER is set
 
-        updated_product = update_product(product_id, product_data, image_file)
+        try:
+            updated_product = update_product(product_id, product_data, image_file)
+        except DuplicateKeyError:
+            flash('A product with this code already exists.', 'error')
+            current_form_data = product.copy()
+            current_form_data.update(request.form.to_dict())
+            return render_template('pc_form.html', product=current_form_data, product_series_list=PRODUCT_SERIES, form_action_url=url_for('product_catalog_bp.edit_product_route', product_id=product_id))
         if updated_product:
             flash('Product updated successfully!', 'success')
         else:
@@ -0,0 +1,192 @@
+import bisect
+import heapq
+import re
+import unicodedata
+
+from ..storage import View
+
+# How much a hit in each field counts towards a product's score
+FIELD_WEIGHTS = {'product_code': 3, 'name': 2, 'series': 1}
+# A query token that is a whole indexed token beats a mere prefix of one
+EXACT_BONUS = 2
+# A query that spells the full product code floats it to the top
+CODE_MATCH_BONUS = 100
+# Shorter query words only match whole tokens, not every token they start
+MIN_PREFIX_LENGTH = 2
+# Words expanding to more tokens than this are checked per candidate instead
+MAX_LOOKUP_EXPANSION = 8
+# Indexing more products than this at once re-sorts the token list instead
+# of inserting each new token
+BULK_INDEX_SIZE = 100
+
+_TOKEN_RE = re.compile(r'[0-9a-z]+')
+
+
+def normalize(text):
+    """Lower-case ``text`` and strip accents ("Ñandú" -> "nandu")."""
+    decomposed = unicodedata.normalize('NFKD', str(text))
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(normalize(text))
+
+
+def _compact_code(code):
+    # "SYN-2T 40" and "syn2t40" should both find the same part
+    return ''.join(tokenize(code))
+
+
+class SearchIndex(View):
+    """Inverted index over product code, name and series.
+
+    ``_postings`` maps each token to ``{product id: weight}`` and
+    ``_tokens`` keeps every distinct token sorted, so a prefix is resolved
+    with two binary searches. The store keeps it in step with the catalog.
+
+    Products are only queued as the store adds them and indexed on the
+    next search, so loading the catalog (on a worker's first request)
+    doesn't pay for tokenizing every product.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._postings = {}
+        self._tokens = []
+        self._documents = {}
+        self._codes = {}
+        # Added products not indexed yet, by id
+        self._pending = {}
+
+    def _document_tokens(self, product):
+        weights = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            value = product.get(field)
+            if not value:
+                continue
+            tokens = tokenize(value)
+            if field == 'product_code':
+                tokens.append(_compact_code(value))
+            for token in tokens:
+                weights[token] = max(weights.get(token, 0), weight)
+        return weights
+
+    def add(self, product):
+        self._pending[product['id']] = product
+
+    def index_pending(self):
+        # Indexes the products queued by add; search does this first
+        pending, self._pending = self._pending, {}
+        new_tokens = []
+        for product in pending.values():
+            weights = self._document_tokens(product)
+            self._documents[product['id']] = weights
+            for token, weight in weights.items():
+                postings = self._postings.get(token)
+                if postings is None:
+                    postings = self._postings[token] = {}
+                    new_tokens.append(token)
+                postings[product['id']] = weight
+            if product.get('product_code'):
+                self._codes.setdefault(_compact_code(product['product_code']), set()).add(product['id'])
+        if len(pending) > BULK_INDEX_SIZE:
+            self._tokens = sorted(self._postings)
+        else:
+            for token in new_tokens:
+                bisect.insort(self._tokens, token)
+
+    def remove(self, product):
+        if self._pending.pop(product['id'], None) is not None:
+            return
+        weights = self._documents.pop(product['id'], {})
+        for token in weights:
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(product['id'], None)
+            if not postings:
+                del self._postings[token]
+                i = bisect.bisect_left(self._tokens, token)
+                del self._tokens[i]
+        if product.get('product_code'):
+            code = _compact_code(product['product_code'])
+            owners = self._codes.get(code)
+            if owners is not None:
+                owners.discard(product['id'])
+                if not owners:
+                    del self._codes[code]
+
+    def _expand(self, query_token):
+        """The indexed tokens that ``query_token`` matches (itself or as a prefix)."""
+        if len(query_token) < MIN_PREFIX_LENGTH:
+            return [query_token] if query_token in self._postings else []
+        start = bisect.bisect_left(self._tokens, query_token)
+        end = bisect.bisect_left(self._tokens, query_token + '\U0010ffff', start)
+        return self._tokens[start:end]
+
+    def _score(self, weights, query_token):
+        # Best score of one query word against one product's tokens
+        if len(query_token) < MIN_PREFIX_LENGTH:
+            return weights.get(query_token, 0) * EXACT_BONUS
+        best = 0
+        for token, weight in weights.items():
+            if token.startswith(query_token):
+                best = max(best, weight * (EXACT_BONUS if token == query_token else 1))
+        return best
+
+    def _collect(self, query_token, expansion, candidates):
+        """{product id: score} of ``query_token`` over its expanded tokens.
+
+        With ``candidates`` only those products are considered; the
+        intersection is done on dict key views, which runs in C.
+        """
+        matched = {}
+        for token in expansion:
+            bonus = EXACT_BONUS if token == query_token else 1
+            postings = self._postings[token]
+            product_ids = postings.keys() if candidates is None else postings.keys() & candidates.keys()
+            if not matched:
+                matched = {product_id: postings[product_id] * bonus for product_id in product_ids}
+                continue
+            for product_id in product_ids:
+                score = postings[product_id] * bonus
+                if score > matched.get(product_id, 0):
+                    matched[product_id] = score
+        return matched
+
+    def search(self, query, limit=50):
+        """Ids of the products matching every word of ``query``, best first.
+
+        Candidates come from the most selective word only; the other words
+        are looked up in their postings (or, for very broad prefixes, checked
+        against each candidate's own handful of tokens), so the cost follows
+        the smallest match set rather than the catalog size.
+        """
+        query_tokens = list(dict.fromkeys(tokenize(query)))
+        if not query_tokens:
+            return []
+        self.index_pending()
+        expansions = {token: self._expand(token) for token in query_tokens}
+        cheapest = min(query_tokens,
+                       key=lambda t: sum(len(self._postings[e]) for e in expansions[t]))
+        scores = self._collect(cheapest, expansions[cheapest], None)
+        for query_token in query_tokens:
+            if query_token == cheapest or not scores:
+                continue
+            expansion = expansions[query_token]
+            if len(expansion) <= MAX_LOOKUP_EXPANSION:
+                matched = self._collect(query_token, expansion, scores)
+            else:
+                matched = {}
+                for product_id in scores:
+                    score = self._score(self._documents[product_id], query_token)
+                    if score:
+                        matched[product_id] = score
+            scores = {product_id: scores[product_id] + score for product_id, score in matched.items()}
+        for product_id in self._codes.get(''.join(query_tokens), ()):
+            if product_id in scores:
+                scores[product_id] += CODE_MATCH_BONUS
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [product_id for product_id, _ in best]
@@ -0,0 +1,112 @@
+"""Startup timing and background warm-up of the data stores.
+
+Stores load their data on first use, so a worker starts quickly however
+large the data files are, but the first request to each collection pays
+for reading it. With ``WARM_UP`` on, a background thread loads every
+collection (records, indexes and views), then runs the ``on_warm_up``
+hooks that build what stores leave for later (the product search index),
+as soon as a worker process starts serving. Later requests find them
+ready; a request that needs a store still loading simply waits for it
+rather than loading it twice.
+
+The warm-up runs in the worker process, never in a parent that will fork:
+a thread running at fork time could leave a store lock held forever in
+the child. It starts on the first request each process serves, or earlier
+from a server hook, e.g. in ``gunicorn.conf.py``::
+
+    def post_worker_init(worker):
+        from modules.startup import start_warm_up
+        start_warm_up()
+
+``report()`` holds how long each step of ``create_app`` and of the warm-up
+took in this process; the app serves it at ``/_startup``.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from .storage import all_stores
+
+logger = logging.getLogger(__name__)
+
+_phases = {}
+_warm_up = {'pid': None, 'thread': None, 'started': None, 'finished': None, 'steps': {}, 'errors': {}}
+_warm_up_lock = threading.Lock()
+_warm_up_hooks = []
+
+
+def on_warm_up(func):
+    """Also run ``func()`` in the warm-up, once every store has loaded.
+
+    For caches a store builds lazily, such as the product search index.
+    """
+    _warm_up_hooks.append(func)
+    return func
+
+
+@contextmanager
+def phase(name):
+    """Record how long the block takes as startup phase ``name``, in ms."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases[name] = round((time.perf_counter() - start) * 1000, 3)
+
+
+def _warm_up_stores(stores):
+    steps = [(collection.name, collection.ensure_exists) for collection in stores]
+    steps += [(f'{func.__module__}.{func.__name__}', func) for func in _warm_up_hooks]
+    for name, func in steps:
+        start = time.perf_counter()
+        try:
+            func()
+        except Exception as e:
+            # Left for the first request to load (and report) itself
+            logger.exception('Warm-up step %s failed', name)
+            _warm_up['errors'][name] = str(e)
+        _warm_up['steps'][name] = round((time.perf_counter() - start) * 1000, 3)
+    _warm_up['finished'] = time.time()
+    logger.info('Warmed up in %.1f ms: %s', sum(_warm_up['steps'].values()), _warm_up['steps'])
+
+
+def start_warm_up():
+    """Load every collection in a background thread, once per process.
+
+    Returns the thread (already started, or started by an earlier call).
+    """
+    with _warm_up_lock:
+        if _warm_up['pid'] != os.getpid():
+            # First call in this process; what a parent recorded doesn't apply
+            _warm_up.update(pid=os.getpid(), started=time.time(), finished=None, steps={}, errors={})
+            _warm_up['thread'] = threading.Thread(target=_warm_up_stores, args=(all_stores(),),
+                                                  name='store warm-up', daemon=True)
+            _warm_up['thread'].start()
+        return _warm_up['thread']
+
+
+def report():
+    """Startup phases and warm-up timings (ms) of this process, for ``/_startup``."""
+    warm_up = None
+    if _warm_up['pid'] == os.getpid():
+        warm_up = {
+            'done': _warm_up['finished'] is not None,
+            'ms': round((_warm_up['finished'] - _warm_up['started']) * 1000, 3) if _warm_up['finished'] else None,
+            'steps': dict(_warm_up['steps']),
+            'errors': dict(_warm_up['errors']),
+        }
+    return {'pid': os.getpid(), 'phases': dict(_phases), 'warm_up': warm_up}
+
+
+def init_app(app):
+    """Start the warm-up on the first request of each process if ``WARM_UP`` is on."""
+    if not app.config.get('WARM_UP'):
+        return
+
+    @app.before_request
+    def warm_up_stores():
+        # After the first request of a process this is one pid comparison
+        if _warm_up['pid'] != os.getpid():
+            start_warm_up()
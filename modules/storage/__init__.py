@@ -0,0 +1,118 @@
+import os
+
+from .errors import StorageError, CorruptDataError, DuplicateKeyError, ConflictError, ClosedPeriodError
+from .indexes import View, HashIndex, SortedIndex, UniqueIndex
+from .archive import PeriodArchive, ClosedPeriods, PERIOD_FIELD, is_closing, period_of, period_bounds, parse_period
+from .json_store import JsonStore
+from .sqlite_store import SqliteStore
+
+BACKENDS = ('json', 'sqlite')
+# Tries of a read-modify-write before giving up on records that keep changing
+MAX_WRITE_ATTEMPTS = 5
+SNAPSHOT_FORMATS = ('json', 'columnar')
+
+_settings = {'backend': 'json', 'sqlite_database': 'erp.sqlite3', 'snapshot_format': 'json', 'group_commit': None}
+
+# One store per data file, shared by every module that uses that file
+_stores = {}
+
+
+def retry_on_conflict(func, attempts=MAX_WRITE_ATTEMPTS):
+    """Call ``func()`` again while it raises ConflictError, and return its result.
+
+    For read-modify-writes: ``func`` reads the records it changes and
+    passes them as ``expected`` to ``write_batch``, so a change another
+    request or worker makes in between starts it over instead of being
+    overwritten. Raises the last ConflictError after ``attempts`` tries.
+    """
+    for attempt in range(attempts):
+        try:
+            return func()
+        except ConflictError:
+            if attempt == attempts - 1:
+                raise
+
+
+class Collection:
+    """A named collection whose backing store is chosen by ``configure``.
+
+    Models create their collection at import time, before the app config is
+    known, so the real store (``JsonStore`` or ``SqliteStore``) is only
+    built on first use. Every store method is available on the collection.
+    ``columns`` is the schema for columnar JSON snapshots, if the
+    collection supports them, and ``upgrade`` converts records saved by
+    older versions as they are read.
+    """
+
+    def __init__(self, path, indexes=(), views=(), columns=(), upgrade=None):
+        self.json_path = path
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.indexes = list(indexes)
+        self.views = list(views)
+        self.columns = list(columns)
+        self.upgrade = upgrade
+        self._store = None
+
+    @property
+    def store(self):
+        if self._store is None:
+            if _settings['backend'] == 'sqlite':
+                self._store = SqliteStore(_settings['sqlite_database'], self.name,
+                                          indexes=self.indexes, views=self.views, upgrade=self.upgrade,
+                                          group_commit=_settings['group_commit'])
+            else:
+                columnar = _settings['snapshot_format'] == 'columnar'
+                self._store = JsonStore(self.json_path, indexes=self.indexes, views=self.views,
+                                        columns=self.columns if columnar else None, upgrade=self.upgrade,
+                                        group_commit=_settings['group_commit'])
+        return self._store
+
+    def unbind(self):
+        self._store = None
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+
+def configure(backend='json', sqlite_database=None, snapshot_format=None, group_commit=None):
+    """Select the backend for every collection (``'json'`` or ``'sqlite'``).
+
+    ``snapshot_format`` picks how the JSON backend writes snapshots of the
+    collections that have a columnar schema: ``'json'`` or ``'columnar'``.
+    ``group_commit`` turns on group commit for every collection with the
+    given ``GroupCommitter`` options (e.g. ``{'max_batch': 64,
+    'max_delay': 0}``), or off with ``False``.
+    """
+    if backend not in BACKENDS:
+        raise StorageError(f"Unknown storage backend {backend!r}; expected one of {', '.join(BACKENDS)}")
+    if snapshot_format is not None and snapshot_format not in SNAPSHOT_FORMATS:
+        raise StorageError(f"Unknown snapshot format {snapshot_format!r}; "
+                           f"expected one of {', '.join(SNAPSHOT_FORMATS)}")
+    _settings['backend'] = backend
+    if sqlite_database:
+        _settings['sqlite_database'] = sqlite_database
+    if snapshot_format:
+        _settings['snapshot_format'] = snapshot_format
+    if group_commit is not None:
+        _settings['group_commit'] = dict(group_commit) if group_commit else None
+    # Collections already used (e.g. at import time) switch over on next use
+    for collection in _stores.values():
+        collection.unbind()
+
+
+def backend():
+    return _settings['backend']
+
+
+def get_store(path, indexes=(), views=(), columns=(), upgrade=None):
+    if path not in _stores:
+        _stores[path] = Collection(path, indexes=indexes, views=views, columns=columns, upgrade=upgrade)
+    return _stores[path]
+
+
+def all_stores():
+    return list(_stores.values())
+
+
+def cache_stats():
+    return [store.stats() for store in _stores.values()]
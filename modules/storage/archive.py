@@ -0,0 +1,310 @@
+"""Monthly periods of ledger collections, and archives of the closed ones.
+
+A ledger (records with a ``YYYY-MM-DD`` date, such as cash transactions
+or receivable entries) is split into one period per month. Open periods
+live in the collection as usual, where the date index finds any day's
+records without a scan. Closing a period freezes its records into a
+read-only segment file in ``<name>.archive/`` next to the data file, and
+replaces them in the collection with a single closing record::
+
+    {"id": "period:2024-03", "period": "2024-03", "records": 1234,
+     "counts": {"2024-03-01": 41, ...}, "summary": {...},
+     "segment": "2024-03.20240405093000000000.json",
+     "closed_at": "2024-04-05T09:30:00.000000"}
+
+``summary`` holds the figures the ledger's views precompute from those
+records (see ``RunningTotals`` and ``CustomerBalances``), so the views
+give the same totals as before the period was closed, without loading it.
+The swap is one store write, so every worker sees either the records or
+their closing record, never both. Each closing names its own segment,
+so a segment on disk never changes: closing a period again (to fold in
+records written to it late) writes a new one, and the old one is only
+removed once the new closing record is in place. Collections and their segments grow
+with the open periods only; a closed period's segment is read when a
+query asks for one of its days, and kept for the next one.
+
+The collection needs a ``SortedIndex`` on the date, a ``HashIndex`` on
+``PERIOD_FIELD`` (its ``None`` bucket lists the open records in order)
+and a ``ClosedPeriods`` view.
+"""
+import heapq
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from .errors import ClosedPeriodError, ConflictError
+from .indexes import View
+from .locking import FileLock, atomic_write
+
+logger = logging.getLogger(__name__)
+
+PERIOD_FIELD = 'period'
+# Closed periods whose records are kept in memory, per ledger
+SEGMENTS_CACHED = 4
+# Passes of close() before giving up on a period that keeps changing
+MAX_CLOSE_ATTEMPTS = 5
+
+
+def period_of(date_str):
+    """The period (``YYYY-MM``) of a ``YYYY-MM-DD`` date."""
+    return date_str[:7]
+
+
+def parse_period(value):
+    """Return ``value`` if it is a ``YYYY-MM`` period; raises ValueError otherwise."""
+    try:
+        if datetime.strptime(value, '%Y-%m').strftime('%Y-%m') == value:
+            return value
+    except (TypeError, ValueError):
+        pass
+    raise ValueError(f'{value!r} is not a period; use YYYY-MM.')
+
+
+def period_bounds(period):
+    # First and last possible date of the period, as range query bounds
+    return f'{period}-01', f'{period}-31'
+
+
+def closing_id(period):
+    return f'period:{period}'
+
+
+def is_closing(record):
+    """True for the closing record of a period rather than a ledger record."""
+    return record.get(PERIOD_FIELD) is not None
+
+
+class ClosedPeriods(View):
+    """The closing records of a ledger, by period.
+
+    Refuses, with ClosedPeriodError, a write of a record dated in a closed
+    period: its records are in a read-only segment.
+    """
+
+    def __init__(self, field='date'):
+        self.field = field
+        self.clear()
+
+    def clear(self):
+        self.periods = {}
+
+    def add(self, record):
+        if is_closing(record):
+            self.periods[record[PERIOD_FIELD]] = record
+
+    def remove(self, record):
+        if is_closing(record):
+            self.periods.pop(record[PERIOD_FIELD], None)
+
+    def check(self, record):
+        value = record.get(self.field)
+        if not is_closing(record) and isinstance(value, str) and period_of(value) in self.periods:
+            raise ClosedPeriodError(period_of(value))
+
+    def closed(self):
+        """The closing records, oldest period first."""
+        return [self.periods[period] for period in sorted(self.periods)]
+
+
+class PeriodArchive:
+    """Reads and closes the periods of a ledger ``collection``.
+
+    ``closed`` is the collection's ``ClosedPeriods`` view, and
+    ``summarize(records)`` returns the ``summary`` of a closing record.
+    Queries by date go to the collection for open periods and to the
+    segments for closed ones, so they only touch the periods they ask for.
+    """
+
+    def __init__(self, collection, closed, summarize, field='date'):
+        self.collection = collection
+        self.closed = closed
+        self.summarize = summarize
+        self.field = field
+        self.directory = os.path.splitext(collection.json_path)[0] + '.archive'
+        # closing record id -> (segment, records, records by date), most recent last
+        self._segments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def segment_path(self, closing):
+        return os.path.join(self.directory, closing['segment'])
+
+    def closed_periods(self):
+        """The closing records, oldest period first."""
+        return self.collection.read(self.closed.closed)
+
+    def closing(self, period):
+        """The closing record of ``period``, or None if it is open."""
+        return self.collection.read(lambda: self.closed.periods.get(period))
+
+    def is_closed(self, period):
+        return self.closing(period) is not None
+
+    def _segment(self, closing):
+        # Segment files never change, only which one a period's closing names
+        key = closing['id']
+        with self._lock:
+            cached = self._segments.get(key)
+            if cached is not None and cached[0] == closing['segment']:
+                self._segments.move_to_end(key)
+                return cached
+        try:
+            with open(self.segment_path(closing), 'rb') as f:
+                records = json.loads(f.read())
+        except FileNotFoundError:
+            # Replaced by a closing written since ``closing`` was read
+            current = self.closing(closing[PERIOD_FIELD])
+            if current is None or current['segment'] == closing['segment']:
+                raise
+            return self._segment(current)
+        upgrade = self.collection.upgrade
+        if upgrade is not None:
+            records = [upgrade(record) for record in records]
+        by_value = {}
+        for record in records:
+            by_value.setdefault(record.get(self.field), []).append(record)
+        cached = (closing['segment'], records, by_value)
+        with self._lock:
+            self._segments[key] = cached
+            self._segments.move_to_end(key)
+            while len(self._segments) > SEGMENTS_CACHED:
+                self._segments.popitem(last=False)
+        return cached
+
+    def records(self, period):
+        """The records of a closed ``period`` in date order; [] if it is open."""
+        closing = self.closing(period)
+        return self._segment(closing)[1] if closing else []
+
+    def page(self, period, offset, limit):
+        """``(records, total)`` for one slice of a closed period, like the store's ``page``."""
+        records = self.records(period)
+        return records[offset:offset + limit], len(records)
+
+    def find(self, value):
+        """The records dated ``value``, from whichever period holds them."""
+        closing = self.closing(period_of(value))
+        if closing is None:
+            return self.collection.find(self.field, value)
+        return list(self._segment(closing)[2].get(value, ()))
+
+    def _closed_between(self, low, high):
+        overlapping = []
+        for closing in self.closed_periods():
+            first, last = period_bounds(closing[PERIOD_FIELD])
+            if first <= high and last >= low:
+                overlapping.append(closing)
+        return overlapping
+
+    def find_range(self, low, high):
+        """The records dated within ``[low, high]``, in date order."""
+        chunks = [self.collection.find_range(self.field, low, high)]
+        for closing in self._closed_between(low, high):
+            chunks.append([record for record in self._segment(closing)[1] if low <= record[self.field] <= high])
+        return list(heapq.merge(*chunks, key=lambda record: record[self.field]))
+
+    def keys_between(self, low, high):
+        """The dates within ``[low, high]`` that have records, sorted.
+
+        Closed periods answer from their closing records' counts.
+        """
+        chunks = [self.collection.keys_between(self.field, low, high)]
+        for closing in self._closed_between(low, high):
+            chunks.append(sorted(value for value in closing['counts'] if low <= value <= high))
+        return list(heapq.merge(*chunks))
+
+    def open_page(self, offset, limit):
+        """``(records, total)`` for one slice of the open periods' records."""
+        return self.collection.page(offset, limit, PERIOD_FIELD, None)
+
+    def all(self):
+        """Every record: the closed periods' in period order, then the open ones."""
+        records = []
+        for closing in self.closed_periods():
+            records.extend(self._segment(closing)[1])
+        records.extend(self.collection.find(PERIOD_FIELD, None))
+        return records
+
+    def _closing_record(self, period, records):
+        counts = {}
+        for record in records:
+            counts[record[self.field]] = counts.get(record[self.field], 0) + 1
+        closed_at = datetime.now()
+        return {
+            'id': closing_id(period),
+            PERIOD_FIELD: period,
+            'records': len(records),
+            'counts': counts,
+            'summary': self.summarize(records),
+            'segment': f'{period}.{closed_at:%Y%m%d%H%M%S%f}.json',
+            'closed_at': closed_at.isoformat(timespec='microseconds'),
+        }
+
+    def _discard(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning('Could not remove segment %s: %s', path, e)
+
+    def close(self, period):
+        """Freeze the records of ``period`` into its segment.
+
+        Writes a new segment, then swaps the period's records (and its
+        previous closing record, if any) for the new closing record in one
+        write that fails with ConflictError if any of them changed since
+        they were read; the new segment is then dropped and the pass starts
+        over. After the swap the ``ClosedPeriods`` view refuses records
+        dated in the period; any written to it just before are folded in
+        by another pass. Returns the closing record, or None if the period
+        has no records.
+        """
+        low, high = period_bounds(period)
+        os.makedirs(self.directory, exist_ok=True)
+        # One closer at a time, from any process
+        with FileLock(os.path.join(self.directory, 'close.lock')).acquire():
+            for _ in range(MAX_CLOSE_ATTEMPTS):
+                closing = self.closing(period)
+                live = self.collection.find_range(self.field, low, high)
+                if not live:
+                    return closing
+                expected = list(live)
+                records = list(live)
+                if closing is not None:
+                    expected.append(closing)
+                    records = list(heapq.merge(self._segment(closing)[1], live, key=lambda r: r[self.field]))
+                new_closing = self._closing_record(period, records)
+                path = self.segment_path(new_closing)
+                atomic_write(path, json.dumps(records, separators=(',', ':')).encode('utf-8'))
+                swapped = False
+                try:
+                    self.collection.write_batch([new_closing], [record['id'] for record in live],
+                                                expected=expected)
+                    swapped = True
+                except ConflictError:
+                    continue
+                finally:
+                    if not swapped:
+                        self._discard(path)
+                if closing is not None:
+                    self._discard(self.segment_path(closing))
+                if not self.collection.find_range(self.field, low, high):
+                    return new_closing
+                # Records written to the period after it was read are
+                # still live; the next pass folds them in
+        raise ConflictError(f'{period} kept changing while it was being closed')
+
+    def close_before(self, before):
+        """Close every open period before ``before`` (``YYYY-MM``), oldest first.
+
+        Yields ``(period, records)`` as each one is closed.
+        """
+        first_open = f'{before}-01'
+        dates = self.collection.keys_between(self.field, '0000-01-01', first_open)
+        for period in sorted({period_of(value) for value in dates if value < first_open}):
+            closing = self.close(period)
+            if closing is not None:
+                yield period, closing['records']
@@ -0,0 +1,70 @@
+import os
+
+import click
+from flask.cli import AppGroup
+
+from . import SNAPSHOT_FORMATS, CorruptDataError, all_stores, backend
+
+storage_cli = AppGroup('storage', help='Maintain and check the data stores.')
+
+
+@storage_cli.command('compact')
+def compact_command():
+    """Fold every store's journal into a fresh snapshot (or checkpoint SQLite)."""
+    for store in all_stores():
+        if backend() == 'sqlite':
+            store.compact()
+            click.echo(f'{store.path}: checkpointed')
+            continue
+        before = store.stats()['journal_bytes']
+        store.compact()
+        click.echo(f'{store.path}: compacted {before} journal bytes')
+
+
+@storage_cli.command('convert')
+@click.argument('snapshot_format', type=click.Choice(SNAPSHOT_FORMATS))
+def convert_command(snapshot_format):
+    """Rewrite the ledgers' snapshots as JSON or columnar files.
+
+    Each new snapshot is read back and compared with the data it replaced.
+    """
+    from flask import current_app
+    if backend() == 'sqlite':
+        raise click.ClickException('Snapshots are only used by the JSON backend.')
+    for collection in all_stores():
+        if not collection.columns:
+            continue
+        try:
+            snapshot = collection.convert(collection.columns if snapshot_format == 'columnar' else None)
+        except CorruptDataError as e:
+            raise click.ClickException(f'{e}; run `flask storage convert json` to undo')
+        click.echo(f'{collection.name}: {snapshot} ({os.path.getsize(snapshot)} bytes)')
+    if current_app.config['SNAPSHOT_FORMAT'] != snapshot_format:
+        click.echo(f"Set SNAPSHOT_FORMAT = '{snapshot_format}' (or FLASK_SNAPSHOT_FORMAT={snapshot_format}) "
+                   f"to keep this format; compactions write the configured one.")
+
+
+@storage_cli.command('stress')
+@click.option('--workers', default=8, show_default=True, help='Writer processes.')
+@click.option('--writes', default=200, show_default=True, help='Inserts per process.')
+def stress_command(workers, writes):
+    """Check that parallel writers from several processes lose nothing."""
+    from .stress import run_stress
+    result = run_stress(workers=workers, writes=writes)
+    click.echo(f"{result['found']}/{result['expected']} records survived "
+               f"({result['compactions']} compactions) in {result['path']}")
+    if result['lost']:
+        raise click.ClickException(f"{len(result['lost'])} writes were lost")
+
+
+@storage_cli.command('migrate-to-sqlite')
+@click.option('--database', default=None, help='SQLite file to write (defaults to SQLITE_DATABASE).')
+@click.option('--batch-size', default=1000, show_default=True, help='Records per transaction.')
+def migrate_to_sqlite_command(database, batch_size):
+    """Bulk-import the JSON data files into a SQLite database."""
+    from flask import current_app
+    from .migrate import migrate_to_sqlite
+    database = database or current_app.config['SQLITE_DATABASE']
+    for name, count in migrate_to_sqlite(all_stores(), database, batch_size=batch_size):
+        click.echo(f'{name}: {count} records imported into {database}')
+    click.echo("Set STORAGE_BACKEND = 'sqlite' (or FLASK_STORAGE_BACKEND=sqlite) to use it.")
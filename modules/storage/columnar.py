@@ -0,0 +1,363 @@
+"""Compact columnar snapshots for ledger-like collections.
+
+A JSON snapshot spends most of its bytes on indentation and repeated keys,
+and loading it means parsing every one of them. A columnar snapshot stores
+each field of a fixed schema as one block instead:
+
+* ``uuid``   -- 16 bytes per id, stored as five blocks (one per group of
+  the canonical ``8-4-4-4-12`` form) so each group decodes in one call
+* ``date``   -- ``YYYY-MM-DD`` as a day ordinal (uint32)
+* ``fixed2`` -- floats with at most two decimals, as int64 hundredths
+* ``int``    -- int64
+* ``text``   -- a table of the distinct strings plus one small code per row
+  (1, 2 or 4 bytes depending on the table size), so repeated names,
+  concepts and types are stored and loaded once
+
+The file is memory-mapped on load and records are rebuilt a column at a
+time. Conversion is lossless: a record with other keys, another key order
+or a value its column cannot reproduce exactly is kept verbatim as JSON in
+an overflow block, at its original position.
+
+Layout: ``MAGIC``, a little-endian uint32 header length, the JSON header,
+then the blocks (8-byte aligned) at the offsets the header lists.
+"""
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import uuid
+from array import array
+from datetime import date
+from itertools import repeat
+
+from .errors import CorruptDataError
+
+MAGIC = b'JBRCOL\x00\x01'
+KINDS = ('uuid', 'date', 'fixed2', 'int', 'text')
+EXTENSION = '.col'
+
+_HEADER_LENGTH = struct.Struct('<I')
+# Byte ranges of the groups of a UUID's canonical text form
+_UUID_GROUPS = ((0, 4), (4, 6), (6, 8), (8, 10), (10, 16))
+_INT64_RANGE = (-2 ** 63, 2 ** 63)
+
+
+def columnar_path(json_path):
+    """Where the columnar snapshot of the collection in ``json_path`` lives."""
+    return os.path.splitext(json_path)[0] + EXTENSION
+
+
+class _Unfit(Exception):
+    """A value its column cannot store exactly."""
+
+
+def _encode_uuid(value):
+    if type(value) is not str:
+        raise _Unfit
+    try:
+        parsed = uuid.UUID(value)
+    except ValueError:
+        raise _Unfit
+    if str(parsed) != value:
+        raise _Unfit
+    return parsed.bytes
+
+
+def _encode_date(value):
+    if type(value) is not str or len(value) != 10:
+        raise _Unfit
+    try:
+        parsed = date.fromisoformat(value)
+    except ValueError:
+        raise _Unfit
+    if parsed.isoformat() != value:
+        raise _Unfit
+    return parsed.toordinal()
+
+
+def _encode_fixed2(value):
+    if type(value) is not float:
+        raise _Unfit
+    try:
+        hundredths = round(value * 100)
+    except (OverflowError, ValueError):  # inf, nan
+        raise _Unfit
+    # n / 100 is the float nearest to the decimal, so this holds exactly
+    # for every value with at most two decimals (but not for -0.0)
+    if hundredths / 100 != value or math.copysign(1, value) < 0 and not hundredths:
+        raise _Unfit
+    if not _INT64_RANGE[0] <= hundredths < _INT64_RANGE[1]:
+        raise _Unfit
+    return hundredths
+
+
+def _encode_int(value):
+    if type(value) is not int or not _INT64_RANGE[0] <= value < _INT64_RANGE[1]:
+        raise _Unfit
+    return value
+
+
+def _encode_text(value):
+    if type(value) is not str:
+        raise _Unfit
+    return value
+
+
+_ENCODERS = {
+    'uuid': _encode_uuid,
+    'date': _encode_date,
+    'fixed2': _encode_fixed2,
+    'int': _encode_int,
+    'text': _encode_text,
+}
+# Stored for rows kept in the overflow block
+_PLACEHOLDERS = {'uuid': bytes(16), 'date': 1, 'fixed2': 0, 'int': 0, 'text': ''}
+
+
+def _code_typecode(table_size):
+    for typecode in ('B', 'H', 'I'):
+        if table_size <= 1 << (8 * array(typecode).itemsize):
+            return typecode
+    raise ValueError('too many distinct strings for one column')
+
+
+def dumps(records, columns):
+    """Encode ``records`` as a columnar snapshot and return the bytes.
+
+    ``columns`` is a list of ``(field, kind)`` in the key order of the
+    records, with ``kind`` one of ``KINDS``.
+    """
+    names = [name for name, _ in columns]
+    for name, kind in columns:
+        if kind not in KINDS:
+            raise ValueError(f'Unknown column kind {kind!r} for {name}')
+    encoders = [_ENCODERS[kind] for _, kind in columns]
+    placeholders = [_PLACEHOLDERS[kind] for _, kind in columns]
+    values = [[] for _ in columns]
+    overflow = []
+    count = 0
+    for n, record in enumerate(records):
+        count += 1
+        try:
+            if list(record) != names:
+                raise _Unfit
+            row = [encode(record[name]) for encode, name in zip(encoders, names)]
+        except _Unfit:
+            overflow.append([n, record])
+            row = placeholders
+        for column, value in zip(values, row):
+            column.append(value)
+
+    blocks = []
+
+    def add_block(data):
+        blocks.append(data)
+        return len(blocks) - 1
+
+    header_columns = []
+    for (name, kind), column in zip(columns, values):
+        entry = {'name': name, 'kind': kind}
+        if kind == 'uuid':
+            entry['block'] = add_block(b''.join(value[start:end] for start, end in _UUID_GROUPS for value in column))
+        elif kind == 'date':
+            entry['typecode'] = 'I'
+            entry['block'] = add_block(array('I', column).tobytes())
+        elif kind in ('fixed2', 'int'):
+            entry['typecode'] = 'q'
+            entry['block'] = add_block(array('q', column).tobytes())
+        else:
+            table = {}
+            codes = [table.setdefault(value, len(table)) for value in column]
+            entry['typecode'] = _code_typecode(len(table))
+            entry['block'] = add_block(array(entry['typecode'], codes).tobytes())
+            entry['table'] = add_block(json.dumps(list(table), ensure_ascii=False).encode('utf-8'))
+        header_columns.append(entry)
+    overflow_block = add_block(json.dumps(overflow, ensure_ascii=False).encode('utf-8'))
+
+    # Block offsets are relative to the first block, so the header can be
+    # written before it is known where the blocks start
+    offsets = []
+    position = 0
+    for data in blocks:
+        offsets.append([position, len(data)])
+        position += len(data) + (-len(data) % 8)
+    header = json.dumps({
+        'count': count,
+        'byteorder': sys.byteorder,
+        'columns': header_columns,
+        'overflow': overflow_block,
+        'blocks': offsets,
+    }).encode('utf-8')
+    start = len(MAGIC) + _HEADER_LENGTH.size + len(header)
+    parts = [MAGIC, _HEADER_LENGTH.pack(len(header)), header, bytes(-start % 8)]
+    for data in blocks:
+        parts += [data, bytes(-len(data) % 8)]
+    return b''.join(parts)
+
+
+def _uuid_strings(data, count, rows=None):
+    # ``rows`` picks out single rows; by default every row is decoded
+    groups = []
+    offset = 0
+    for start, end in _UUID_GROUPS:
+        width = end - start
+        if rows is None:
+            groups.append(data[offset:offset + width * count].hex(' ', width).split())
+        else:
+            groups.append([data[offset + width * n:offset + width * (n + 1)].hex() for n in rows])
+        offset += width * count
+    return list(map('-'.join, zip(*groups)))
+
+
+class ColumnarSnapshot:
+    """A read-only record view over a memory-mapped columnar snapshot.
+
+    ``snapshot[i]`` builds one record straight from the mapped columns and
+    ``column(name)`` decodes a whole field at once; iterating yields every
+    record in order. Use it as a context manager, or call ``close``, to
+    release the mapping.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                raise CorruptDataError(f'{path} is empty; restore it from a backup or remove it')
+        self._buffer = memoryview(self._mmap)
+        # Set before parsing so close() works on a file that fails it
+        self._raw = {}
+        self._decoded = {}
+        try:
+            self._parse_header()
+        except (ValueError, KeyError, IndexError, TypeError, struct.error):
+            self.close()
+            raise CorruptDataError(f'{path} is not a valid columnar snapshot; restore it from a backup')
+
+    def _parse_header(self):
+        if bytes(self._buffer[:len(MAGIC)]) != MAGIC:
+            raise ValueError('bad magic')
+        (length,) = _HEADER_LENGTH.unpack_from(self._buffer, len(MAGIC))
+        header_start = len(MAGIC) + _HEADER_LENGTH.size
+        header = json.loads(bytes(self._buffer[header_start:header_start + length]))
+        data_start = header_start + length
+        data_start += -data_start % 8
+        self.count = header['count']
+        self._blocks = [(data_start + offset, size) for offset, size in header['blocks']]
+        if self._blocks and self._blocks[-1][0] + self._blocks[-1][1] > len(self._buffer):
+            raise ValueError('truncated')
+        self.columns = [(column['name'], column['kind']) for column in header['columns']]
+        self._fields = [name for name, _ in self.columns]
+        self._swap = header['byteorder'] != sys.byteorder
+        self._raw = {}
+        self._tables = {}
+        for column in header['columns']:
+            name, kind = column['name'], column['kind']
+            data = self._block(column['block'])
+            if kind == 'uuid':
+                self._raw[name] = data
+            else:
+                self._raw[name] = self._numbers(data, column['typecode'])
+            if kind == 'text':
+                self._tables[name] = json.loads(bytes(self._block(column['table'])))
+            if len(self._raw[name]) != self.count * (16 if kind == 'uuid' else 1):
+                raise ValueError(f'{name} has the wrong length')
+        self._overflow = {n: record for n, record in json.loads(bytes(self._block(header['overflow'])))}
+
+    def _block(self, index):
+        offset, size = self._blocks[index]
+        return self._buffer[offset:offset + size]
+
+    def _numbers(self, data, typecode):
+        if not self._swap:
+            # Zero-copy view of the mapped block
+            return data.cast(typecode)
+        numbers = array(typecode)
+        numbers.frombytes(data)
+        numbers.byteswap()
+        return numbers
+
+    def __len__(self):
+        return self.count
+
+    def column(self, name):
+        """Return every row's decoded value of ``name`` as a list."""
+        values = self._decoded.get(name)
+        if values is None:
+            kind = dict(self.columns)[name]
+            raw = self._raw[name]
+            if kind == 'uuid':
+                values = _uuid_strings(raw, self.count)
+            elif kind == 'date':
+                # Dates repeat a lot: decode each distinct day once
+                days = {ordinal: date.fromordinal(ordinal).isoformat() for ordinal in set(raw)}
+                values = list(map(days.__getitem__, raw))
+            elif kind == 'fixed2':
+                values = [n / 100 for n in raw]
+            elif kind == 'int':
+                values = list(raw)
+            else:
+                values = list(map(self._tables[name].__getitem__, raw))
+            self._decoded[name] = values
+        return values
+
+    def _value(self, name, kind, n):
+        raw = self._raw[name]
+        if kind == 'uuid':
+            return _uuid_strings(raw, self.count, rows=[n])[0]
+        if kind == 'date':
+            return date.fromordinal(raw[n]).isoformat()
+        if kind == 'fixed2':
+            return raw[n] / 100
+        if kind == 'int':
+            return raw[n]
+        return self._tables[name][raw[n]]
+
+    def __getitem__(self, n):
+        if n < 0:
+            n += self.count
+        if not 0 <= n < self.count:
+            raise IndexError(n)
+        if n in self._overflow:
+            return self._overflow[n]
+        return {name: self._value(name, kind, n) for name, kind in self.columns}
+
+    def records(self):
+        """Return every record, in order, as a list of dicts."""
+        if not self._fields:
+            records = [{} for _ in range(self.count)]
+        else:
+            # dict(zip(fields, row)) for every row, with the loop in C
+            rows = zip(*[self.column(name) for name in self._fields])
+            records = list(map(dict, map(zip, repeat(self._fields), rows)))
+        for n, record in self._overflow.items():
+            records[n] = record
+        return records
+
+    def __iter__(self):
+        return iter(self.records())
+
+    def close(self):
+        self._decoded = {}
+        # Every view into the mapping must be released before it can close
+        for raw in self._raw.values():
+            if isinstance(raw, memoryview):
+                raw.release()
+        self._raw = {}
+        self._buffer.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load_records(path):
+    """Return every record of the columnar snapshot at ``path`` as a list."""
+    with ColumnarSnapshot(path) as snapshot:
+        return snapshot.records()
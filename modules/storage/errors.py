@@ -0,0 +1,27 @@
+class StorageError(Exception):
+    """Base class for errors raised by the data stores."""
+
+
+class CorruptDataError(StorageError):
+    """A data file exists but cannot be read back as a list of records."""
+
+
+class DuplicateKeyError(StorageError):
+    """A write would give two records the same value for a unique field."""
+
+    def __init__(self, field, value):
+        super().__init__(f"{field} {value!r} is already in use")
+        self.field = field
+        self.value = value
+
+
+class ConflictError(StorageError):
+    """A record changed between being read and a write that depended on it."""
+
+
+class ClosedPeriodError(StorageError):
+    """A write is dated in a period whose records were archived."""
+
+    def __init__(self, period):
+        super().__init__(f"The period {period} is closed; its records can no longer be changed.")
+        self.period = period
@@ -0,0 +1,103 @@
+"""Change counters shared by every worker through a memory-mapped file.
+
+Each collection has a small ``.gen`` file next to its data holding a
+64-bit counter. Every write bumps it once the change is durable, and the
+file is mapped into each worker's memory, so checking whether anything
+changed since the last look is a read of shared memory rather than file
+stats or a query. Only when the counter moved does a store look at its
+files (or its change log) and catch up on what changed.
+
+Writes made without the counter (a restored backup, a hand edit, an
+older version of the app) are still picked up: a store also does the
+full check at least every ``RECHECK_SECONDS``.
+"""
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+from ..instrumentation import count
+from .locking import _lock_file, _unlock_file
+
+logger = logging.getLogger(__name__)
+
+RECHECK_SECONDS = 1.0
+
+_COUNTER = struct.Struct('<Q')
+
+
+class GenerationCounter:
+    """A counter in the file ``path``, shared by every process mapping it.
+
+    ``unchanged()`` is true while no bump happened since the last
+    ``caught_up()`` and ``RECHECK_SECONDS`` have not passed; stores call it
+    (under their own lock) first in every read and skip their own checks
+    if it holds. Writers bump it before releasing their write lock, so a
+    writer that takes the lock next always sees the bump. If the file
+    can't be created or mapped, ``unchanged()`` is always false and stores
+    check every time, as without it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+        self._map = None
+        self._failed = False
+        # The counter when the store last caught up, and when to recheck
+        self._seen = None
+        self._recheck_at = 0
+
+    def _mapped(self):
+        if self._map is None and not self._failed:
+            with self._lock:
+                if self._map is None and not self._failed:
+                    try:
+                        f = open(self.path, 'a+b')
+                        if os.fstat(f.fileno()).st_size < _COUNTER.size:
+                            # Zeros, if two workers get here at once
+                            f.truncate(_COUNTER.size)
+                        self._map = mmap.mmap(f.fileno(), _COUNTER.size)
+                        self._file = f
+                    except (OSError, ValueError):
+                        logger.warning('Cannot map %s; checking the data files on every read instead',
+                                       self.path, exc_info=True)
+                        self._failed = True
+        return self._map
+
+    def value(self):
+        """The current count, or None if the counter is not available."""
+        counter = self._mapped()
+        return None if counter is None else _COUNTER.unpack_from(counter)[0]
+
+    def bump(self):
+        """Count a write. Call it once the write is durable and visible."""
+        counter = self._mapped()
+        if counter is None:
+            return
+        # Writers of some stores are not serialized by a lock of their
+        # own, so the increment takes the file's lock
+        with self._lock:
+            _lock_file(self._file)
+            try:
+                _COUNTER.pack_into(counter, 0, (_COUNTER.unpack_from(counter)[0] + 1) % (1 << 64))
+            finally:
+                _unlock_file(self._file)
+        count('generation_bumps')
+
+    def unchanged(self):
+        """True if nothing was written since the last ``caught_up()``."""
+        return (self._seen is not None and time.monotonic() < self._recheck_at
+                and self._seen == self.value())
+
+    def caught_up(self, seen):
+        # ``seen`` is the value() read before the store's full check, so a
+        # write landing during the check is noticed next time
+        self._seen = seen
+        self._recheck_at = time.monotonic() + RECHECK_SECONDS
+
+    def forget(self):
+        """Make the next ``unchanged()`` false, e.g. after dropping cached state."""
+        self._seen = None
@@ -0,0 +1,105 @@
+"""Group commit: many writers, one flush.
+
+Each write to a store normally takes the file lock, appends and fsyncs on
+its own, so a burst of concurrent writes queues up behind one fsync each.
+With group commit a store hands its writes to a ``GroupCommitter``
+instead: one background thread takes every write queued while it was
+busy (up to ``max_batch`` of them) and commits them together with a
+single fsync. With ``max_delay`` it also waits that many seconds for
+more writes before committing; this rarely helps when fsync is slow,
+as the queue refills during the flush anyway. Each caller still blocks until its own
+write is durable, and gets back its own result or exception.
+"""
+import os
+import queue
+import threading
+import time
+
+DEFAULT_MAX_BATCH = 64
+DEFAULT_MAX_DELAY = 0
+
+
+class _Pending:
+    def __init__(self, job):
+        self.job = job
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class GroupCommitter:
+    """Runs ``commit(jobs)`` on a writer thread for jobs submitted from any thread.
+
+    ``commit`` receives the jobs of one batch, in submission order, and
+    returns one ``(result, error)`` pair per job; ``submit`` returns the
+    result or raises the error. If ``commit`` itself raises, every job of
+    the batch fails with that exception. The writer thread is started on
+    first use, and again in a forked worker process.
+    """
+
+    def __init__(self, commit, max_batch=DEFAULT_MAX_BATCH, max_delay=DEFAULT_MAX_DELAY, name='group-commit'):
+        if max_batch < 1 or max_delay < 0:
+            raise ValueError('max_batch must be at least 1 and max_delay not negative')
+        self._commit = commit
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.name = name
+        self._start_lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self.batches = 0
+        self.jobs = 0
+
+    def _started_queue(self):
+        with self._start_lock:
+            if self._pid != os.getpid():
+                # Threads don't survive a fork; neither may a queue's locks
+                self._queue = queue.SimpleQueue()
+                self._thread = threading.Thread(target=self._run, args=(self._queue,), name=self.name, daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+            return self._queue
+
+    def submit(self, job):
+        """Queue ``job`` for the next batch and wait until it is committed."""
+        if threading.current_thread() is self._thread:
+            # A write made while committing (e.g. from a view) can't wait
+            # for the batch it is part of
+            (result, error), = self._commit([job])
+        else:
+            pending = _Pending(job)
+            self._started_queue().put(pending)
+            pending.done.wait()
+            result, error = pending.result, pending.error
+        if error is not None:
+            raise error
+        return result
+
+    def _collect(self, jobs):
+        batch = [jobs.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(jobs.get(timeout=timeout) if timeout > 0 else jobs.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, jobs):
+        while True:
+            batch = self._collect(jobs)
+            try:
+                outcomes = self._commit([pending.job for pending in batch])
+            except BaseException as e:
+                outcomes = [(None, e)] * len(batch)
+            self.batches += 1
+            self.jobs += len(batch)
+            for pending, (result, error) in zip(batch, outcomes):
+                pending.result, pending.error = result, error
+                pending.done.set()
+
+    def stats(self):
+        return {'batches': self.batches, 'jobs': self.jobs,
+                'max_batch': self.max_batch, 'max_delay': self.max_delay}
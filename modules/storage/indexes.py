@@ -0,0 +1,135 @@
+import bisect
+import logging
+
+from .errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+class View:
+    """Derived state that a store keeps in step with its records.
+
+    The store calls ``clear`` and then ``add`` for every record when it
+    (re)loads, and ``replace``/``remove`` as each mutation is applied, so a
+    view never needs to rescan the collection. ``check`` may refuse a write
+    by raising a ``StorageError`` before it reaches the journal.
+    """
+
+    def clear(self):
+        raise NotImplementedError
+
+    def add(self, record):
+        raise NotImplementedError
+
+    def remove(self, record):
+        raise NotImplementedError
+
+    def replace(self, old, new):
+        self.remove(old)
+        self.add(new)
+
+    def check(self, record):
+        pass
+
+
+class HashIndex(View):
+    """Maps each value of ``field`` to the ids of the records holding it.
+
+    Ids are kept in insertion order, so a lookup returns records in the same
+    order a scan of the collection would.
+    """
+
+    def __init__(self, field):
+        self.field = field
+        self.clear()
+
+    def clear(self):
+        self._buckets = {}
+
+    def add(self, record):
+        self._buckets.setdefault(record.get(self.field), {})[record['id']] = None
+
+    def remove(self, record):
+        key = record.get(self.field)
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket.pop(record['id'], None)
+            if not bucket:
+                del self._buckets[key]
+
+    def replace(self, old, new):
+        # Keep the record's place in its bucket unless the key changed
+        if old.get(self.field) != new.get(self.field):
+            super().replace(old, new)
+
+    def ids(self, key):
+        return list(self._buckets.get(key, ()))
+
+    def iter_ids(self, key):
+        # Without copying the bucket; the caller holds the store's lock
+        return iter(self._buckets.get(key, ()))
+
+    def count(self, key):
+        return len(self._buckets.get(key, ()))
+
+    def keys(self):
+        return list(self._buckets)
+
+
+class SortedIndex(HashIndex):
+    """A ``HashIndex`` that also keeps its distinct values sorted.
+
+    ``keys_between`` finds the values in a range with a binary search, so
+    range queries cost O(log n + k) for k matching values. Records without a
+    value for ``field`` are only reachable through ``ids(None)``.
+    """
+
+    def clear(self):
+        super().clear()
+        self._sorted_keys = []
+
+    def add(self, record):
+        key = record.get(self.field)
+        if key is not None and key not in self._buckets:
+            bisect.insort(self._sorted_keys, key)
+        super().add(record)
+
+    def remove(self, record):
+        super().remove(record)
+        key = record.get(self.field)
+        if key is not None and key not in self._buckets:
+            i = bisect.bisect_left(self._sorted_keys, key)
+            if i < len(self._sorted_keys) and self._sorted_keys[i] == key:
+                del self._sorted_keys[i]
+
+    def keys_between(self, low, high):
+        """Return the indexed values ``v`` with ``low <= v <= high``, sorted."""
+        start = bisect.bisect_left(self._sorted_keys, low)
+        end = bisect.bisect_right(self._sorted_keys, high)
+        return self._sorted_keys[start:end]
+
+
+class UniqueIndex(HashIndex):
+    """A ``HashIndex`` whose values may belong to one record at most.
+
+    Records without a value for ``field`` are not indexed. Writes that would
+    reuse a taken value are refused with ``DuplicateKeyError``; duplicates
+    already on disk are tolerated (the last record wins) so old data files
+    still load.
+    """
+
+    def add(self, record):
+        key = record.get(self.field)
+        if key is None:
+            return
+        bucket = self._buckets.setdefault(key, {})
+        if bucket and record['id'] not in bucket:
+            logger.warning("Duplicate %s %r in stored data", self.field, key)
+            bucket.clear()
+        bucket[record['id']] = None
+
+    def check(self, record):
+        key = record.get(self.field)
+        owners = self._buckets.get(key, ())
+        if key is not None and any(owner != record['id'] for owner in owners):
+            raise DuplicateKeyError(self.field, key)
@@ -0,0 +1,622 @@
+import gc
+import itertools
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+from ..instrumentation import count, measured, timed
+from .columnar import columnar_path, dumps as columnar_dumps, load_records as load_columnar
+from .errors import ConflictError, CorruptDataError
+from .generations import GenerationCounter
+from .group_commit import GroupCommitter
+from .locking import FileLock, atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Journals smaller than this are never compacted automatically
+DEFAULT_COMPACT_THRESHOLD = 1024 * 1024
+
+# How often a reader retries when a compaction replaces the files under it
+_MAX_LOAD_ATTEMPTS = 5
+
+
+@contextmanager
+def _gc_paused():
+    # A load allocates a container per record and no cycles, so letting the
+    # cyclic collector rescan the growing heap meanwhile is wasted time.
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+def _stat_signature(path):
+    count('file_stats')
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _journal_line(entries):
+    entry = entries[0] if len(entries) == 1 else {'op': 'batch', 'entries': entries}
+    return json.dumps(entry, separators=(',', ':')) + '\n'
+
+
+class JsonStore:
+    """A JSON list file plus an append-only journal, kept parsed in memory.
+
+    ``path`` holds a snapshot (the same JSON list format the app has always
+    used) and ``path + '.journal'`` holds one compact JSON line per mutation
+    made since that snapshot::
+
+        {"op":"put","id":"...","payload":{...}}
+        {"op":"delete","id":"..."}
+
+    Writes append a single line, so their cost does not grow with the size
+    of the collection. Reads replay the journal over the snapshot once and
+    then only replay lines appended since the last read; nothing is re-read
+    while the files are unchanged on disk. Once the journal is larger than
+    both ``compact_threshold`` and the snapshot itself, it is folded into a
+    new snapshot, which keeps the amortized cost of a write constant.
+
+    Records are kept in a dict keyed by id, and ``indexes`` and other
+    ``views`` (see ``indexes.py``) are updated as each mutation is applied,
+    so lookups by id or by an indexed field never scan the collection.
+
+    The store is safe to share between threads and between processes (e.g.
+    several gunicorn workers). Writers serialize on ``path + '.lock'`` and
+    fsync each journal line before returning. Snapshots and fresh journals
+    are swapped in with an atomic rename, so readers never take the lock:
+    they detect a swap by inode and simply reload.
+
+    With ``columns`` (see ``columnar.py``) snapshots are written in the
+    compact columnar format instead, to ``<name>.col`` next to ``path``. A
+    snapshot in either format is read, so switching formats only takes
+    effect at the next compaction, which also removes the other file.
+
+    ``upgrade``, if given, is applied to every record read from disk to
+    bring records saved by older versions up to date; they are written back
+    in the new shape by the next compaction.
+
+    ``group_commit`` (a dict of ``GroupCommitter`` options, e.g.
+    ``{'max_batch': 64, 'max_delay': 0}``) funnels the writes of all
+    threads through one writer thread that appends each batch with a single
+    fsync; see ``group_commit.py``.
+    """
+
+    def __init__(self, path, indexes=(), views=(), compact_threshold=DEFAULT_COMPACT_THRESHOLD, columns=None,
+                 upgrade=None, group_commit=None):
+        self.path = path
+        self._upgrade = upgrade
+        self.columns = list(columns) if columns else None
+        self.columnar_path = columnar_path(path)
+        # The snapshot file the records were loaded from
+        self._snapshot_path = None
+        self._indexes = {index.field: index for index in indexes}
+        self._views = list(indexes) + list(views)
+        self.journal_path = path + '.journal'
+        self.compact_threshold = compact_threshold
+        self._records = {}
+        self._snapshot_signature = None
+        self._snapshot_size = 0
+        self._journal_inode = None
+        self._journal_offset = 0
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(path + '.lock')
+        # Bumped by every write, so reads can skip the stats; see generations.py
+        self._generations = GenerationCounter(path + '.gen')
+        self._group_commit = None
+        if group_commit is not None:
+            self._group_commit = GroupCommitter(self._commit_group, name=f'group-commit {path}', **group_commit)
+        self.hits = 0
+        self.misses = 0
+        self.replays = 0
+        self.compactions = 0
+
+    def _snapshot_paths(self):
+        # The format written by compactions first
+        if self.columns:
+            return self.columnar_path, self.path
+        return self.path, self.columnar_path
+
+    def _existing_snapshot_path(self):
+        for path in self._snapshot_paths():
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _read_snapshot(self, path):
+        if path == self.columnar_path:
+            try:
+                count('bytes_read', os.path.getsize(path))
+                with timed('json_parse'):
+                    records = load_columnar(path)
+            except FileNotFoundError:
+                return None
+            count('file_reads')
+            return records
+        try:
+            with open(path, 'rb') as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return None
+        count('file_reads')
+        count('bytes_read', len(raw))
+        if not raw.strip():
+            return []
+        try:
+            with timed('json_parse'):
+                data = json.loads(raw)
+        except ValueError:
+            data = None
+        if not isinstance(data, list):
+            raise CorruptDataError(
+                f"{path} is not a valid JSON list; restore it from a backup "
+                f"or move it aside to start with an empty collection")
+        return data
+
+    def _create_snapshot(self):
+        with self._file_lock.acquire():
+            if self._existing_snapshot_path() is None:
+                atomic_write(self.path, b'[]')
+                self._generations.bump()
+
+    def _load(self):
+        with _gc_paused():
+            self._load_snapshot_and_journal()
+
+    def _load_snapshot_and_journal(self):
+        for _ in range(_MAX_LOAD_ATTEMPTS):
+            path = self._existing_snapshot_path()
+            if path is None:
+                self._create_snapshot()
+                continue
+            signature = _stat_signature(path)
+            data = self._read_snapshot(path)
+            if data is None:
+                # Replaced by a snapshot in the other format meanwhile
+                continue
+            self._records = {}
+            for view in self._views:
+                view.clear()
+            for record in data:
+                self._put(record)
+            self._journal_inode = None
+            self._journal_offset = 0
+            self._replay_journal()
+            # A compaction that lands between reading the snapshot and the
+            # journal would make us miss the journal it folded in: retry.
+            if _stat_signature(path) == signature:
+                self._snapshot_path = path
+                self._snapshot_signature = signature
+                self._snapshot_size = signature[2]
+                return
+        raise CorruptDataError(f"{self.path} kept changing while it was being loaded")
+
+    def _replay_journal(self):
+        """Apply journal lines written since ``_journal_offset``.
+
+        Returns False if the journal was replaced since the last replay, in
+        which case nothing is applied and the caller must reload.
+        """
+        try:
+            with open(self.journal_path, 'rb') as f:
+                inode = os.fstat(f.fileno()).st_ino
+                if self._journal_inode is None:
+                    self._journal_inode = inode
+                elif inode != self._journal_inode:
+                    return False
+                f.seek(self._journal_offset)
+                chunk = f.read()
+        except FileNotFoundError:
+            return self._journal_inode is None
+        count('file_reads')
+        count('bytes_read', len(chunk))
+        # Only complete lines are applied; a line still being written is
+        # picked up on the next read.
+        end = chunk.rfind(b'\n') + 1
+        entries = []
+        with timed('json_parse'):
+            for line in chunk[:end].splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    logger.warning("Skipping unreadable journal line in %s", self.journal_path)
+        for entry in entries:
+            try:
+                self._apply(entry)
+            except KeyError:
+                logger.warning("Skipping unreadable journal line in %s", self.journal_path)
+        self._journal_offset += end
+        return True
+
+    def _put(self, record):
+        if self._upgrade is not None:
+            record = self._upgrade(record)
+        old = self._records.get(record['id'])
+        self._records[record['id']] = record
+        for view in self._views:
+            if old is None:
+                view.add(record)
+            else:
+                view.replace(old, record)
+
+    def _apply(self, entry):
+        if entry['op'] == 'batch':
+            for inner in entry['entries']:
+                self._apply(inner)
+        elif entry['op'] == 'put':
+            self._put(entry['payload'])
+        elif entry['op'] == 'delete':
+            old = self._records.pop(entry['id'], None)
+            if old is not None:
+                for view in self._views:
+                    view.remove(old)
+
+    def _check(self, record):
+        for view in self._views:
+            view.check(record)
+
+    def _refresh(self, full=False):
+        # Writers pass ``full``: the journal offset they append at must
+        # come from the file itself, even if someone wrote without bumping
+        if not full and self._generations.unchanged():
+            # Nothing written anywhere since the last check
+            self.hits += 1
+            return
+        seen = self._generations.value()
+        self._refresh_from_files()
+        self._generations.caught_up(seen)
+
+    @measured('storage_read')
+    def _refresh_from_files(self):
+        signature = _stat_signature(self._snapshot_path) if self._snapshot_path else None
+        if signature is None or signature != self._snapshot_signature:
+            self.misses += 1
+            self._load()
+            return
+        journal = _stat_signature(self.journal_path)
+        if journal is None:
+            if self._journal_inode is None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self._load()
+        elif self._journal_inode is not None and journal[0] != self._journal_inode:
+            # The journal was swapped out by a compaction elsewhere
+            self.misses += 1
+            self._load()
+        elif journal[2] == self._journal_offset:
+            self.hits += 1
+        else:
+            self.replays += 1
+            if not self._replay_journal():
+                self.misses += 1
+                self._load()
+
+    @measured('storage_write')
+    def _write(self, make_entries):
+        """Append the entries built by ``make_entries`` to the journal.
+
+        ``make_entries`` sees the latest records (including other processes'
+        writes) and returns a list of entries, possibly empty. Several
+        entries are wrapped in one ``batch`` line, so they are written with
+        a single append and fsync and a crash keeps all or none of them.
+        Returns the entries written.
+        """
+        if self._group_commit is not None:
+            return self._group_commit.submit(make_entries)
+        with self._file_lock.acquire():
+            with self._lock:
+                self._refresh(full=True)
+                entries = make_entries()
+                if not entries:
+                    return entries
+                end = self._journal_offset
+            self._append(end, _journal_line(entries).encode('utf-8'))
+            self._generations.bump()
+            with self._lock:
+                self._refresh()
+            self._compact_if_needed()
+            return entries
+
+    def _append(self, end, data):
+        # Caller holds the file lock; ``end`` is where the journal ends.
+        # Returns the journal's inode.
+        with open(self.journal_path, 'ab') as f:
+            if f.tell() > end:
+                # A writer crashed half-way through a line; drop it.
+                f.truncate(end)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            inode = os.fstat(f.fileno()).st_ino
+        count('file_writes')
+        count('bytes_written', len(data))
+        return inode
+
+    def _compact_if_needed(self):
+        # Caller holds the file lock
+        with self._lock:
+            needs_compaction = self._journal_offset > max(self.compact_threshold, self._snapshot_size)
+        if needs_compaction:
+            self._compact_locked()
+
+    def _commit_group(self, batch):
+        """Run a batch of ``_write`` calls and append their lines with one fsync.
+
+        Called on the group commit thread. Each ``make_entries`` sees the
+        changes of the ones before it, as if they had been written one by
+        one; one that raises fails alone. Readers in this process wait
+        until the batch is durable, so they never see a write that could
+        still be lost. Returns an ``(entries, error)`` pair per call.
+        """
+        outcomes = []
+        with self._file_lock.acquire():
+            with self._lock:
+                self._refresh(full=True)
+                end = self._journal_offset
+                lines = []
+                try:
+                    for make_entries in batch:
+                        try:
+                            entries = make_entries()
+                        except Exception as e:
+                            outcomes.append((None, e))
+                            continue
+                        outcomes.append((entries, None))
+                        if entries:
+                            line = _journal_line(entries)
+                            lines.append(line)
+                            # Applied from a parsed copy, exactly like a replay
+                            self._apply(json.loads(line))
+                    if lines:
+                        data = ''.join(lines).encode('utf-8')
+                        self._journal_inode = self._append(end, data)
+                        self._journal_offset = end + len(data)
+                        self._generations.bump()
+                except BaseException:
+                    # Forget the applied but unwritten changes: reload from disk
+                    self._snapshot_signature = None
+                    self._generations.forget()
+                    raise
+            self._compact_if_needed()
+        return outcomes
+
+    def ensure_exists(self):
+        with self._lock:
+            self._refresh()
+
+    def all(self):
+        with self._lock:
+            self._refresh()
+            return list(self._records.values())
+
+    def get(self, record_id):
+        with self._lock:
+            self._refresh()
+            return self._records.get(record_id)
+
+    def get_many(self, record_ids):
+        """Return the records for ``record_ids`` in that order, skipping unknown ids."""
+        with self._lock:
+            self._refresh()
+            return [self._records[i] for i in record_ids if i in self._records]
+
+    def read(self, func):
+        """Return ``func()`` called on up-to-date records and views.
+
+        Use this to read a view's state consistently with the records.
+        """
+        with self._lock:
+            self._refresh()
+            with timed('aggregate'):
+                return func()
+
+    def page(self, offset, limit, field=None, value=None):
+        """Return ``(records, total)`` for one slice of the collection.
+
+        With ``field``/``value`` the slice is taken from the matching records
+        of an indexed field. Only the requested slice is copied.
+        """
+        with self._lock:
+            self._refresh()
+            if field is None:
+                total = len(self._records)
+                records = list(itertools.islice(self._records.values(), offset, offset + limit))
+            else:
+                index = self._indexes[field]
+                total = index.count(value)
+                records = [self._records[record_id]
+                           for record_id in itertools.islice(index.iter_ids(value), offset, offset + limit)]
+            return records, total
+
+    def page_after(self, after, limit, field=None, value=None):
+        """Return ``(records, cursor)`` for up to ``limit`` records following the id ``after``.
+
+        Records come in the same order as ``page``; ``after=None`` starts
+        from the first one. ``cursor`` is the ``after`` to pass for the next
+        slice, or None once there are no more records. Unlike an offset, the
+        cursor does not shift when records before it are added or removed;
+        if the record ``after`` itself is gone, no records are returned.
+        """
+        with self._lock:
+            self._refresh()
+            ids = iter(self._records) if field is None else self._indexes[field].iter_ids(value)
+            if after is not None:
+                for record_id in ids:
+                    if record_id == after:
+                        break
+            window = list(itertools.islice(ids, limit + 1))
+            records = [self._records[record_id] for record_id in window[:limit]]
+            return records, (window[limit - 1] if len(window) > limit else None)
+
+    def find(self, field, value):
+        """Return the records whose indexed ``field`` equals ``value``."""
+        with self._lock:
+            self._refresh()
+            return [self._records[record_id] for record_id in self._indexes[field].ids(value)]
+
+    def find_range(self, field, low, high):
+        """Return the records whose ``field`` lies in ``[low, high]``.
+
+        ``field`` must have a ``SortedIndex``; records come out in key order.
+        """
+        with self._lock:
+            self._refresh()
+            index = self._indexes[field]
+            return [self._records[record_id]
+                    for key in index.keys_between(low, high)
+                    for record_id in index.ids(key)]
+
+    def keys(self, field):
+        """Return the distinct values of the indexed ``field``."""
+        with self._lock:
+            self._refresh()
+            return self._indexes[field].keys()
+
+    def keys_between(self, field, low, high):
+        with self._lock:
+            self._refresh()
+            return self._indexes[field].keys_between(low, high)
+
+    def find_one(self, field, value):
+        records = self.find(field, value)
+        return records[0] if records else None
+
+    def insert(self, record):
+        """Add ``record``; raises DuplicateKeyError if a unique index refuses it."""
+        def make_entries():
+            self._check(record)
+            return [{'op': 'put', 'id': record['id'], 'payload': record}]
+        self._write(make_entries)
+        return record
+
+    def put_many(self, records):
+        """Insert or replace ``records`` (matched by id) in one journal write."""
+        self.write_batch(records)
+        return records
+
+    def write_batch(self, puts=(), deletes=(), expected=()):
+        """Insert or replace ``puts`` and delete the ids in ``deletes`` atomically.
+
+        Every record is checked against the unique indexes first, and
+        nothing is written if one is refused. Records in the same batch must
+        not conflict with each other. Unknown ids in ``deletes`` are ignored.
+        The records in ``expected`` must still be stored exactly as given,
+        or ConflictError is raised and nothing is written.
+        """
+        def make_entries():
+            for record in expected:
+                if self._records.get(record['id']) != record:
+                    raise ConflictError(f"{record['id']} changed in {self.path}")
+            for record in puts:
+                self._check(record)
+            return ([{'op': 'put', 'id': record['id'], 'payload': record} for record in puts] +
+                    [{'op': 'delete', 'id': record_id} for record_id in deletes if record_id in self._records])
+        self._write(make_entries)
+
+    def update(self, record_id, changes):
+        """Apply ``changes`` to the record with ``record_id``.
+
+        Returns the updated record, or None if there is no such record.
+        """
+        def make_entries():
+            record = self._records.get(record_id)
+            if record is None:
+                return []
+            updated = dict(record, **changes)
+            self._check(updated)
+            return [{'op': 'put', 'id': record_id, 'payload': updated}]
+        entries = self._write(make_entries)
+        return entries[0]['payload'] if entries else None
+
+    def delete(self, record_id):
+        def make_entries():
+            if record_id not in self._records:
+                return []
+            return [{'op': 'delete', 'id': record_id}]
+        return bool(self._write(make_entries))
+
+    @measured('storage_write')
+    def _compact_locked(self):
+        # Caller holds the file lock
+        with self._lock:
+            self._refresh(full=True)
+            records = list(self._records.values())
+        target, other = self._snapshot_paths()
+        if self.columns:
+            atomic_write(target, columnar_dumps(records, self.columns))
+        else:
+            atomic_write(target, json.dumps(records, indent=4).encode('utf-8'))
+        # Removed before the journal is swapped: until then the old snapshot
+        # and journal still hold the same data as the new snapshot.
+        if os.path.exists(other):
+            os.remove(other)
+        # Swap in a new, empty journal rather than truncating the old one
+        # so readers can tell the two apart by inode.
+        atomic_write(self.journal_path, b'')
+        with self._lock:
+            self._snapshot_path = target
+            self._snapshot_signature = _stat_signature(target)
+            self._snapshot_size = self._snapshot_signature[2]
+            self._journal_inode = _stat_signature(self.journal_path)[0]
+            self._journal_offset = 0
+            self.compactions += 1
+        self._generations.bump()
+
+    def compact(self):
+        """Fold the journal into a new snapshot and start an empty journal."""
+        with self._file_lock.acquire():
+            self._compact_locked()
+
+    def convert(self, columns):
+        """Rewrite the snapshot as a columnar file with ``columns``, or as JSON if None.
+
+        The new snapshot is read back and compared with the records it
+        replaces, under the file lock so no write slips in between; raises
+        CorruptDataError if they differ. Returns the snapshot's path.
+        """
+        with self._file_lock.acquire():
+            expected = json.dumps(self.all())
+            self.columns = list(columns) if columns else None
+            self._compact_locked()
+            snapshot = self.stats()['snapshot']
+            if json.dumps(JsonStore(self.path, upgrade=self._upgrade).all()) != expected:
+                raise CorruptDataError(f'{snapshot} does not read back the same records')
+            return snapshot
+
+    def version(self):
+        """A token that changes whenever the stored data changes.
+
+        It is derived from the snapshot's identity and the journal length,
+        so every worker reading the same files reports the same version.
+        """
+        with self._lock:
+            self._refresh()
+            return '{:x}.{:x}.{:x}'.format(
+                self._snapshot_signature[0], self._snapshot_signature[1], self._journal_offset)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'path': self.path,
+                'snapshot': self._snapshot_path,
+                'records': len(self._records),
+                'hits': self.hits,
+                'misses': self.misses,
+                'replays': self.replays,
+                'compactions': self.compactions,
+                'journal_bytes': self._journal_offset,
+                'generation': self._generations.value(),
+                'group_commit': self._group_commit.stats() if self._group_commit else None,
+            }
@@ -0,0 +1,88 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from ..instrumentation import count, timed
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def _lock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class FileLock:
+    """An exclusive lock shared by every thread and process using ``path``.
+
+    Threads in the same process queue on a ``threading.RLock`` first so only
+    one of them at a time waits on the OS-level lock. The lock is re-entrant
+    for the thread holding it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._file = None
+        self._depth = 0
+
+    @contextmanager
+    def acquire(self):
+        # Time spent queueing here shows up as lock_wait in request timings
+        with timed('lock_wait'):
+            self._thread_lock.acquire()
+        try:
+            if self._depth == 0:
+                self._file = open(self.path, 'a+b')
+                with timed('lock_wait'):
+                    _lock_file(self._file)
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    _unlock_file(self._file)
+                    self._file.close()
+                    self._file = None
+        finally:
+            self._thread_lock.release()
+
+
+def atomic_write(path, data):
+    """Replace ``path`` with ``data`` (bytes) so readers never see a partial file.
+
+    The data goes to a temporary file in the same directory, is flushed to
+    disk and then renamed over ``path``.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp_path = f'{path}.tmp-{os.getpid()}-{threading.get_ident()}'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    count('file_writes')
+    count('bytes_written', len(data))
+    os.replace(tmp_path, path)
+    if hasattr(os, 'O_DIRECTORY'):
+        # Make the rename itself durable
+        fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
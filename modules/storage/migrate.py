@@ -0,0 +1,22 @@
+import os
+
+from .columnar import columnar_path
+from .json_store import JsonStore
+from .sqlite_store import SqliteStore
+
+
+def migrate_to_sqlite(collections, database, batch_size=1000):
+    """Copy every collection's JSON data into ``database``.
+
+    Records are written in batched transactions and keyed by id, so running
+    the migration again simply overwrites the same rows. Collections with
+    no snapshot (JSON or columnar) are skipped. Yields ``(name, count)`` per
+    collection.
+    """
+    for collection in collections:
+        if not (os.path.exists(collection.json_path) or os.path.exists(columnar_path(collection.json_path))):
+            yield collection.name, 0
+            continue
+        source = JsonStore(collection.json_path, upgrade=collection.upgrade)
+        target = SqliteStore(database, collection.name, indexes=collection.indexes)
+        yield collection.name, target.import_records(source.all(), batch_size=batch_size)
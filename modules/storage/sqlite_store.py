@@ -0,0 +1,552 @@
+import json
+import sqlite3
+import threading
+
+from .. import instrumentation
+from ..instrumentation import measured, timed
+from .errors import ConflictError, DuplicateKeyError, StorageError
+from .generations import GenerationCounter
+from .group_commit import GroupCommitter
+from .indexes import UniqueIndex
+
+# Change-log rows kept for other workers to catch up from
+CHANGES_KEPT = 10000
+
+
+def _dumps(record):
+    return json.dumps(record, separators=(',', ':'))
+
+
+def _count_statement(sql):
+    instrumentation.count('sql_statements')
+
+
+class _ConnectionPool(threading.local):
+    """One connection per thread and database file."""
+
+    def __init__(self):
+        self.connections = {}
+
+
+_pool = _ConnectionPool()
+
+
+def connect(db_path):
+    conn = _pool.connections.get(db_path)
+    if conn is None:
+        # Statements are parameterized constants, so sqlite3's per-connection
+        # statement cache prepares each of them only once.
+        conn = sqlite3.connect(db_path, isolation_level=None, timeout=30, cached_statements=256)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=FULL')
+        conn.execute('PRAGMA foreign_keys=ON')
+        if instrumentation.enabled():
+            conn.set_trace_callback(_count_statement)
+        _pool.connections[db_path] = conn
+    return conn
+
+
+class SqliteStore:
+    """A collection stored as JSON documents in one SQLite table.
+
+    Offers the same methods as ``JsonStore``. Lookups by id or by an indexed
+    field are answered by SQLite using expression indexes on the JSON
+    fields, so no records are held in memory. Views that are not indexes
+    (running totals, the search index) are still kept in memory: every
+    write also appends the old and new record to a change log, and each
+    worker replays log entries it has not seen before serving from its
+    views, so they stay current across processes without a rescan. A
+    counter shared through a file next to the database (see
+    ``generations.py``) tells a worker whether there is anything to replay
+    without a query.
+
+    ``upgrade`` is applied to every record read, and ``group_commit``
+    batches writes into shared transactions, like in ``JsonStore``.
+    """
+
+    def __init__(self, db_path, table, indexes=(), views=(), upgrade=None, group_commit=None):
+        self.db_path = db_path
+        self._upgrade = upgrade
+        self.table = table
+        self.path = f'{db_path}:{table}'
+        self._indexes = {index.field: index for index in indexes}
+        self._unique_fields = [index.field for index in indexes if isinstance(index, UniqueIndex)]
+        self._views = list(views)
+        self._lock = threading.RLock()
+        self._seen_generation = None
+        self._generations = GenerationCounter(f'{db_path}-{table}.gen')
+        self._group_commit = None
+        if group_commit is not None:
+            self._group_commit = GroupCommitter(self._commit_group, name=f'group-commit {self.path}', **group_commit)
+        self.hits = 0
+        self.misses = 0
+        self.replays = 0
+        self.compactions = 0
+        self._create_schema()
+
+    @property
+    def _conn(self):
+        return connect(self.db_path)
+
+    def _loads(self, data):
+        record = json.loads(data)
+        return record if self._upgrade is None else self._upgrade(record)
+
+    def _expr(self, field):
+        if field not in self._indexes:
+            raise KeyError(f'{field} is not indexed in {self.table}')
+        return f"json_extract(data, '$.{field}')"
+
+    def _match(self, field, value):
+        # "=" rather than "IS ?" so the partial unique indexes can be used
+        if value is None:
+            return f'{self._expr(field)} IS NULL', ()
+        return f'{self._expr(field)} = ?', (value,)
+
+    def _create_schema(self):
+        t = self.table
+        conn = self._conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(f'CREATE TABLE IF NOT EXISTS "{t}" ('
+                         'seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         'id TEXT NOT NULL UNIQUE, '
+                         'data TEXT NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS _generations ('
+                         'name TEXT PRIMARY KEY, generation INTEGER NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS _changes ('
+                         'name TEXT NOT NULL, generation INTEGER NOT NULL, '
+                         'op TEXT NOT NULL, old TEXT, new TEXT, '
+                         'PRIMARY KEY (name, generation))')
+            conn.execute('INSERT OR IGNORE INTO _generations VALUES (?, 0)', (t,))
+            for field in self._indexes:
+                expr = self._expr(field)
+                if field in self._unique_fields:
+                    conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "ux_{t}_{field}" '
+                                 f'ON "{t}"({expr}) WHERE {expr} IS NOT NULL')
+                else:
+                    conn.execute(f'CREATE INDEX IF NOT EXISTS "ix_{t}_{field}" ON "{t}"({expr}, seq)')
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    # -- in-memory views -------------------------------------------------
+
+    def _generation(self):
+        row = self._conn.execute('SELECT generation FROM _generations WHERE name = ?',
+                                 (self.table,)).fetchone()
+        return row[0]
+
+    def _rebuild_views(self, generation):
+        for view in self._views:
+            view.clear()
+        # Streamed rather than fetched at once to keep memory flat
+        for (data,) in self._conn.execute(f'SELECT data FROM "{self.table}" ORDER BY seq'):
+            record = self._loads(data)
+            for view in self._views:
+                view.add(record)
+        self._seen_generation = generation
+
+    def _refresh(self):
+        if not self._views:
+            return
+        if self._generations.unchanged():
+            # Nothing written by any worker since the last check
+            self.hits += 1
+            return
+        seen = self._generations.value()
+        self._refresh_from_log()
+        self._generations.caught_up(seen)
+
+    @measured('storage_read')
+    def _refresh_from_log(self):
+        conn = self._conn
+        conn.execute('BEGIN')
+        try:
+            self._catch_up(conn)
+        finally:
+            conn.execute('COMMIT')
+
+    def _catch_up(self, conn):
+        # Caller holds the lock and a transaction on ``conn``
+        if not self._views:
+            return
+        generation = self._generation()
+        if generation == self._seen_generation:
+            self.hits += 1
+            return
+        if self._seen_generation is None:
+            self.misses += 1
+            self._rebuild_views(generation)
+            return
+        changes = conn.execute(
+            'SELECT op, old, new FROM _changes WHERE name = ? AND generation > ? '
+            'ORDER BY generation', (self.table, self._seen_generation)).fetchall()
+        if len(changes) != generation - self._seen_generation:
+            # The log no longer reaches back far enough
+            self.misses += 1
+            self._rebuild_views(generation)
+            return
+        self.replays += 1
+        with timed('json_parse'):
+            changes = [(op, self._loads(old) if old else None, self._loads(new) if new else None)
+                       for op, old, new in changes]
+        self._apply_changes(changes)
+        self._seen_generation = generation
+
+    def _apply_changes(self, changes):
+        for op, old, new in changes:
+            for view in self._views:
+                if op == 'delete':
+                    view.remove(old)
+                elif old is None:
+                    view.add(new)
+                else:
+                    view.replace(old, new)
+
+    # -- writes ----------------------------------------------------------
+
+    def _check_unique(self, record):
+        for field in self._unique_fields:
+            value = record.get(field)
+            if value is None:
+                continue
+            row = self._conn.execute(
+                f'SELECT id FROM "{self.table}" WHERE {self._expr(field)} = ? AND id != ?',
+                (value, record['id'])).fetchone()
+            if row is not None:
+                raise DuplicateKeyError(field, value)
+        for view in self._views:
+            view.check(record)
+
+    @measured('storage_write')
+    def _write(self, mutate):
+        """Run ``mutate(conn)`` in a write transaction.
+
+        ``mutate`` returns a list of ``(op, old, new)`` changes it made,
+        possibly empty; they are logged and the generation bumped in the
+        same transaction. Returns that list. The views are caught up with
+        other workers' writes first, inside the transaction, so the checks
+        ``mutate`` runs against them see the latest records.
+        """
+        if self._group_commit is not None:
+            return self._group_commit.submit(mutate)
+        conn = self._conn
+        with timed('lock_wait'):
+            conn.execute('BEGIN IMMEDIATE')
+        try:
+            with self._lock:
+                self._catch_up(conn)
+                changes = mutate(conn)
+            if not changes:
+                conn.execute('ROLLBACK')
+                return changes
+            self._log_changes(conn, changes)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self._generations.bump()
+        with self._lock:
+            self._refresh()
+        return changes
+
+    def _log_changes(self, conn, changes):
+        generation = self._generation()
+        conn.executemany('INSERT INTO _changes VALUES (?, ?, ?, ?, ?)', [
+            (self.table, generation + n, op,
+             _dumps(old) if old is not None else None,
+             _dumps(new) if new is not None else None)
+            for n, (op, old, new) in enumerate(changes, 1)])
+        conn.execute('UPDATE _generations SET generation = ? WHERE name = ?',
+                     (generation + len(changes), self.table))
+        if generation // 1000 != (generation + len(changes)) // 1000:
+            conn.execute('DELETE FROM _changes WHERE name = ? AND generation <= ?',
+                         (self.table, generation - CHANGES_KEPT))
+        return generation + len(changes)
+
+    def _commit_group(self, batch):
+        """Run a batch of ``_write`` calls in one transaction (one fsync).
+
+        Called on the group commit thread. Each ``mutate`` runs in its own
+        savepoint, so one that raises is rolled back and fails alone, and
+        sees the changes of the ones before it, in the table and in the
+        views, as if they had been written one by one. Readers in this
+        process wait until the batch is committed. Returns a
+        ``(changes, error)`` pair per call.
+        """
+        conn = self._conn
+        outcomes = []
+        logged = []
+        with self._lock:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._catch_up(conn)
+                for mutate in batch:
+                    conn.execute('SAVEPOINT group_write')
+                    try:
+                        changes = mutate(conn)
+                    except Exception as e:
+                        conn.execute('ROLLBACK TO group_write')
+                        conn.execute('RELEASE group_write')
+                        outcomes.append((None, e))
+                        continue
+                    conn.execute('RELEASE group_write')
+                    outcomes.append((changes, None))
+                    logged.extend(changes)
+                    self._apply_changes(changes)
+                generation = self._log_changes(conn, logged) if logged else self._seen_generation
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                # Forget the applied but uncommitted changes: rebuild from the table
+                self._seen_generation = None
+                self._generations.forget()
+                raise
+            self._seen_generation = generation
+        if logged:
+            self._generations.bump()
+        return outcomes
+
+    def _fetch(self, conn, record_id):
+        with timed('storage_read'):
+            row = conn.execute(f'SELECT data FROM "{self.table}" WHERE id = ?', (record_id,)).fetchone()
+        if row is None:
+            return None
+        with timed('json_parse'):
+            return self._loads(row[0])
+
+    def _put(self, conn, record):
+        old = self._fetch(conn, record['id'])
+        self._check_unique(record)
+        conn.execute(f'INSERT INTO "{self.table}" (id, data) VALUES (?, ?) '
+                     'ON CONFLICT(id) DO UPDATE SET data = excluded.data',
+                     (record['id'], _dumps(record)))
+        return 'put', old, record
+
+    def insert(self, record):
+        def mutate(conn):
+            if self._fetch(conn, record['id']) is not None:
+                raise StorageError(f"{record['id']} already exists in {self.table}")
+            return [self._put(conn, record)]
+        self._write(mutate)
+        return record
+
+    def put_many(self, records):
+        """Insert or replace ``records`` (matched by id) in one transaction."""
+        self.write_batch(records)
+        return records
+
+    def write_batch(self, puts=(), deletes=(), expected=()):
+        """Insert or replace ``puts`` and delete the ids in ``deletes`` in one transaction.
+
+        Raises ConflictError, writing nothing, unless the records in
+        ``expected`` are still stored exactly as given.
+        """
+        def mutate(conn):
+            for record in expected:
+                if self._fetch(conn, record['id']) != record:
+                    raise ConflictError(f"{record['id']} changed in {self.path}")
+            changes = [self._put(conn, record) for record in puts]
+            for record_id in deletes:
+                change = self._remove(conn, record_id)
+                if change:
+                    changes.append(change)
+            return changes
+        self._write(mutate)
+
+    def update(self, record_id, changes):
+        def mutate(conn):
+            old = self._fetch(conn, record_id)
+            if old is None:
+                return []
+            return [self._put(conn, dict(old, **changes))]
+        written = self._write(mutate)
+        return written[0][2] if written else None
+
+    def _remove(self, conn, record_id):
+        old = self._fetch(conn, record_id)
+        if old is None:
+            return None
+        conn.execute(f'DELETE FROM "{self.table}" WHERE id = ?', (record_id,))
+        return 'delete', old, None
+
+    def delete(self, record_id):
+        def mutate(conn):
+            change = self._remove(conn, record_id)
+            return [change] if change else []
+        return bool(self._write(mutate))
+
+    def import_records(self, records, batch_size=1000):
+        """Bulk-load ``records`` (replacing any with the same id or unique key).
+
+        Each batch is one transaction. Workers rebuild their views afterwards
+        since the change log does not cover imported rows. Returns the number
+        of records written.
+        """
+        conn = self._conn
+        count = 0
+        batch = []
+
+        def flush():
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.executemany(f'INSERT OR REPLACE INTO "{self.table}" (id, data) VALUES (?, ?)',
+                                 [(r['id'], _dumps(r)) for r in batch])
+                self._bump_unlogged(conn)
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            self._generations.bump()
+
+        for record in records:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                flush()
+                count += len(batch)
+                batch = []
+        if batch:
+            flush()
+            count += len(batch)
+        return count
+
+    # -- reads -----------------------------------------------------------
+
+    def _records(self, sql, params=()):
+        with timed('storage_read'):
+            rows = self._conn.execute(sql, params).fetchall()
+        with timed('json_parse'):
+            return [self._loads(data) for (data,) in rows]
+
+    def ensure_exists(self):
+        with self._lock:
+            self._refresh()
+
+    def all(self):
+        return self._records(f'SELECT data FROM "{self.table}" ORDER BY seq')
+
+    def get(self, record_id):
+        return self._fetch(self._conn, record_id)
+
+    def get_many(self, record_ids):
+        record_ids = list(record_ids)
+        if not record_ids:
+            return []
+        found = {}
+        for start in range(0, len(record_ids), 500):
+            chunk = record_ids[start:start + 500]
+            marks = ','.join('?' * len(chunk))
+            for record in self._records(f'SELECT data FROM "{self.table}" WHERE id IN ({marks})', chunk):
+                found[record['id']] = record
+        return [found[i] for i in record_ids if i in found]
+
+    def read(self, func):
+        with self._lock:
+            self._refresh()
+            with timed('aggregate'):
+                return func()
+
+    @measured('storage_read')
+    def page(self, offset, limit, field=None, value=None):
+        t = self.table
+        if field is None:
+            total = self._conn.execute(f'SELECT COUNT(*) FROM "{t}"').fetchone()[0]
+            records = self._records(f'SELECT data FROM "{t}" ORDER BY seq LIMIT ? OFFSET ?',
+                                    (limit, offset))
+        else:
+            where, params = self._match(field, value)
+            total = self._conn.execute(f'SELECT COUNT(*) FROM "{t}" WHERE {where}', params).fetchone()[0]
+            records = self._records(f'SELECT data FROM "{t}" WHERE {where} ORDER BY seq LIMIT ? OFFSET ?',
+                                    params + (limit, offset))
+        return records, total
+
+    @measured('storage_read')
+    def page_after(self, after, limit, field=None, value=None):
+        t = self.table
+        where, params = ('1', ()) if field is None else self._match(field, value)
+        if after is not None:
+            # An unknown id gives NULL, which matches nothing
+            where += f' AND seq > (SELECT seq FROM "{t}" WHERE id = ?)'
+            params += (after,)
+        records = self._records(f'SELECT data FROM "{t}" WHERE {where} ORDER BY seq LIMIT ?',
+                                params + (limit + 1,))
+        if len(records) > limit:
+            return records[:limit], records[limit - 1]['id']
+        return records, None
+
+    def find(self, field, value):
+        where, params = self._match(field, value)
+        return self._records(f'SELECT data FROM "{self.table}" WHERE {where} ORDER BY seq', params)
+
+    def find_one(self, field, value):
+        records = self.find(field, value)
+        return records[0] if records else None
+
+    def find_range(self, field, low, high):
+        expr = self._expr(field)
+        return self._records(f'SELECT data FROM "{self.table}" WHERE {expr} BETWEEN ? AND ? '
+                             f'ORDER BY {expr}, seq', (low, high))
+
+    @measured('storage_read')
+    def keys(self, field):
+        expr = self._expr(field)
+        return [key for (key,) in self._conn.execute(f'SELECT DISTINCT {expr} FROM "{self.table}"')]
+
+    @measured('storage_read')
+    def keys_between(self, field, low, high):
+        expr = self._expr(field)
+        return [key for (key,) in self._conn.execute(
+            f'SELECT DISTINCT {expr} FROM "{self.table}" WHERE {expr} BETWEEN ? AND ? ORDER BY 1',
+            (low, high))]
+
+    # -- maintenance -----------------------------------------------------
+
+    def _bump_unlogged(self, conn):
+        # A generation step with no change row makes every worker rebuild
+        # its views from the table instead of replaying the log.
+        conn.execute('UPDATE _generations SET generation = generation + 1 WHERE name = ?',
+                     (self.table,))
+
+    def compact(self):
+        """Trim the change log and checkpoint the WAL into the database file.
+
+        Like a JSON compaction, this makes every worker rebuild its views.
+        """
+        conn = self._conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM _changes WHERE name = ? AND generation <= ?',
+                         (self.table, self._generation() - CHANGES_KEPT))
+            self._bump_unlogged(conn)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self._generations.bump()
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self.compactions += 1
+
+    def version(self):
+        if not self._views:
+            return str(self._generation())
+        # The generation the views caught up to, without a query if the
+        # shared counter has not moved
+        with self._lock:
+            self._refresh()
+            return str(self._seen_generation)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'path': self.path,
+                'records': self._conn.execute(f'SELECT COUNT(*) FROM "{self.table}"').fetchone()[0],
+                'hits': self.hits,
+                'misses': self.misses,
+                'replays': self.replays,
+                'compactions': self.compactions,
+                'generation': self._seen_generation,
+                'counter': self._generations.value(),
+                'group_commit': self._group_commit.stats() if self._group_commit else None,
+            }
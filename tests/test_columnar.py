@@ -0,0 +1,37 @@
+import pytest
+
+from modules.storage import CorruptDataError
+from modules.storage.columnar import dumps, load_records
+
+COLUMNS = [('id', 'uuid'), ('date', 'date'), ('concept', 'text'), ('amount_cents', 'int')]
+
+
+def _write(tmp_path, records):
+    path = tmp_path / 'ledger.col'
+    path.write_bytes(dumps(records, COLUMNS))
+    return str(path)
+
+
+def test_records_read_back_unchanged(tmp_path):
+    records = [{'id': '3f2b8c1e-9a4d-4e6f-8b1a-2c3d4e5f6a7b', 'date': '2026-10-01', 'concept': 'sale', 'amount_cents': 1050},
+               {'id': 'not-a-uuid', 'date': '2026-10-02', 'concept': 'Año', 'amount_cents': -5},
+               {'id': 'x', 'extra': True}]
+    assert load_records(_write(tmp_path, records)) == records
+
+
+def test_truncated_snapshot_is_reported_as_corrupt(tmp_path):
+    records = [{'id': str(n), 'date': '2026-10-01', 'concept': 'c%d' % n, 'amount_cents': n} for n in range(100)]
+    path = _write(tmp_path, records)
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:-64])
+    with pytest.raises(CorruptDataError):
+        load_records(path)
+
+
+def test_garbage_is_reported_as_corrupt(tmp_path):
+    path = tmp_path / 'ledger.col'
+    path.write_bytes(b'not a snapshot at all')
+    with pytest.raises(CorruptDataError):
+        load_records(str(path))
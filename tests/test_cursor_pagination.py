@@ -0,0 +1,26 @@
+from modules.storage import HashIndex, JsonStore
+
+
+def _pages(store, limit, **filters):
+    ids, after = [], None
+    while True:
+        records, after = store.page_after(after, limit, **filters)
+        ids.append([record['id'] for record in records])
+        if after is None:
+            return ids
+
+
+def test_cursor_walks_every_record_once(tmp_path):
+    store = JsonStore(str(tmp_path / 'products.json'), indexes=[HashIndex('series')])
+    store.put_many([{'id': 'p%02d' % n, 'series': 'a' if n % 2 else 'b'} for n in range(10)])
+    assert _pages(store, 4) == [['p00', 'p01', 'p02', 'p03'], ['p04', 'p05', 'p06', 'p07'], ['p08', 'p09']]
+    assert _pages(store, 5, field='series', value='a') == [['p01', 'p03', 'p05', 'p07', 'p09']]
+
+
+def test_cursor_does_not_shift_when_earlier_records_change(tmp_path):
+    store = JsonStore(str(tmp_path / 'products.json'))
+    store.put_many([{'id': 'p%d' % n} for n in range(6)])
+    first, after = store.page_after(None, 3)
+    store.delete('p0')
+    records, after = store.page_after(after, 3)
+    assert [record['id'] for record in records] == ['p3', 'p4', 'p5'] and after is None
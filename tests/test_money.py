@@ -0,0 +1,28 @@
+import pytest
+
+from modules.money import format_cents, to_cents, upgrade_amounts
+
+
+def test_amounts_round_half_up_to_the_cent():
+    assert to_cents('10.5') == 1050
+    assert to_cents(0.1) == 10
+    assert to_cents('2.675') == 268
+    assert to_cents('-0.005') == -1
+    with pytest.raises(ValueError):
+        to_cents('abc')
+
+
+def test_legacy_float_amounts_are_upgraded_in_place():
+    record = {'id': 'a', 'amount': 0.1 + 0.2, 'name': 'x'}
+    upgraded = upgrade_amounts(record, ('amount',))
+    assert list(upgraded) == ['id', 'amount_cents', 'name']
+    assert upgraded['amount_cents'] == 30
+    assert upgrade_amounts(upgraded, ('amount',)) is upgraded
+    # An unreadable amount is kept as it was
+    assert upgrade_amounts({'amount': 'n/a'}, ('amount',)) == {'amount': 'n/a'}
+
+
+def test_cents_are_formatted_without_floats():
+    assert format_cents(123450) == '1234.50'
+    assert format_cents(-5) == '-0.05'
+    assert format_cents(None) == ''
@@ -0,0 +1,9 @@
+from modules.storage.stress import run_stress
+
+
+def test_parallel_writers_lose_nothing(tmp_path):
+    # A tiny compaction threshold makes journal swaps race with the writers
+    result = run_stress(workers=4, writes=100, compact_threshold=2048, directory=str(tmp_path))
+    assert result['lost'] == []
+    assert result['found'] == result['expected'] == 400
+    assert result['compactions'] > 0